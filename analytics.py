@@ -0,0 +1,227 @@
+# --------------------------------------------------------------------------------------
+# Precomputed operations analytics for the results dashboard.
+# Vehicle status, job status and freight counts and the daily fuel / mileage series
+# come from one statement: narrow projections of fleet, orders and finance_trips are
+# stacked and aggregated in a single GROUPING SETS pass. The result is stored as a JSON
+# snapshot in `analytics_snapshots`, recomputed by one worker at a time when the
+# "orders", "fleet" or "finance" cache namespaces move on (i.e. after a write) or when
+# it is older than the refresh interval. Every worker keeps the serialized snapshot in
+# memory, so serving it never touches the database.
+# --------------------------------------------------------------------------------------
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date, timedelta
+
+from psycopg2.extras import Json
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_NAME = 'operations'
+# Arbitrary key for pg_try_advisory_xact_lock so only one worker recomputes at a time.
+REFRESH_LOCK_KEY = 7310416
+# Page cache namespaces whose writes make the snapshot stale.
+SOURCE_NAMESPACES = ('orders', 'fleet', 'finance')
+# The planner expects far more groups than the few dozen the pass produces; with the
+# default work_mem it sorts the stacked rows on disk instead of hashing them.
+REFRESH_WORK_MEM = '64MB'
+
+
+def create_analytics_tables(cur):
+    """Creates the table holding precomputed dashboard snapshots."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS analytics_snapshots (
+            name VARCHAR(50) PRIMARY KEY,
+            payload JSONB NOT NULL,
+            source_versions JSONB NOT NULL,
+            compute_ms DOUBLE PRECISION,
+            computed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+    """)
+
+
+def compute_operations(cur, fuel_days=30, today=None):
+    """The results dashboard's data from one grouped pass over fleet, orders and finance_trips."""
+    today = today or date.today()
+    first_day = today - timedelta(days=fuel_days - 1)
+    cur.execute("""
+        SELECT source, status, category, day, COUNT(*), SUM(litres), SUM(km),
+               GROUPING(status, category, day)
+        FROM (
+            SELECT 'vehicle' AS source, COALESCE(status, 'Unknown') AS status, NULL AS category,
+                   NULL::date AS day, NULL::float8 AS litres, NULL::float8 AS km
+            FROM fleet
+            UNION ALL
+            SELECT 'order', COALESCE(status, 'Unknown'), COALESCE(order_type, 'Unknown'), NULL, NULL, NULL
+            FROM orders
+            UNION ALL
+            SELECT 'trip', NULL, NULL, trip_date, fuel_liters, distance_km
+            FROM finance_trips
+            WHERE trip_date BETWEEN %s AND %s
+        ) AS facts
+        GROUP BY GROUPING SETS ((source, status), (source, category), (source, day))
+        ORDER BY source, status, category, day
+    """, (first_day, today))
+
+    # GROUPING() bits are (status, category, day); a set bit means "not grouped by".
+    by_status, by_category, by_day = 0b011, 0b101, 0b110
+    vehicle_status, job_status, freight, trips = [], [], [], {}
+    for source, status, category, day, count, litres, km, grouping in cur.fetchall():
+        if source == 'vehicle' and grouping == by_status:
+            vehicle_status.append({'status': status, 'count': count})
+        elif source == 'order' and grouping == by_status:
+            job_status.append({'status': status, 'count': count})
+        elif source == 'order' and grouping == by_category:
+            freight.append({'category': category, 'count': count})
+        elif source == 'trip' and grouping == by_day:
+            trips[day] = (litres or 0.0, km or 0.0)
+
+    days = [first_day + timedelta(days=i) for i in range(fuel_days)]
+    litres = [round(trips.get(d, (0.0, 0.0))[0], 1) for d in days]
+    mileage_days = [d for d in days if trips.get(d, (0.0, 0.0))[0] > 0]
+    return {
+        'vehicle_status': vehicle_status,
+        'job_status': job_status,
+        'freight': freight,
+        'fuel': {'date': [d.isoformat() for d in days], 'litres': litres},
+        'mileage': {'date': [d.isoformat() for d in mileage_days],
+                    'mileage': [round(trips[d][1] / trips[d][0], 2) for d in mileage_days]},
+        # No alarm or unload-time source is recorded yet; the charts render empty.
+        'alarms': {'date': [], 'alarms': []},
+        'unload': {'date': [], 'hours': []},
+    }
+
+
+class OperationsAnalytics:
+    """Keeps the operations snapshot current and its serialized JSON in memory."""
+
+    def __init__(self, db_pool, page_cache, refresh_interval=300.0, check_interval=5.0, fuel_days=30):
+        self.db_pool = db_pool
+        self.page_cache = page_cache
+        self.refresh_interval = refresh_interval
+        self.check_interval = check_interval
+        self.fuel_days = fuel_days
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._lock = threading.Lock()
+        self._snapshot = None      # (body bytes, etag, payload dict, source versions, computed_at epoch)
+        self.stats = {'refreshes': 0, 'skipped_refreshes': 0, 'loads': 0, 'served': 0, 'errors': 0,
+                      'last_compute_ms': None, 'last_refreshed_at': None}
+
+    def ensure_running(self):
+        """Starts the background refresh once per process (and again after a fork)."""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._run, name='analytics-refresh', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            try:
+                self.sync()
+            except Exception:
+                self.stats['errors'] += 1
+                logger.exception('Error refreshing operations analytics')
+            time.sleep(self.check_interval)
+
+    def _install(self, body, versions, computed_at):
+        payload = json.loads(body)
+        etag = hashlib.sha1(body).hexdigest()
+        with self._lock:
+            self._snapshot = (body, etag, payload, versions, computed_at)
+
+    def sync(self):
+        """Recomputes the snapshot if its sources changed or it aged out, else adopts a newer stored one."""
+        versions = self.page_cache.current_versions(SOURCE_NAMESPACES)
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT source_versions, EXTRACT(EPOCH FROM computed_at), EXTRACT(EPOCH FROM NOW() - computed_at)
+                    FROM analytics_snapshots WHERE name = %s
+                """, (SNAPSHOT_NAME,))
+                row = cur.fetchone()
+            conn.commit()
+        if row is None or row[0] != versions or row[2] >= self.refresh_interval:
+            return self.refresh(versions)
+        with self._lock:
+            current = self._snapshot[4] if self._snapshot else None
+        if current is None or current < float(row[1]):
+            self.load()
+        return False
+
+    def refresh(self, versions=None, wait=False):
+        """Recomputes and stores the snapshot.
+
+        Unless `wait` is set, returns False at once when another worker is
+        already recomputing it.
+        """
+        versions = versions if versions is not None else self.page_cache.current_versions(SOURCE_NAMESPACES)
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                if wait:
+                    cur.execute("SELECT pg_advisory_xact_lock(%s), true", (REFRESH_LOCK_KEY,))
+                else:
+                    cur.execute("SELECT true, pg_try_advisory_xact_lock(%s)", (REFRESH_LOCK_KEY,))
+                if not cur.fetchone()[1]:
+                    conn.rollback()
+                    self.stats['skipped_refreshes'] += 1
+                    return False
+                cur.execute("SET LOCAL work_mem = %s", (REFRESH_WORK_MEM,))
+                started = time.perf_counter()
+                payload = compute_operations(cur, self.fuel_days)
+                compute_ms = round((time.perf_counter() - started) * 1000, 1)
+                cur.execute("""
+                    INSERT INTO analytics_snapshots (name, payload, source_versions, compute_ms)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (name) DO UPDATE SET
+                        payload = EXCLUDED.payload, source_versions = EXCLUDED.source_versions,
+                        compute_ms = EXCLUDED.compute_ms, computed_at = NOW()
+                    RETURNING payload::text, EXTRACT(EPOCH FROM computed_at)
+                """, (SNAPSHOT_NAME, Json(payload), Json(versions), compute_ms))
+                body, computed_at = cur.fetchone()
+            conn.commit()
+        self._install(body.encode(), versions, float(computed_at))
+        self.stats['refreshes'] += 1
+        self.stats['last_compute_ms'] = compute_ms
+        self.stats['last_refreshed_at'] = time.time()
+        return True
+
+    def load(self):
+        """Reads the stored snapshot into memory; returns False if there is none yet."""
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT payload::text, source_versions, EXTRACT(EPOCH FROM computed_at)
+                    FROM analytics_snapshots WHERE name = %s
+                """, (SNAPSHOT_NAME,))
+                row = cur.fetchone()
+            conn.commit()
+        if row is None:
+            return False
+        self._install(row[0].encode(), row[1], float(row[2]))
+        self.stats['loads'] += 1
+        return True
+
+    def snapshot(self):
+        """(JSON body, ETag, payload) of the current snapshot, computing the first one if needed."""
+        with self._lock:
+            snapshot = self._snapshot
+        if snapshot is None:
+            if not self.load():
+                self.refresh(wait=True)
+            with self._lock:
+                snapshot = self._snapshot
+        self.stats['served'] += 1
+        return snapshot[0], snapshot[1], snapshot[2]
+
+    def metrics(self):
+        with self._lock:
+            computed_at = self._snapshot[4] if self._snapshot else None
+        return dict(self.stats, refresh_interval=self.refresh_interval,
+                    snapshot_age_seconds=round(time.time() - computed_at, 1) if computed_at else None)
@@ -0,0 +1,622 @@
+# --------------------------------------------------------------------------------------
+# Benchmark and load-test suite for the TMS application.
+# `run` seeds a disposable PostgreSQL database with synthetic fleet, driver and order
+# data at 1k / 100k / 1M orders, imports the app against it and drives /orders,
+# /fleet_master, /driver_master and /upload_orders twice: sequentially through Flask's
+# test client (server-side latency) and concurrently over HTTP against a threaded
+# server (latency under contention). p50/p95/p99 latency, throughput, peak RSS and SQL
+# statements per request go to a JSON baseline. `compare` diffs two baselines, and
+# `run --compare` diffs the new run against an old one; both exit 1 on a regression.
+#
+#   python benchmark.py run --scale 100k --output bench-100k.json
+#   python benchmark.py run --scale 100k --compare bench-100k.json
+#   python benchmark.py compare old.json new.json
+#
+# Without --dsn a scratch cluster is created with initdb/pg_ctl (from PATH or PG_BIN)
+# in a temporary directory and removed afterwards. A --dsn database is truncated, so it
+# must be empty or carry the marker table of an earlier benchmark run; anything else is
+# refused unless --i-know-this-is-scratch is given. The data is generated from the row
+# number alone, so every run at a given scale sees identical tables.
+# --------------------------------------------------------------------------------------
+
+import argparse
+import glob
+import http.client
+import io
+import itertools
+import json
+import os
+import platform
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+import psycopg2
+import psycopg2.extensions
+
+SCALES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+DEFAULT_THRESHOLD = 0.10
+# Latency changes smaller than this are noise on any machine, whatever the percentage.
+DEFAULT_MIN_DELTA_MS = 2.0
+BENCH_USER = 'bench'
+# Created in every database the benchmark seeds; only such databases are truncated again.
+MARKER_TABLE = 'tms_benchmark_marker'
+
+# Routes driven by both the test client and the HTTP load generator.
+SCENARIOS = [
+    ('GET /orders', 'GET', '/orders'),
+    ('GET /orders filtered', 'GET', '/orders?status=Pending&delivery_priority=High&sort=amount&direction=desc'),
+    ('GET /fleet_master', 'GET', '/fleet_master'),
+    ('GET /driver_master', 'GET', '/driver_master'),
+    ('POST /upload_orders', 'POST', '/upload_orders?format=json'),
+]
+
+# Tables the app expects but does not create itself (create_tables() adds the rest).
+BASE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users_tms (
+        id SERIAL PRIMARY KEY,
+        username VARCHAR(100) UNIQUE NOT NULL,
+        email VARCHAR(255),
+        password VARCHAR(255) NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS fleet (
+        vehicle_id VARCHAR(50) PRIMARY KEY,
+        vehicle_name VARCHAR(100),
+        make VARCHAR(50),
+        model VARCHAR(50),
+        vin VARCHAR(50),
+        type VARCHAR(50),
+        "group" VARCHAR(50),
+        status VARCHAR(20),
+        license_plate VARCHAR(20),
+        current_meter INTEGER,
+        capacity_weight_kg NUMERIC(10, 2),
+        capacity_vol_cbm NUMERIC(10, 2),
+        documents_expiry DATE,
+        driver_id VARCHAR(50),
+        date_of_join DATE,
+        avg NUMERIC(6, 2)
+    );
+    CREATE TABLE IF NOT EXISTS orders (
+        order_id VARCHAR(50) PRIMARY KEY,
+        customer_name VARCHAR(100),
+        created_date DATE,
+        order_type VARCHAR(50),
+        pickup_location_latlon VARCHAR(100),
+        drop_location_latlon VARCHAR(100),
+        volume_cbm NUMERIC(10, 2),
+        weight_kg NUMERIC(10, 2),
+        delivery_priority VARCHAR(20),
+        expected_delivery DATE,
+        amount NUMERIC(12, 2),
+        status VARCHAR(20)
+    );
+    CREATE TABLE IF NOT EXISTS driver_master (
+        driver_id VARCHAR(50) PRIMARY KEY,
+        driver_name VARCHAR(100) NOT NULL,
+        license_number VARCHAR(50) NOT NULL,
+        contact_number VARCHAR(20),
+        address TEXT,
+        availability VARCHAR(20),
+        shift_info VARCHAR(50),
+        vehicle_id VARCHAR(50),
+        aadhar_file VARCHAR(255),
+        license_file VARCHAR(255)
+    );
+"""
+
+# Synthetic rows are pure functions of the row number `i` and a fixed base date
+# (`%%` is a literal modulo, since these run with parameters).
+SEED_FLEET = """
+    INSERT INTO fleet
+    SELECT 'VEH' || lpad(i::text, 6, '0'), 'Truck ' || i,
+           (ARRAY['Tata', 'Ashok Leyland', 'Eicher', 'BharatBenz'])[1 + i %% 4],
+           (ARRAY['LPT 1613', 'Boss 1115', 'Pro 3015', '1617R'])[1 + i %% 4],
+           upper(substr(md5(i::text), 1, 17)),
+           (ARRAY['Truck', 'Trailer', 'Van'])[1 + i %% 3], 'Zone ' || (i %% 20),
+           CASE WHEN i %% 10 < 8 THEN 'Active' WHEN i %% 10 = 8 THEN 'Maintenance' ELSE 'Inactive' END,
+           'MH' || lpad((i %% 100)::text, 2, '0') || 'AB' || lpad(i::text, 6, '0'),
+           10000 + i * 37 %% 200000, 1000 + (i %% 10) * 1000, 10 + (i %% 10) * 5,
+           DATE '2026-01-01' + i %% 730, 'DRV' || lpad(i::text, 6, '0'), DATE '2026-01-01' - i %% 1000,
+           4 + i %% 8
+    FROM generate_series(1, %(vehicles)s) AS i
+"""
+SEED_DRIVERS = """
+    INSERT INTO driver_master
+    SELECT 'DRV' || lpad(i::text, 6, '0'), 'Driver ' || i, 'DL' || lpad(i::text, 10, '0'),
+           '9' || lpad(i::text, 9, '0'), 'Depot ' || (i %% 50),
+           (ARRAY['Available', 'On Trip', 'Off Duty'])[1 + i %% 3], (ARRAY['Day', 'Night'])[1 + i %% 2],
+           'VEH' || lpad(i::text, 6, '0'), NULL, NULL
+    FROM generate_series(1, %(drivers)s) AS i;
+    INSERT INTO driver_financials (driver_id, salary, bonus, last_paid_date)
+    SELECT 'DRV' || lpad(i::text, 6, '0'), 20000 + (i %% 20) * 1000, (i %% 5) * 500, DATE '2026-01-01' - i %% 30
+    FROM generate_series(1, %(drivers)s) AS i;
+"""
+SEED_ORDERS = """
+    INSERT INTO orders
+    SELECT 'ORD' || lpad(i::text, 8, '0'), 'Customer ' || (i * 7919 %% 5000),
+           DATE '2026-01-01' + i %% 365, (ARRAY['Standard', 'Express', 'Bulk'])[1 + i %% 3],
+           round(12 + (i * 37 %% 1600) / 100.0, 4) || ',' || round(72 + (i * 53 %% 1400) / 100.0, 4),
+           round(12 + (i * 41 %% 1600) / 100.0, 4) || ',' || round(72 + (i * 59 %% 1400) / 100.0, 4),
+           0.1 + (i * 13 %% 200) / 10.0, 5 + i * 17 %% 2000,
+           (ARRAY['Low', 'Medium', 'High', 'Urgent'])[1 + i * 3 %% 4],
+           DATE '2026-01-01' + i %% 365 + 1 + i %% 10, 500 + (i * 29 %% 50000) / 10.0,
+           CASE WHEN i %% 10 < 4 THEN 'Pending' WHEN i %% 10 < 6 THEN 'In Transit'
+                WHEN i %% 10 < 9 THEN 'Delivered' ELSE 'Cancelled' END
+    FROM generate_series(%(start)s, %(stop)s) AS i
+"""
+SEED_ORDER_BATCH = 200_000
+
+UPLOAD_HEADER = ('Order_ID,Customer_Name,created_date,Order_Type,Pickup_Location_LatLon,Drop_Location_LatLon,'
+                 'Volume_CBM,Weight_KG,Delivery_Priority,Expected_Delivery,amount,Status\n')
+
+
+# -------------------------- Database --------------------------
+
+def _find_pg_bin():
+    if os.environ.get('PG_BIN'):
+        return os.environ['PG_BIN']
+    initdb = shutil.which('initdb')
+    if initdb:
+        return os.path.dirname(initdb)
+    # Debian/Ubuntu keep the server binaries off PATH, one directory per major version.
+    candidates = glob.glob('/usr/lib/postgresql/*/bin/initdb')
+    if candidates:
+        return os.path.dirname(max(candidates, key=lambda p: int(p.split('/')[-3].split('.')[0])))
+    raise RuntimeError('initdb not found; set PG_BIN or pass --dsn to use an existing scratch database')
+
+
+@contextmanager
+def disposable_postgres():
+    """Starts a throwaway cluster in a temp directory; yields its connection settings.
+
+    Durability is switched off (fsync, synchronous_commit), which is fine for a
+    database that is deleted afterwards and keeps seeding fast.
+    """
+    pg_bin = _find_pg_bin()
+    root = tempfile.mkdtemp(prefix='tmsbench-')
+    data_dir = os.path.join(root, 'data')
+    options = (f"-k {root} -c listen_addresses='' -c fsync=off -c synchronous_commit=off "
+               f"-c full_page_writes=off -c max_connections=200")
+    try:
+        for command in (['initdb', '-D', data_dir, '-U', 'postgres', '-A', 'trust'],
+                        ['pg_ctl', '-D', data_dir, '-o', options, '-w', '-l', os.path.join(root, 'postgres.log'),
+                         'start']):
+            done = subprocess.run([os.path.join(pg_bin, command[0])] + command[1:], capture_output=True, text=True)
+            if done.returncode:
+                # initdb refuses to run as root, among other things; say why.
+                raise RuntimeError(f'{command[0]} failed: {(done.stderr or done.stdout).strip()}')
+        try:
+            yield {'host': root, 'user': 'postgres', 'password': '', 'database': 'postgres', 'port': 5432}
+        finally:
+            subprocess.run([os.path.join(pg_bin, 'pg_ctl'), '-D', data_dir, '-m', 'immediate', 'stop'],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def parse_dsn(dsn):
+    """A libpq URL or key=value string as a db_config dict."""
+    params = psycopg2.extensions.parse_dsn(dsn)
+    return {'host': params.get('host', 'localhost'), 'user': params.get('user', 'postgres'),
+            'password': params.get('password', ''), 'database': params.get('dbname', 'postgres'),
+            'port': int(params.get('port', 5432))}
+
+
+def _connect(config):
+    return psycopg2.connect(host=config['host'], user=config['user'], password=config['password'],
+                            dbname=config['database'], port=config['port'])
+
+
+def claim_scratch_database(config, force=False):
+    """Marks the database as the benchmark's own; refuses one that holds tables but no marker.
+
+    Seeding truncates the fleet, driver, order and user tables, so an existing
+    database is only accepted when it is empty or an earlier run marked it.
+    """
+    conn = _connect(config)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass(%s)", (MARKER_TABLE,))
+            marked = cur.fetchone()[0] is not None
+            cur.execute("""
+                SELECT count(*) FROM pg_class AS c JOIN pg_namespace AS n ON n.oid = c.relnamespace
+                WHERE c.relkind IN ('r', 'p') AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+                  AND n.nspname NOT LIKE 'pg_toast%%'
+            """)
+            tables = cur.fetchone()[0]
+            if not (marked or tables == 0 or force):
+                raise SystemExit(f"refusing to seed {config['database']} on {config['host']}: it has {tables} "
+                                 f"tables and no {MARKER_TABLE} table. Point --dsn at an empty scratch database "
+                                 f"or pass --i-know-this-is-scratch.")
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {MARKER_TABLE} (created_at TIMESTAMPTZ NOT NULL DEFAULT NOW())")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def create_base_tables(config):
+    conn = _connect(config)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(BASE_SCHEMA)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def seed(config, orders):
+    """Loads `orders` orders plus one vehicle and driver per 100 orders (at least 20)."""
+    vehicles = max(20, orders // 100)
+    started = time.perf_counter()
+    conn = _connect(config)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("TRUNCATE fleet, driver_master, driver_financials, orders, users_tms CASCADE")
+            cur.execute("INSERT INTO users_tms (username, email, password) VALUES (%s, %s, %s)",
+                        (BENCH_USER, 'bench@example.com', uuid.uuid4().hex))
+            cur.execute(SEED_FLEET, {'vehicles': vehicles})
+            cur.execute(SEED_DRIVERS, {'drivers': vehicles})
+            for start in range(1, orders + 1, SEED_ORDER_BATCH):
+                cur.execute(SEED_ORDERS, {'start': start, 'stop': min(start + SEED_ORDER_BATCH - 1, orders)})
+                conn.commit()
+        conn.commit()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("VACUUM ANALYZE")
+    finally:
+        conn.close()
+    return {'orders': orders, 'vehicles': vehicles, 'drivers': vehicles,
+            'seed_seconds': round(time.perf_counter() - started, 2)}
+
+
+# -------------------------- Measurement --------------------------
+
+def _current_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KiB on Linux and bytes on macOS; it is a lifetime peak either way.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class RssSampler:
+    """Tracks the peak resident set size of this process (app and load generator) while active."""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak_mb = _current_rss_mb()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, _current_rss_mb())
+
+
+_SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def summarize(latencies, errors, elapsed, peak_rss_mb, db_queries=None):
+    """Latency percentiles in milliseconds plus throughput for one scenario."""
+    ms = np.asarray(latencies, dtype=float) * 1000
+    result = {
+        'requests': int(len(ms)),
+        'errors': int(errors),
+        'p50_ms': round(float(np.percentile(ms, 50)), 2) if len(ms) else None,
+        'p95_ms': round(float(np.percentile(ms, 95)), 2) if len(ms) else None,
+        'p99_ms': round(float(np.percentile(ms, 99)), 2) if len(ms) else None,
+        'mean_ms': round(float(ms.mean()), 2) if len(ms) else None,
+        'throughput_rps': round(len(ms) / elapsed, 1) if elapsed > 0 else None,
+        'peak_rss_mb': round(peak_rss_mb, 1),
+    }
+    if db_queries:
+        result['db_queries_per_request'] = round(float(np.mean(db_queries)), 1)
+    return result
+
+
+def _upload_csv(rows, counter):
+    """An orders CSV of `rows` new orders with IDs unique to this upload."""
+    batch = next(counter)
+    buffer = io.StringIO()
+    buffer.write(UPLOAD_HEADER)
+    for i in range(rows):
+        buffer.write(f'UPL{batch:05d}{i:06d},Bench Customer {i % 50},2026-03-01,Standard,"19.07,72.87",'
+                     f'"28.70,77.10",{1 + i % 20},{100 + i % 900},Medium,2026-03-05,{1000 + i},Pending\n')
+    return buffer.getvalue().encode()
+
+
+# -------------------------- Drivers --------------------------
+
+def run_test_client(app, scenarios, iterations, warmup, upload_rows):
+    """Requests each scenario `iterations` times in sequence through Flask's test client."""
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user'] = BENCH_USER
+    counter = itertools.count()
+    results = {}
+    for name, method, path in scenarios:
+        def request():
+            if method == 'POST':
+                data = {'orders_file': (io.BytesIO(_upload_csv(upload_rows, counter)), 'bench.csv')}
+                return client.post(path, data=data, content_type='multipart/form-data')
+            return client.get(path)
+
+        for _ in range(warmup):
+            request()
+        latencies, db_queries, errors = [], [], 0
+        with RssSampler() as rss:
+            started = time.perf_counter()
+            for _ in range(iterations):
+                t = time.perf_counter()
+                response = request()
+                response.get_data()
+                latencies.append(time.perf_counter() - t)
+                errors += response.status_code >= 400
+                match = _SERVER_TIMING_QUERIES.search(response.headers.get('Server-Timing', ''))
+                if match:
+                    db_queries.append(int(match.group(1)))
+            elapsed = time.perf_counter() - started
+        results[f'test_client {name}'] = summarize(latencies, errors, elapsed, rss.peak_mb, db_queries)
+        print(f'  test_client {name}: p95 {results[f"test_client {name}"]["p95_ms"]} ms')
+    return results
+
+
+def _multipart(payload, boundary):
+    return (f'--{boundary}\r\nContent-Disposition: form-data; name="orders_file"; filename="bench.csv"\r\n'
+            f'Content-Type: text/csv\r\n\r\n').encode() + payload + f'\r\n--{boundary}--\r\n'.encode()
+
+
+def run_http_load(app, scenarios, requests_per_scenario, concurrency, upload_rows):
+    """Sends each scenario's requests from `concurrency` keep-alive clients to a threaded server."""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    port = server.server_port
+    cookie = 'session=' + app.session_interface.get_signing_serializer(app).dumps({'user': BENCH_USER})
+    counter = itertools.count(10_000)
+    results = {}
+    try:
+        for name, method, path in scenarios:
+            remaining = itertools.count()
+            lock = threading.Lock()
+            latencies, errors = [], [0]
+
+            def worker():
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+                local = []
+                while next(remaining) < requests_per_scenario:
+                    headers = {'Cookie': cookie}
+                    body = None
+                    if method == 'POST':
+                        boundary = uuid.uuid4().hex
+                        body = _multipart(_upload_csv(upload_rows, counter), boundary)
+                        headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
+                    t = time.perf_counter()
+                    try:
+                        conn.request(method, path, body=body, headers=headers)
+                        response = conn.getresponse()
+                        response.read()
+                        failed = response.status >= 400
+                    except (OSError, http.client.HTTPException):
+                        conn.close()
+                        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+                        failed = True
+                    local.append(time.perf_counter() - t)
+                    if failed:
+                        with lock:
+                            errors[0] += 1
+                conn.close()
+                with lock:
+                    latencies.extend(local)
+
+            with RssSampler() as rss:
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    for future in [pool.submit(worker) for _ in range(concurrency)]:
+                        future.result()
+                elapsed = time.perf_counter() - started
+            key = f'http c={concurrency} {name}'
+            results[key] = summarize(latencies, errors[0], elapsed, rss.peak_mb)
+            print(f'  {key}: p95 {results[key]["p95_ms"]} ms, {results[key]["throughput_rps"]} req/s')
+    finally:
+        server.shutdown()
+        server_thread.join()
+    return results
+
+
+def wait_for_imports(db_pool, timeout):
+    """Blocks until the upload scenarios' background imports have drained."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT count(*) FROM import_jobs WHERE status IN ('queued', 'running')")
+                if cur.fetchone()[0] == 0:
+                    return True
+        time.sleep(0.5)
+    return False
+
+
+# -------------------------- Baselines --------------------------
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(old, new, threshold=DEFAULT_THRESHOLD, min_delta_ms=DEFAULT_MIN_DELTA_MS):
+    """Returns (rows, regressions) comparing scenarios present in both baselines.
+
+    A scenario regresses when p95 or p99 grows by more than `threshold` (and by at
+    least `min_delta_ms`), throughput drops by more than `threshold`, peak RSS grows
+    by more than `threshold`, or it returns errors it did not return before.
+    """
+    rows, regressions = [], []
+    for name in sorted(set(old['results']) & set(new['results'])):
+        before, after = old['results'][name], new['results'][name]
+        problems = []
+        for metric in ('p95_ms', 'p99_ms'):
+            if before.get(metric) and after.get(metric) is not None:
+                delta = after[metric] - before[metric]
+                if delta > before[metric] * threshold and delta >= min_delta_ms:
+                    problems.append(f'{metric} {before[metric]} -> {after[metric]}')
+        if before.get('throughput_rps') and after.get('throughput_rps') is not None:
+            if after['throughput_rps'] < before['throughput_rps'] * (1 - threshold):
+                problems.append(f"throughput {before['throughput_rps']} -> {after['throughput_rps']} req/s")
+        if before.get('peak_rss_mb') and after.get('peak_rss_mb', 0) > before['peak_rss_mb'] * (1 + threshold):
+            problems.append(f"peak RSS {before['peak_rss_mb']} -> {after['peak_rss_mb']} MB")
+        if after.get('errors', 0) > before.get('errors', 0):
+            problems.append(f"errors {before.get('errors', 0)} -> {after['errors']}")
+        rows.append((name, before, after, problems))
+        if problems:
+            regressions.append((name, problems))
+    return rows, regressions
+
+
+def print_comparison(old, new, threshold, min_delta_ms):
+    if old['meta'].get('scale') != new['meta'].get('scale'):
+        print(f"warning: comparing scale {old['meta'].get('scale')} against {new['meta'].get('scale')}")
+    rows, regressions = compare(old, new, threshold, min_delta_ms)
+    print(f"{'scenario':<44} {'p95 ms':>22} {'p99 ms':>22} {'req/s':>20}")
+    for name, before, after, problems in rows:
+        cells = [f"{before[m]} -> {after[m]}" for m in ('p95_ms', 'p99_ms', 'throughput_rps')]
+        print(f"{name:<44} {cells[0]:>22} {cells[1]:>22} {cells[2]:>20}{'  REGRESSION' if problems else ''}")
+    for name, problems in regressions:
+        print(f'regression in {name}: ' + '; '.join(problems))
+    if not regressions:
+        print(f'no regressions beyond {threshold:.0%}')
+    return regressions
+
+
+# -------------------------- Command line --------------------------
+
+@contextmanager
+def _existing(config):
+    yield config
+
+
+def run(args):
+    orders = SCALES[args.scale]
+    with (disposable_postgres() if not args.dsn else _existing(parse_dsn(args.dsn))) as config:
+        # The app reads DB_* and its tuning knobs at import time.
+        os.environ.update({'DB_HOST': config['host'], 'DB_USER': config['user'],
+                           'DB_PASSWORD': config['password'], 'DB_NAME': config['database'],
+                           'DB_PORT': str(config['port'])})
+        os.environ.setdefault('DB_POOL_MAX', str(max(10, args.concurrency + 4)))
+        if args.cold:
+            os.environ['PAGE_CACHE_TTL'] = '0'
+        claim_scratch_database(config, force=args.i_know_this_is_scratch)
+        create_base_tables(config)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import app as tms
+
+        print(f'seeding {args.scale} orders...')
+        data = seed(config, orders)
+        tms.page_cache.invalidate('orders', 'fleet', 'drivers')
+        print(f"  {data['orders']} orders, {data['vehicles']} vehicles in {data['seed_seconds']} s")
+
+        scenarios = [s for s in SCENARIOS if not args.only or any(o in s[0] for o in args.only)]
+        results = run_test_client(tms.app, scenarios, args.iterations, args.warmup, args.upload_rows)
+        # Uploads return once queued; let their imports finish so they don't load the next phase.
+        wait_for_imports(tms.db_pool, timeout=600)
+        if args.concurrency > 0:
+            results.update(run_http_load(tms.app, scenarios, args.requests, args.concurrency, args.upload_rows))
+        wait_for_imports(tms.db_pool, timeout=600)
+
+    baseline = {
+        'meta': dict(data, scale=args.scale, iterations=args.iterations, http_requests=args.requests,
+                     concurrency=args.concurrency, cold_page_cache=args.cold, upload_rows=args.upload_rows,
+                     git_commit=_git_commit(), python=platform.python_version(), platform=platform.platform(),
+                     cpus=os.cpu_count(), created_at=datetime.now(timezone.utc).isoformat(timespec='seconds')),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'baseline written to {args.output}')
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if print_comparison(old, baseline, args.threshold, args.min_delta_ms):
+            return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the TMS routes against a scratch PostgreSQL database.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='seed a scratch database and benchmark the routes')
+    run_parser.add_argument('--scale', choices=SCALES, default='1k', help='number of orders to seed')
+    run_parser.add_argument('--dsn', help='libpq URL or key=value string of an existing scratch database '
+                                          '(its fleet, driver and order tables are truncated)')
+    run_parser.add_argument('--i-know-this-is-scratch', action='store_true',
+                            help='seed a --dsn database even if it holds tables and no benchmark marker')
+    run_parser.add_argument('--iterations', type=int, default=50, help='test-client requests per scenario')
+    run_parser.add_argument('--warmup', type=int, default=3, help='unmeasured test-client requests per scenario')
+    run_parser.add_argument('--requests', type=int, default=200, help='HTTP requests per scenario')
+    run_parser.add_argument('--concurrency', type=int, default=16, help='concurrent HTTP clients (0 skips HTTP)')
+    run_parser.add_argument('--upload-rows', type=int, default=1000, help='orders per uploaded CSV')
+    run_parser.add_argument('--only', nargs='*', help='run only scenarios whose name contains one of these')
+    run_parser.add_argument('--cold', action='store_true', help='disable the page cache (PAGE_CACHE_TTL=0)')
+    run_parser.add_argument('--output', help='write the baseline JSON here')
+    run_parser.add_argument('--compare', help='baseline JSON to compare this run against')
+
+    compare_parser = commands.add_parser('compare', help='compare two baseline files')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+
+    for p in (run_parser, compare_parser):
+        p.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                       help='relative change that counts as a regression (default 0.10)')
+        p.add_argument('--min-delta-ms', type=float, default=DEFAULT_MIN_DELTA_MS,
+                       help='ignore latency changes smaller than this (default 2 ms)')
+
+    args = parser.parse_args(argv)
+    if args.command == 'compare':
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        return 1 if print_comparison(old, new, args.threshold, args.min_delta_ms) else 0
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+# --------------------------------------------------------------------------------------
+# Process-wide PostgreSQL connection pool for the TMS application.
+# Connections are opened lazily per process (so gunicorn workers never share sockets
+# inherited from the master), health-checked on checkout and counted so the pool
+# size can be tuned against the number of workers.
+# --------------------------------------------------------------------------------------
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+
+
+class PoolExhaustedError(Exception):
+    """Raised when no connection becomes free within the checkout timeout."""
+
+
+class ConnectionPool:
+    """A thread-safe psycopg2 connection pool with blocking checkout and metrics."""
+
+    def __init__(self, db_config, minconn=1, maxconn=10, timeout=10.0, health_check_interval=30.0,
+                 connection_factory=None):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Pool size must satisfy 0 <= minconn <= maxconn and maxconn >= 1")
+        self.db_config = db_config
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.connection_factory = connection_factory
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._reset_state()
+
+    # -------------------------- Internal helpers --------------------------
+
+    def _reset_state(self):
+        """Forgets every connection; used on first use and after a fork."""
+        self._idle = []            # list of (conn, last_used_monotonic)
+        self._in_use = set()
+        self._slots = threading.BoundedSemaphore(self.maxconn)
+        self._pid = os.getpid()
+        self.stats = {
+            'checkouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'waits': 0,
+            'exhausted': 0,
+            'connections_opened': 0,
+            'connections_discarded': 0,
+            'health_check_failures': 0,
+        }
+
+    def _connect(self):
+        conn = psycopg2.connect(
+            host=self.db_config['host'],
+            user=self.db_config['user'],
+            password=self.db_config['password'],
+            dbname=self.db_config['database'],
+            port=self.db_config['port'],
+            connection_factory=self.connection_factory
+        )
+        self.stats['connections_opened'] += 1
+        return conn
+
+    def _check_fork(self):
+        """Drops connections inherited from a parent process (gunicorn preload)."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Sockets belong to the parent; never close them from the child.
+                    self._reset_state()
+                    for _ in range(self.minconn):
+                        self._idle.append((self._connect(), time.monotonic()))
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            self.stats['health_check_failures'] += 1
+            return False
+
+    def _discard(self, conn):
+        self.stats['connections_discarded'] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    # -------------------------- Public API --------------------------
+
+    def getconn(self):
+        """Checks a connection out of the pool, waiting up to `timeout` seconds."""
+        self._check_fork()
+        start = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.stats['exhausted'] += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                raise PoolExhaustedError(
+                    f"No database connection available after {self.timeout}s "
+                    f"(maxconn={self.maxconn})")
+        waited = time.monotonic() - start
+
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    idle = self._idle.pop() if self._idle else None
+                if idle is None:
+                    conn = self._connect()
+                elif self._is_healthy(*idle):
+                    conn = idle[0]
+                else:
+                    self._discard(idle[0])
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use.add(conn)
+            self.stats['checkouts'] += 1
+            if waited > 0.001:
+                self.stats['waits'] += 1
+            self.stats['wait_time_total'] += waited
+            self.stats['wait_time_max'] = max(self.stats['wait_time_max'], waited)
+        return conn
+
+    def putconn(self, conn):
+        """Returns a connection to the pool, rolling back any open transaction."""
+        with self._lock:
+            if conn not in self._in_use:
+                return
+            self._in_use.discard(conn)
+        try:
+            if not conn.closed:
+                conn.rollback()
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+            else:
+                self.stats['connections_discarded'] += 1
+        except psycopg2.Error:
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Context manager for code that runs outside a Flask request."""
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        """Closes every idle connection owned by this process."""
+        with self._lock:
+            if self._pid == os.getpid():
+                for conn, _ in self._idle:
+                    self._discard(conn)
+            self._idle = []
+
+    def metrics(self):
+        """Returns a snapshot of pool usage for sizing against the worker count."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats.update({
+                'pid': os.getpid(),
+                'minconn': self.minconn,
+                'maxconn': self.maxconn,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'wait_time_avg': (stats['wait_time_total'] / stats['checkouts']) if stats['checkouts'] else 0.0,
+            })
+        return stats
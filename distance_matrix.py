@@ -0,0 +1,177 @@
+# --------------------------------------------------------------------------------------
+# Distance matrices for route planning.
+# Coordinates are parsed once into NumPy arrays and haversine distances are computed
+# in float32, a block of rows at a time, so memory stays bounded for large stop sets.
+# Finished matrices are kept in an on-disk .npy store that is memory-mapped on read;
+# a new stop set reuses every pair it shares with the closest cached matrix and only
+# computes rows for the stops that are new.
+# --------------------------------------------------------------------------------------
+
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_KM = 6371.0088
+DEFAULT_CHUNK_ROWS = 1024
+# Coordinates are rounded before hashing so float noise does not defeat the cache
+# (1e-6 degrees is roughly 0.1 m).
+COORD_DECIMALS = 6
+
+
+def parse_latlon_array(values):
+    """Parses an iterable of "lat,lon" strings into an (n, 2) float64 array.
+
+    Unparseable or out-of-range entries become NaN rows.
+    """
+    parts = pd.Series(list(values), dtype=object).astype(str).str.replace(';', ',').str.split(',', expand=True)
+    parts = parts.reindex(columns=[0, 1, 2])
+    coords = np.array(parts[[0, 1]].apply(pd.to_numeric, errors='coerce'), dtype=np.float64)
+    invalid = parts[2].notna().to_numpy() | (np.abs(coords[:, 0]) > 90) | (np.abs(coords[:, 1]) > 180)
+    coords[invalid] = np.nan
+    return coords
+
+
+def haversine_matrix(a, b, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Great-circle distances in km between every row of `a` and every row of `b`.
+
+    Work is done `chunk_rows` rows at a time, so temporaries never exceed
+    chunk_rows x len(b) elements.
+    """
+    a = np.radians(np.asarray(a, dtype=np.float64))
+    b = np.radians(np.asarray(b, dtype=np.float64))
+    out = np.empty((len(a), len(b)), dtype=np.float32)
+    lat_b, lon_b = b[:, 0][None, :], b[:, 1][None, :]
+    cos_lat_b = np.cos(lat_b)
+    for start in range(0, len(a), chunk_rows):
+        chunk = a[start:start + chunk_rows]
+        lat_a, lon_a = chunk[:, 0][:, None], chunk[:, 1][:, None]
+        h = (np.sin((lat_b - lat_a) / 2) ** 2
+             + np.cos(lat_a) * cos_lat_b * np.sin((lon_b - lon_a) / 2) ** 2)
+        out[start:start + chunk_rows] = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+    return out
+
+
+def _row_keys(coords):
+    """Views each (lat, lon) row as one opaque value so sets of stops can be compared."""
+    coords = np.ascontiguousarray(coords)
+    return coords.view(np.dtype((np.void, coords.dtype.itemsize * coords.shape[1]))).ravel()
+
+
+class DistanceMatrixCache:
+    """A bounded, memory-mapped store of distance matrices keyed by stop set.
+
+    Matrices are stored for the sorted, de-duplicated stop set, so the same stops
+    in a different order hit the same entry. Files are written atomically, which
+    lets several gunicorn workers share one cache directory.
+    """
+
+    def __init__(self, cache_dir, max_entries=32, chunk_rows=DEFAULT_CHUNK_ROWS):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.chunk_rows = chunk_rows
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'partial_hits': 0, 'misses': 0, 'pairs_computed': 0, 'pairs_reused': 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, key):
+        return (os.path.join(self.cache_dir, f'{key}.npy'),
+                os.path.join(self.cache_dir, f'{key}.coords.npy'))
+
+    def _entries(self):
+        """Cached keys, most recently used first."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.coords.npy'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    entries.append((os.path.getmtime(path), name[:-len('.coords.npy')]))
+                except OSError:
+                    continue
+        return [key for _, key in sorted(entries, reverse=True)]
+
+    def _save(self, key, matrix, coords):
+        matrix_path, coords_path = self._paths(key)
+        for path, array in ((matrix_path, matrix), (coords_path, coords)):
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp, path)
+
+    def _evict(self):
+        for key in self._entries()[self.max_entries:]:
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _load(self, key):
+        matrix_path, coords_path = self._paths(key)
+        matrix = np.load(matrix_path, mmap_mode='r')
+        coords = np.load(coords_path, mmap_mode='r')
+        os.utime(coords_path)
+        return matrix, coords
+
+    def _best_overlap(self, canonical_keys, candidates=8):
+        """Finds the recent cached entry sharing the most stops with `canonical_keys`."""
+        best = None
+        for key in self._entries()[:candidates]:
+            try:
+                matrix, coords = self._load(key)
+            except (OSError, ValueError):
+                continue
+            _, new_idx, old_idx = np.intersect1d(canonical_keys, _row_keys(np.asarray(coords)),
+                                                 assume_unique=True, return_indices=True)
+            if best is None or len(new_idx) > len(best[1]):
+                best = (matrix, new_idx, old_idx)
+        return best
+
+    def get(self, coords):
+        """Returns the (n, n) float32 km matrix for an (n, 2) array of coordinates."""
+        coords = np.round(np.asarray(coords, dtype=np.float64), COORD_DECIMALS)
+        canonical, inverse = np.unique(coords, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        key = hashlib.sha1(canonical.tobytes()).hexdigest()
+
+        with self._lock:
+            try:
+                matrix, _ = self._load(key)
+                self.stats['hits'] += 1
+                return np.asarray(matrix[np.ix_(inverse, inverse)])
+            except (OSError, ValueError):
+                pass
+
+            m = len(canonical)
+            matrix = np.empty((m, m), dtype=np.float32)
+            canonical_keys = _row_keys(canonical)
+            overlap = self._best_overlap(canonical_keys)
+            if overlap is not None and len(overlap[1]):
+                old_matrix, new_idx, old_idx = overlap
+                matrix[np.ix_(new_idx, new_idx)] = old_matrix[np.ix_(old_idx, old_idx)]
+                missing = np.setdiff1d(np.arange(m), new_idx, assume_unique=True)
+                self.stats['partial_hits'] += 1
+                self.stats['pairs_reused'] += len(new_idx) ** 2
+            else:
+                missing = np.arange(m)
+                self.stats['misses'] += 1
+
+            if len(missing):
+                rows = haversine_matrix(canonical[missing], canonical, self.chunk_rows)
+                matrix[missing, :] = rows
+                matrix[:, missing] = rows.T
+                self.stats['pairs_computed'] += rows.size
+
+            self._save(key, matrix, canonical)
+            self._evict()
+        return matrix[np.ix_(inverse, inverse)]
+
+
+def distance_matrix(coords, cache=None):
+    """Returns the float32 km distance matrix for `coords`, using `cache` if given."""
+    if cache is not None:
+        return cache.get(coords)
+    return haversine_matrix(coords, coords)
@@ -0,0 +1,346 @@
+# --------------------------------------------------------------------------------------
+# Streaming CSV / XLSX exports of orders, fleet, drivers and trips.
+# Rows are never held in memory as a whole: plain CSV is produced by the server with
+# COPY ... TO STDOUT and relayed in chunks, and every other export reads a server-side
+# (named) cursor one batch at a time. XLSX files are written as a streamed zip, so the
+# first bytes leave before the query has finished and memory stays flat however many
+# rows there are.
+# --------------------------------------------------------------------------------------
+
+import csv
+import io
+import math
+import queue
+import threading
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from order_listing import SORT_COLUMNS, build_filter_clause
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+DEFAULT_BATCH_SIZE = 2000
+DEFAULT_CHUNK_BYTES = 64 * 1024
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+# -------------------------- Queries --------------------------
+
+def orders_export_query(filters, sort='expected_delivery', direction='asc'):
+    """The /orders listing query without its page limit; returns (sql, params)."""
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f'Unsupported sort column: {sort}')
+    clauses, params = build_filter_clause(filters)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    order = 'ASC NULLS LAST' if direction == 'asc' else 'DESC NULLS FIRST'
+    tie = 'ASC' if direction == 'asc' else 'DESC'
+    order_by = f"order_id {tie}" if sort == 'order_id' else f"{sort} {order}, order_id {tie}"
+    return f"""
+        SELECT order_id, customer_name, created_date, order_type, pickup_location_latlon,
+               drop_location_latlon, volume_cbm, weight_kg, delivery_priority, expected_delivery,
+               amount, status
+        FROM orders
+        {where}
+        ORDER BY {order_by}
+    """, params
+
+
+def fleet_export_query(filters):
+    """Fleet vehicles matching the fleet_master filter bar; returns (sql, params)."""
+    clauses, params = [], []
+    if filters.get('vehicle_id'):
+        clauses.append("vehicle_id ILIKE %s")
+        params.append(f"%{filters['vehicle_id']}%")
+    if filters.get('driver'):
+        clauses.append("driver_id ILIKE %s")
+        params.append(f"%{filters['driver']}%")
+    if filters.get('documents_expiry'):
+        clauses.append("documents_expiry >= %s")
+        params.append(filters['documents_expiry'])
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    return f"""
+        SELECT vehicle_id, vehicle_name, make, model, vin, type, "group", status, license_plate,
+               current_meter, capacity_weight_kg, capacity_vol_cbm, documents_expiry, driver_id,
+               date_of_join, avg
+        FROM fleet
+        {where}
+        ORDER BY vehicle_id
+    """, params
+
+
+def drivers_export_query():
+    return """
+        SELECT dm.driver_id, dm.driver_name, dm.license_number, dm.contact_number, dm.address,
+               dm.availability, dm.shift_info, dm.vehicle_id, df.salary, df.bonus, df.last_paid_date
+        FROM driver_master AS dm
+        LEFT JOIN driver_financials AS df ON df.driver_id = dm.driver_id
+        ORDER BY dm.driver_id
+    """, []
+
+
+def trips_export_query(start, end, vehicle_id=None, driver_id=None):
+    """Trips that started in [start, end), the same selection as /trip-history."""
+    clauses, params = ['started_at >= %s', 'started_at < %s'], [start, end]
+    if vehicle_id:
+        clauses.append('vehicle_id = %s')
+        params.append(vehicle_id)
+    if driver_id:
+        clauses.append('driver_id = %s')
+        params.append(driver_id)
+    return f"""
+        SELECT vehicle_id, driver_id, started_at, ended_at,
+               ROUND((EXTRACT(EPOCH FROM ended_at - started_at) / 3600)::numeric, 2) AS duration_hrs,
+               distance_km, max_speed, start_lat, start_lon, end_lat, end_lon, raw_points
+        FROM vehicle_trips
+        WHERE {' AND '.join(clauses)}
+        ORDER BY started_at DESC
+    """, params
+
+
+# -------------------------- Row sources --------------------------
+
+def iter_copy_csv(db_pool, sql, params, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """Streams `sql` as CSV with a header using COPY ... TO STDOUT.
+
+    COPY writes into a bounded queue from a helper thread, so a slow client
+    holds back the server rather than filling memory. Closing the generator
+    early (the client went away) cancels the COPY.
+    """
+    chunks = queue.Queue(maxsize=8)
+    cancelled = threading.Event()
+    done = object()
+
+    class _Sink:
+        def __init__(self):
+            self.parts, self.size = [], 0
+
+        def write(self, data):
+            if cancelled.is_set():
+                return
+            self.parts.append(data if isinstance(data, bytes) else data.encode())
+            self.size += len(data)
+            if self.size >= chunk_bytes:
+                self.flush()
+
+        def flush(self):
+            if self.parts:
+                chunks.put(b''.join(self.parts))
+                self.parts, self.size = [], 0
+
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            statement = cur.mogrify(sql, params).decode()
+        copy_sql = f"COPY ({statement}) TO STDOUT WITH (FORMAT csv, HEADER)"
+        errors = []
+
+        def _copy():
+            sink = _Sink()
+            try:
+                with conn.cursor() as cur:
+                    cur.copy_expert(copy_sql, sink)
+                sink.flush()
+            except Exception as e:
+                if not cancelled.is_set():
+                    errors.append(e)
+            finally:
+                chunks.put(done)
+
+        worker = threading.Thread(target=_copy, name='export-copy', daemon=True)
+        worker.start()
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is done:
+                    break
+                yield chunk
+            if errors:
+                raise errors[0]
+        finally:
+            if worker.is_alive():
+                cancelled.set()
+                conn.cancel()
+                while chunks.get() is not done:
+                    pass
+                worker.join()
+            conn.rollback()
+
+
+def iter_cursor_rows(db_pool, sql, params, batch_size=DEFAULT_BATCH_SIZE):
+    """Yields the column names, then batches of rows, from a server-side cursor."""
+    with db_pool.connection() as conn:
+        try:
+            with conn.cursor(name='tms_export') as cur:
+                cur.itersize = batch_size
+                cur.execute(sql, params)
+                rows = cur.fetchmany(batch_size)
+                yield [col[0] for col in cur.description]
+                while rows:
+                    yield rows
+                    rows = cur.fetchmany(batch_size)
+        finally:
+            conn.rollback()
+
+
+# -------------------------- Encoders --------------------------
+
+def encode_csv(batches):
+    """CSV bytes for a `iter_cursor_rows` stream, one chunk per batch."""
+    batches = iter(batches)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(next(batches))
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+# Escapes markup and drops the characters XML 1.0 does not allow, even escaped,
+# in a single str.translate pass.
+_XML_TEXT = {ord('&'): '&amp;', ord('<'): '&lt;', ord('>'): '&gt;'}
+_XML_TEXT.update(dict.fromkeys([*range(0x00, 0x09), 0x0b, 0x0c, *range(0x0e, 0x20), 0xfffe, 0xffff]))
+
+_XLSX_STATIC = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+_XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+
+def _xlsx_text(value):
+    text = str(value).translate(_XML_TEXT)
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_number(value):
+    return f'<c><v>{value}</v></c>'
+
+
+def _xlsx_float(value):
+    return f'<c><v>{value}</v></c>' if math.isfinite(value) else _xlsx_text(value)
+
+
+# Cell writers by exact type; a dict lookup is much cheaper per cell than an
+# isinstance chain. Other types (subclasses included) go through _xlsx_cell.
+_XLSX_WRITERS = {
+    str: _xlsx_text,
+    int: _xlsx_number,
+    Decimal: _xlsx_number,
+    float: _xlsx_float,
+    bool: lambda value: f'<c t="b"><v>{int(value)}</v></c>',
+    date: lambda value: _xlsx_text(value.isoformat()),
+    datetime: lambda value: _xlsx_text(value.isoformat(sep=' ')),
+    type(None): lambda value: '<c/>',
+}
+
+
+def _xlsx_cell(value):
+    writer = _XLSX_WRITERS.get(type(value))
+    if writer is None:
+        for kind in (bool, datetime, date, int, float, str):
+            if isinstance(value, kind):
+                return _XLSX_WRITERS[kind](value)
+        return _xlsx_text(value)
+    return writer(value)
+
+
+def _xlsx_row(values):
+    return '<row>' + ''.join(map(_xlsx_cell, values)) + '</row>'
+
+
+class _ZipSink:
+    """Write-only file object collecting what ZipFile writes until it is drained."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def encode_xlsx(batches, sheet_name='Export'):
+    """XLSX bytes for a `iter_cursor_rows` stream.
+
+    The workbook is a single sheet of inline strings and numbers. Because the
+    sink cannot seek, zipfile writes each member with a trailing data
+    descriptor, so the sheet is compressed and sent as the rows arrive.
+    """
+    batches = iter(batches)
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_STATIC.items():
+            archive.writestr(name, content)
+        archive.writestr('xl/workbook.xml', _XLSX_WORKBOOK.format(name=escape(sheet_name[:31])))
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                         '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                         '<sheetData>' + _xlsx_row(next(batches))).encode())
+            for rows in batches:
+                sheet.write(''.join(_xlsx_row(row) for row in rows).encode())
+                chunk = sink.drain()
+                if chunk:
+                    yield chunk
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.drain()
+
+
+def stream_export(db_pool, sql, params, export_format, use_copy=True, sheet_name='Export',
+                  batch_size=DEFAULT_BATCH_SIZE):
+    """Byte chunks of `sql` rendered as `export_format` ('csv' or 'xlsx')."""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f'Unsupported export format: {export_format}')
+    if export_format == 'csv' and use_copy:
+        return iter_copy_csv(db_pool, sql, params)
+    batches = iter_cursor_rows(db_pool, sql, params, batch_size=batch_size)
+    if export_format == 'csv':
+        return encode_csv(batches)
+    return encode_xlsx(batches, sheet_name=sheet_name)
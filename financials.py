@@ -0,0 +1,338 @@
+# --------------------------------------------------------------------------------------
+# Financial aggregates for the vehicle P&L dashboard.
+# Every non-cancelled order is a trip line in `finance_trips`: its revenue, the vehicle
+# and driver the route plan dispatched it with, and the fuel and running cost of its
+# share of that route. Daily rollups per vehicle and per customer are kept in summary
+# tables. Statement-level triggers on `orders` and `order_dispatch` queue the ids of
+# changed orders, and a background refresh rebuilds only those trip lines and the
+# (vehicle, day) / (customer, day) groups they touch.
+# --------------------------------------------------------------------------------------
+
+import logging
+import os
+import threading
+import time
+
+from order_listing import decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary key for pg_try_advisory_xact_lock so only one worker refreshes at a time.
+REFRESH_LOCK_KEY = 7310413
+# Queued changes drained per refresh transaction.
+DEFAULT_REFRESH_BATCH = 20000
+
+TRIGGER_FUNCTION = """
+    CREATE OR REPLACE FUNCTION finance_mark_changed() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO finance_changes (order_id) SELECT order_id FROM new_rows;
+        ELSIF TG_OP = 'UPDATE' THEN
+            INSERT INTO finance_changes (order_id)
+            SELECT order_id FROM new_rows UNION SELECT order_id FROM old_rows;
+        ELSE
+            INSERT INTO finance_changes (order_id) SELECT order_id FROM old_rows;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+"""
+
+# Transition tables allow one event per trigger, hence three triggers per table.
+TRIGGER_EVENTS = {
+    'ins': ('INSERT', 'NEW TABLE AS new_rows'),
+    'upd': ('UPDATE', 'NEW TABLE AS new_rows OLD TABLE AS old_rows'),
+    'del': ('DELETE', 'OLD TABLE AS old_rows'),
+}
+
+ROLLUPS = {
+    'fin_vehicle_daily': 'vehicle_id',
+    'fin_customer_daily': 'customer_name',
+}
+
+
+def create_financial_tables(cur):
+    """Creates the trip fact table, the daily rollups, the change queue and its triggers.
+
+    The triggers are skipped for `orders` or `order_dispatch` while that table does not exist.
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS finance_trips (
+            order_id VARCHAR(50) PRIMARY KEY,
+            vehicle_id VARCHAR(50),
+            driver_id VARCHAR(50),
+            trip_date DATE NOT NULL,
+            customer_name TEXT NOT NULL,
+            pickup TEXT,
+            drop_location TEXT,
+            status TEXT,
+            distance_km DOUBLE PRECISION NOT NULL,
+            fuel_liters DOUBLE PRECISION NOT NULL,
+            revenue NUMERIC NOT NULL,
+            fuel_cost NUMERIC NOT NULL,
+            cost NUMERIC NOT NULL,
+            pnl NUMERIC NOT NULL
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_finance_trips_date ON finance_trips (trip_date, order_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_finance_trips_vehicle ON finance_trips (vehicle_id, trip_date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_finance_trips_customer ON finance_trips (customer_name, trip_date)")
+    for table, key in ROLLUPS.items():
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {key} TEXT NOT NULL,
+                day DATE NOT NULL,
+                orders INTEGER NOT NULL,
+                revenue NUMERIC NOT NULL,
+                distance_km DOUBLE PRECISION NOT NULL,
+                fuel_cost NUMERIC NOT NULL,
+                cost NUMERIC NOT NULL,
+                pnl NUMERIC NOT NULL,
+                PRIMARY KEY ({key}, day)
+            );
+        """)
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_day ON {table} (day)")
+    cur.execute("CREATE TABLE IF NOT EXISTS finance_changes (order_id VARCHAR(50) NOT NULL)")
+
+    cur.execute(TRIGGER_FUNCTION)
+    # Triggers only go on the tables that exist; a later run adds the rest.
+    cur.execute("""
+        SELECT t.name FROM unnest(ARRAY['orders', 'order_dispatch']) AS t(name)
+        WHERE to_regclass(t.name) IS NOT NULL
+    """)
+    tables = [row[0] for row in cur.fetchall()]
+    cur.execute("""
+        SELECT tgname FROM pg_trigger
+        WHERE tgrelid IN (SELECT to_regclass(name) FROM unnest(%s::text[]) AS name) AND tgname LIKE 'finance_%%'
+    """, (tables,))
+    existing = {row[0] for row in cur.fetchall()}
+    for table in tables:
+        for suffix, (event, referencing) in TRIGGER_EVENTS.items():
+            name = f'finance_{table}_{suffix}'
+            if name not in existing:
+                cur.execute(f"""
+                    CREATE TRIGGER {name} AFTER {event} ON {table}
+                    REFERENCING {referencing}
+                    FOR EACH STATEMENT EXECUTE FUNCTION finance_mark_changed()
+                """)
+
+
+class FinancialAggregates:
+    """Keeps `finance_trips` and the daily rollups in step with orders and dispatches."""
+
+    def __init__(self, db_pool, interval=60.0, fuel_price=95.0, cost_per_km=0.0, on_refresh=None,
+                 batch_size=DEFAULT_REFRESH_BATCH):
+        self.db_pool = db_pool
+        self.interval = interval
+        self.batch_size = batch_size
+        self.fuel_price = fuel_price
+        self.cost_per_km = cost_per_km
+        # Called with the number of orders refreshed after a refresh that changed trip lines.
+        self.on_refresh = on_refresh
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self.stats = {'refreshes': 0, 'skipped_refreshes': 0, 'orders_refreshed': 0,
+                      'groups_refreshed': 0, 'errors': 0, 'last_refresh_seconds': None,
+                      'last_refreshed_at': None}
+
+    def ensure_running(self):
+        """Starts the background refresh once per process (and again after a fork)."""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._run, name='finance-refresh', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        # Catch up straight away, then poll; changes queued before start are not left waiting.
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                self.stats['errors'] += 1
+                logger.exception('Error refreshing financial aggregates')
+            time.sleep(self.interval)
+
+    def refresh(self, full=False, wait=False):
+        """Applies queued order changes to the trip lines and rollups; returns orders refreshed.
+
+        A full refresh (also done automatically the first time) re-derives every
+        order, e.g. after changing the fuel price. Unless `wait` is set, the call
+        returns at once when another worker is already refreshing. The queue is
+        drained `batch_size` rows per transaction, so a long backlog is worked off
+        in bounded steps and each processed batch is deleted as soon as it commits.
+        """
+        started = time.perf_counter()
+        changed = 0
+        first = True
+        while True:
+            with self.db_pool.connection() as conn:
+                with conn.cursor() as cur:
+                    if wait:
+                        cur.execute("SELECT pg_advisory_xact_lock(%s), true", (REFRESH_LOCK_KEY,))
+                    else:
+                        cur.execute("SELECT true, pg_try_advisory_xact_lock(%s)", (REFRESH_LOCK_KEY,))
+                    if not cur.fetchone()[1]:
+                        # Another worker holds the lock and will drain the rest of the queue.
+                        conn.rollback()
+                        if first:
+                            self.stats['skipped_refreshes'] += 1
+                            return 0
+                        break
+
+                    if first and not full:
+                        cur.execute("SELECT NOT EXISTS (SELECT 1 FROM finance_trips) AND EXISTS (SELECT 1 FROM orders)")
+                        full = cur.fetchone()[0]
+                    if first and full:
+                        cur.execute("""
+                            INSERT INTO finance_changes (order_id)
+                            SELECT order_id FROM orders UNION SELECT order_id FROM finance_trips
+                        """)
+
+                    cur.execute("CREATE TEMP TABLE fin_changed (order_id VARCHAR(50) PRIMARY KEY) ON COMMIT DROP")
+                    cur.execute("""
+                        WITH drained AS (
+                            DELETE FROM finance_changes
+                            WHERE ctid = ANY(ARRAY(SELECT ctid FROM finance_changes LIMIT %s))
+                            RETURNING order_id
+                        ), queued AS (
+                            INSERT INTO fin_changed SELECT DISTINCT order_id FROM drained RETURNING 1
+                        )
+                        SELECT (SELECT COUNT(*) FROM drained), (SELECT COUNT(*) FROM queued)
+                    """, (self.batch_size,))
+                    drained, batch_changed = cur.fetchone()
+                    if batch_changed:
+                        cur.execute("ANALYZE fin_changed")
+                        groups = self._apply_changes(cur)
+                        self.stats['groups_refreshed'] += groups
+                conn.commit()
+            changed += batch_changed
+            first = False
+            if drained < self.batch_size:
+                break
+
+        self.stats['refreshes'] += 1
+        self.stats['orders_refreshed'] += changed
+        self.stats['last_refresh_seconds'] = round(time.perf_counter() - started, 3)
+        self.stats['last_refreshed_at'] = time.time()
+        if changed and self.on_refresh is not None:
+            self.on_refresh(changed)
+        return changed
+
+    def _apply_changes(self, cur):
+        """Rebuilds trip lines for `fin_changed` and every rollup group they touch."""
+        # Groups the changed orders belonged to before and after the change.
+        cur.execute("""
+            CREATE TEMP TABLE fin_groups ON COMMIT DROP AS
+            SELECT t.vehicle_id, t.customer_name, t.trip_date AS day
+            FROM finance_trips AS t JOIN fin_changed AS c ON c.order_id = t.order_id
+        """)
+        cur.execute("DELETE FROM finance_trips AS t USING fin_changed AS c WHERE c.order_id = t.order_id")
+        cur.execute("""
+            INSERT INTO finance_trips (
+                order_id, vehicle_id, driver_id, trip_date, customer_name, pickup, drop_location, status,
+                distance_km, fuel_liters, revenue, fuel_cost, cost, pnl
+            )
+            SELECT o.order_id, d.vehicle_id, d.driver_id,
+                   COALESCE(o.expected_delivery, o.created_date, d.dispatched_at::date, CURRENT_DATE),
+                   COALESCE(NULLIF(o.customer_name, ''), 'Unknown'),
+                   o.pickup_location_latlon, o.drop_location_latlon, o.status,
+                   km, litres, revenue, fuel_cost, fuel_cost + running_cost,
+                   revenue - fuel_cost - running_cost
+            FROM fin_changed AS c
+            JOIN orders AS o ON o.order_id = c.order_id
+            LEFT JOIN order_dispatch AS d ON d.order_id = o.order_id
+            CROSS JOIN LATERAL (SELECT COALESCE(d.distance_km, 0) AS km,
+                                       COALESCE(d.fuel_liters, 0) AS litres,
+                                       COALESCE(o.amount, 0)::numeric AS revenue) AS base
+            CROSS JOIN LATERAL (SELECT (litres * %(fuel_price)s)::numeric AS fuel_cost,
+                                       (km * %(cost_per_km)s)::numeric AS running_cost) AS costs
+            WHERE COALESCE(o.status, '') <> 'Cancelled'
+        """, {'fuel_price': self.fuel_price, 'cost_per_km': self.cost_per_km})
+        cur.execute("""
+            INSERT INTO fin_groups
+            SELECT t.vehicle_id, t.customer_name, t.trip_date
+            FROM finance_trips AS t JOIN fin_changed AS c ON c.order_id = t.order_id
+        """)
+
+        groups = 0
+        for table, key in ROLLUPS.items():
+            cur.execute(f"""
+                CREATE TEMP TABLE fin_keys ON COMMIT DROP AS
+                SELECT DISTINCT {key} AS key, day FROM fin_groups WHERE {key} IS NOT NULL
+            """)
+            groups += cur.rowcount
+            cur.execute(f"DELETE FROM {table} AS r USING fin_keys AS k WHERE r.{key} = k.key AND r.day = k.day")
+            cur.execute(f"""
+                INSERT INTO {table} ({key}, day, orders, revenue, distance_km, fuel_cost, cost, pnl)
+                SELECT t.{key}, t.trip_date, COUNT(*), SUM(t.revenue), SUM(t.distance_km),
+                       SUM(t.fuel_cost), SUM(t.cost), SUM(t.pnl)
+                FROM finance_trips AS t
+                JOIN fin_keys AS k ON k.key = t.{key} AND k.day = t.trip_date
+                GROUP BY t.{key}, t.trip_date
+            """)
+            cur.execute("DROP TABLE fin_keys")
+        return groups
+
+
+# -------------------------- Queries --------------------------
+
+def fetch_rollup(cur, table, start, end, limit=None):
+    """Totals per vehicle (or customer) over [start, end], highest revenue first."""
+    key = ROLLUPS[table]
+    cur.execute(f"""
+        SELECT {key}, SUM(orders) AS orders, SUM(revenue) AS revenue, SUM(distance_km) AS distance_km,
+               SUM(fuel_cost) AS fuel_cost, SUM(cost) AS cost, SUM(pnl) AS pnl
+        FROM {table}
+        WHERE day BETWEEN %s AND %s
+        GROUP BY {key}
+        ORDER BY revenue DESC, {key}
+        LIMIT %s
+    """, (start, end, limit))
+    return cur.fetchall()
+
+
+def fetch_totals(cur, start, end):
+    """Fleet-wide totals over [start, end]; unassigned orders count towards revenue."""
+    cur.execute("""
+        SELECT COALESCE(SUM(orders), 0) AS orders, COALESCE(SUM(revenue), 0) AS revenue,
+               COALESCE(SUM(fuel_cost), 0) AS fuel_cost, COALESCE(SUM(cost), 0) AS cost,
+               COALESCE(SUM(pnl), 0) AS pnl
+        FROM fin_customer_daily
+        WHERE day BETWEEN %s AND %s
+    """, (start, end))
+    return cur.fetchone()
+
+
+def fetch_trip_page(cur, start, end, vehicle_id=None, customer=None, cursor=None, limit=50):
+    """One page of trip lines, newest first; returns (rows, next_cursor).
+
+    Raises ValueError for a malformed cursor.
+    """
+    clauses = ['t.trip_date BETWEEN %s AND %s']
+    params = [start, end]
+    if vehicle_id:
+        clauses.append('t.vehicle_id = %s')
+        params.append(vehicle_id)
+    if customer:
+        clauses.append('t.customer_name ILIKE %s')
+        params.append(f'%{customer}%')
+    if cursor:
+        after_date, after_id = decode_cursor(cursor)
+        clauses.append('(t.trip_date, t.order_id) < (%s, %s)')
+        params.extend([after_date, after_id])
+    cur.execute(f"""
+        SELECT t.order_id, t.vehicle_id, f.model AS vehicle_model, t.driver_id, dm.driver_name,
+               dm.shift_info, dm.availability, t.trip_date, t.customer_name, t.pickup, t.drop_location,
+               t.status, t.distance_km, t.fuel_liters, t.revenue, t.fuel_cost, t.cost, t.pnl
+        FROM finance_trips AS t
+        LEFT JOIN fleet AS f ON f.vehicle_id = t.vehicle_id
+        LEFT JOIN driver_master AS dm ON dm.driver_id = t.driver_id
+        WHERE {' AND '.join(clauses)}
+        ORDER BY t.trip_date DESC, t.order_id DESC
+        LIMIT %s
+    """, params + [limit + 1])
+    rows = cur.fetchall()
+    next_cursor = encode_cursor(rows[limit - 1], 'trip_date') if len(rows) > limit else None
+    return rows[:limit], next_cursor
@@ -0,0 +1,375 @@
+# --------------------------------------------------------------------------------------
+# Geocoding for order locations and driver addresses.
+# Order pickup/drop fields are usually "lat,lon", but uploads and the order form also
+# carry free-text addresses, as does driver_master.address. Those are resolved once
+# through a pluggable backend and kept in a Postgres cache keyed by the normalized
+# address, so "12, M.G. Rd , Pune" and "12 mg road pune" share one entry. Routing only
+# ever reads the cache; a background pre-warm job fills it after uploads and edits,
+# resolving misses on a bounded thread pool so a slow or rate-limited backend never
+# sits on a request path.
+# --------------------------------------------------------------------------------------
+
+import csv
+import importlib
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from psycopg2.extras import execute_values
+
+from route_optimizer import parse_latlon
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_NEGATIVE_TTL_DAYS = 7
+# Backend failures (timeouts, rate limits) are retried much sooner than "not found".
+ERROR_RETRY_MINUTES = 60
+RESOLVE_CHUNK_SIZE = 500
+MAX_KEY_LENGTH = 500
+
+# Postgres regex for values that are already coordinates (see parse_latlon).
+COORDINATE_PATTERN = r'^\s*-?[0-9]+(\.[0-9]+)?\s*[,;]\s*-?[0-9]+(\.[0-9]+)?\s*$'
+
+ABBREVIATIONS = {
+    'rd': 'road', 'st': 'street', 'ave': 'avenue', 'ln': 'lane', 'mkt': 'market', 'ngr': 'nagar',
+    'nr': 'near', 'opp': 'opposite', 'bldg': 'building', 'apt': 'apartment', 'sec': 'sector',
+    'dist': 'district', 'hwy': 'highway', 'no': 'number', 'flr': 'floor',
+}
+
+
+def normalize_address(address):
+    """Cache key for an address: case-folded words without punctuation, abbreviations expanded.
+
+    Runs of initials are joined, so "M.G. Road" and "MG Road" share a key.
+    """
+    text = unicodedata.normalize('NFKC', str(address)).casefold()
+    text = re.sub(r'\b([^\W\d_])[.\s]+(?=[^\W\d_]\b)', r'\1', text)
+    words = re.findall(r'[^\W_]+', text)
+    return ' '.join(ABBREVIATIONS.get(w, w) for w in words)[:MAX_KEY_LENGTH]
+
+
+def needs_geocoding(value):
+    return bool(value) and parse_latlon(value) is None
+
+
+def create_geocode_cache_table(cur):
+    """Creates the normalized-address geocode cache."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS geocode_cache (
+            address_key TEXT PRIMARY KEY,
+            address TEXT NOT NULL,
+            lat DOUBLE PRECISION,
+            lon DOUBLE PRECISION,
+            status VARCHAR(12) NOT NULL,
+            provider VARCHAR(50),
+            resolved_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+    """)
+
+
+# -------------------------- Backends --------------------------
+
+class GeocoderUnavailable(Exception):
+    """A backend failed transiently (timeout, rate limit); the address is retried later."""
+
+
+# Built-in city centroids for the offline gazetteer; a CSV of name,lat,lon extends it.
+DEFAULT_GAZETTEER = {
+    'mumbai': (19.0760, 72.8777), 'bombay': (19.0760, 72.8777), 'delhi': (28.7041, 77.1025),
+    'new delhi': (28.6139, 77.2090), 'bengaluru': (12.9716, 77.5946), 'bangalore': (12.9716, 77.5946),
+    'hyderabad': (17.3850, 78.4867), 'ahmedabad': (23.0225, 72.5714), 'chennai': (13.0827, 80.2707),
+    'madras': (13.0827, 80.2707), 'kolkata': (22.5726, 88.3639), 'calcutta': (22.5726, 88.3639),
+    'pune': (18.5204, 73.8567), 'surat': (21.1702, 72.8311), 'jaipur': (26.9124, 75.7873),
+    'lucknow': (26.8467, 80.9462), 'kanpur': (26.4499, 80.3319), 'nagpur': (21.1458, 79.0882),
+    'indore': (22.7196, 75.8577), 'thane': (19.2183, 72.9781), 'bhopal': (23.2599, 77.4126),
+    'visakhapatnam': (17.6868, 83.2185), 'patna': (25.5941, 85.1376), 'vadodara': (22.3072, 73.1812),
+    'ghaziabad': (28.6692, 77.4538), 'ludhiana': (30.9010, 75.8573), 'agra': (27.1767, 78.0081),
+    'nashik': (19.9975, 73.7898), 'faridabad': (28.4089, 77.3178), 'rajkot': (22.3039, 70.8022),
+    'varanasi': (25.3176, 82.9739), 'amritsar': (31.6340, 74.8723), 'coimbatore': (11.0168, 76.9558),
+    'kochi': (9.9312, 76.2673), 'guwahati': (26.1445, 91.7362), 'chandigarh': (30.7333, 76.7794),
+    'gurugram': (28.4595, 77.0266), 'gurgaon': (28.4595, 77.0266), 'noida': (28.5355, 77.3910),
+    'navi mumbai': (19.0330, 73.0297), 'mysuru': (12.2958, 76.6394), 'madurai': (9.9252, 78.1198),
+}
+
+
+class GazetteerBackend:
+    """Offline stand-in: matches the longest known place name in the address.
+
+    When several names match equally, the last one wins, since addresses usually end
+    with the city. Deterministic and network-free, for tests, benchmarks and dev.
+    """
+
+    name = 'gazetteer'
+
+    def __init__(self, path=None):
+        self.places = dict(DEFAULT_GAZETTEER)
+        if path:
+            with open(path, newline='', encoding='utf-8') as f:
+                for row in csv.reader(f):
+                    if len(row) >= 3 and row[0].strip() and not row[0].startswith('#'):
+                        try:
+                            self.places[normalize_address(row[0])] = (float(row[1]), float(row[2]))
+                        except ValueError:
+                            continue      # header or malformed line
+        self.max_words = max(len(name.split()) for name in self.places)
+
+    def geocode(self, address):
+        words = normalize_address(address).split()
+        best = None
+        for start in range(len(words)):
+            for size in range(1, min(self.max_words, len(words) - start) + 1):
+                name = ' '.join(words[start:start + size])
+                if name in self.places and (best is None or size >= best[0]):
+                    best = (size, name)
+        return self.places[best[1]] if best else None
+
+
+class GeopyBackend:
+    """Any geopy geocoding service (Nominatim by default), throttled to `min_interval` seconds."""
+
+    def __init__(self, service='nominatim', user_agent='tms-geocoder', min_interval=1.0, timeout=10, **options):
+        from geopy.geocoders import get_geocoder_for_service
+
+        self.name = service
+        self.geocoder = get_geocoder_for_service(service)(user_agent=user_agent, timeout=timeout, **options)
+        self.min_interval = min_interval
+        self._throttle_lock = threading.Lock()
+        self._next_call = 0.0
+
+    def geocode(self, address):
+        from geopy.exc import GeopyError
+
+        with self._throttle_lock:
+            wait = self._next_call - time.monotonic()
+            self._next_call = max(self._next_call, time.monotonic()) + self.min_interval
+        if wait > 0:
+            time.sleep(wait)
+        try:
+            location = self.geocoder.geocode(address)
+        except GeopyError as e:
+            raise GeocoderUnavailable(str(e)) from e
+        return None if location is None else (location.latitude, location.longitude)
+
+
+def make_backend(name, gazetteer_path=None, user_agent='tms-geocoder', min_interval=1.0):
+    """Backend by name: 'gazetteer', any geopy service name, or 'package.module:factory'."""
+    if name == 'gazetteer':
+        return GazetteerBackend(gazetteer_path)
+    if ':' in name:
+        module, attr = name.split(':', 1)
+        return getattr(importlib.import_module(module), attr)()
+    return GeopyBackend(name, user_agent=user_agent, min_interval=min_interval)
+
+
+# -------------------------- Cache and resolver --------------------------
+
+class GeocodingCache:
+    """Cache-first geocoder: reads are single queries, misses go to the backend in bounded batches."""
+
+    def __init__(self, db_pool, backend, max_concurrency=DEFAULT_CONCURRENCY,
+                 negative_ttl_days=DEFAULT_NEGATIVE_TTL_DAYS):
+        self.db_pool = db_pool
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.negative_ttl_days = negative_ttl_days
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._prewarm_requested = threading.Event()
+        self._prewarm_pid = None
+        self._deferred = set()     # addresses a budgeted resolve left for the pre-warm job
+        self.stats = {'lookups': 0, 'cache_hits': 0, 'resolved': 0, 'not_found': 0, 'backend_errors': 0,
+                      'prewarm_runs': 0, 'prewarm_errors': 0, 'last_prewarm_seconds': None,
+                      'last_prewarm_addresses': 0}
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                    thread_name_prefix='geocoder')
+                self._pid = os.getpid()
+            return self._executor
+
+    def lookup(self, cur, values):
+        """Cached coordinates for `values` as {value: (lat, lon)}; never calls the backend."""
+        keys = {}
+        for value in values:
+            if needs_geocoding(value):
+                keys.setdefault(normalize_address(value), []).append(value)
+        if not keys:
+            return {}
+        cur.execute("SELECT address_key, lat, lon FROM geocode_cache WHERE address_key = ANY(%s) AND status = 'ok'",
+                    (list(keys),))
+        found = {}
+        for key, lat, lon in cur.fetchall():
+            for value in keys[key]:
+                found[value] = (lat, lon)
+        self.stats['lookups'] += len(keys)
+        self.stats['cache_hits'] += len(found)
+        return found
+
+    def _cached_keys(self, cur, keys):
+        """Keys with a usable cache entry: found, or a miss/error that is not due for a retry."""
+        cur.execute("""
+            SELECT address_key FROM geocode_cache
+            WHERE address_key = ANY(%s)
+              AND (status = 'ok'
+                   OR (status = 'not_found' AND resolved_at > NOW() - %s * INTERVAL '1 day')
+                   OR (status = 'error' AND resolved_at > NOW() - %s * INTERVAL '1 minute'))
+        """, (list(keys), self.negative_ttl_days, ERROR_RETRY_MINUTES))
+        return {row[0] for row in cur.fetchall()}
+
+    def _resolve_one(self, address):
+        try:
+            point = self.backend.geocode(address)
+        except GeocoderUnavailable as e:
+            logger.warning('Geocoder %s failed for an address: %s', self.backend.name, e)
+            return 'error', None
+        return ('ok', point) if point is not None else ('not_found', None)
+
+    def resolve(self, addresses, time_budget=None):
+        """Resolves every address not yet cached and stores the results; returns a summary.
+
+        Addresses are deduplicated by normalized key and sent to the backend at most
+        `max_concurrency` at a time, in chunks that are committed as they finish. No
+        pooled connection is held while the backend runs. With a `time_budget` in
+        seconds, whatever is unresolved when it runs out is left to the pre-warm job
+        and counted as `deferred`.
+        """
+        keys = {}
+        for address in addresses:
+            if needs_geocoding(address):
+                key = normalize_address(address)
+                if key:
+                    keys.setdefault(key, address.strip())
+        summary = {'addresses': len(keys), 'cached': 0, 'resolved': 0, 'not_found': 0, 'errors': 0,
+                   'deferred': 0}
+        if not keys:
+            return summary
+
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cached = self._cached_keys(cur, keys)
+            conn.commit()
+        summary['cached'] = len(cached)
+        missing = [key for key in keys if key not in cached]
+
+        deadline = None if time_budget is None else time.monotonic() + time_budget
+        executor = self._get_executor() if missing else None
+        deferred = []
+        for start in range(0, len(missing), RESOLVE_CHUNK_SIZE):
+            chunk = missing[start:start + RESOLVE_CHUNK_SIZE]
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                deferred.extend(chunk)
+                continue
+            futures = {executor.submit(self._resolve_one, keys[key]): key for key in chunk}
+            done, pending = wait(futures, timeout=remaining)
+            for future in pending:
+                # Calls already running finish in the background; their result is not stored.
+                future.cancel()
+                deferred.append(futures[future])
+            rows = []
+            for future in done:
+                key = futures[future]
+                status, point = future.result()
+                summary[{'ok': 'resolved', 'not_found': 'not_found', 'error': 'errors'}[status]] += 1
+                rows.append((key, keys[key], point[0] if point else None, point[1] if point else None,
+                             status, self.backend.name))
+            if rows:
+                self._store(rows)
+        if deferred:
+            summary['deferred'] = len(deferred)
+            self.request_prewarm([keys[key] for key in deferred])
+
+        self.stats['resolved'] += summary['resolved']
+        self.stats['not_found'] += summary['not_found']
+        self.stats['backend_errors'] += summary['errors']
+        return summary
+
+    def _store(self, rows):
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                execute_values(cur, """
+                    INSERT INTO geocode_cache (address_key, address, lat, lon, status, provider)
+                    VALUES %s
+                    ON CONFLICT (address_key) DO UPDATE SET
+                        address = EXCLUDED.address, lat = EXCLUDED.lat, lon = EXCLUDED.lon,
+                        status = EXCLUDED.status, provider = EXCLUDED.provider, resolved_at = NOW()
+                """, rows)
+            conn.commit()
+
+    def results(self, cur, addresses):
+        """Cached entries for `addresses` as {address: {'lat', 'lon', 'status'}}, None if absent."""
+        keys = {normalize_address(a): a for a in addresses if needs_geocoding(a)}
+        cur.execute("SELECT address_key, lat, lon, status FROM geocode_cache WHERE address_key = ANY(%s)",
+                    (list(keys),))
+        rows = {key: {'lat': lat, 'lon': lon, 'status': status} for key, lat, lon, status in cur.fetchall()}
+        out = {}
+        for address in addresses:
+            point = parse_latlon(address)
+            if point is not None:
+                out[address] = {'lat': point[0], 'lon': point[1], 'status': 'coordinates'}
+            else:
+                out[address] = rows.get(normalize_address(address)) if address else None
+        return out
+
+    # ---- Pre-warm job ----
+
+    def request_prewarm(self, addresses=()):
+        """Asks the background job to geocode outstanding order and driver addresses, plus `addresses`."""
+        if addresses:
+            with self._lock:
+                self._deferred.update(addresses)
+        if self._prewarm_pid != os.getpid():
+            with self._lock:
+                if self._prewarm_pid != os.getpid():
+                    threading.Thread(target=self._run_prewarm, name='geocode-prewarm', daemon=True).start()
+                    self._prewarm_pid = os.getpid()
+        self._prewarm_requested.set()
+
+    def _run_prewarm(self):
+        while True:
+            self._prewarm_requested.wait()
+            # Requests made while a run is in progress coalesce into one follow-up run.
+            self._prewarm_requested.clear()
+            try:
+                self.prewarm()
+            except Exception:
+                self.stats['prewarm_errors'] += 1
+                logger.exception('Error pre-warming the geocode cache')
+
+    def prewarm(self):
+        """Resolves the free-text locations of pending orders, all driver addresses and deferred addresses."""
+        started = time.perf_counter()
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT DISTINCT location FROM (
+                        SELECT pickup_location_latlon AS location FROM orders WHERE status = 'Pending'
+                        UNION ALL
+                        SELECT drop_location_latlon FROM orders WHERE status = 'Pending'
+                        UNION ALL
+                        SELECT address FROM driver_master
+                    ) AS locations
+                    WHERE location IS NOT NULL AND btrim(location) <> '' AND location !~ %s
+                """, (COORDINATE_PATTERN,))
+                addresses = [row[0] for row in cur.fetchall()]
+            conn.commit()
+        with self._lock:
+            addresses.extend(self._deferred)
+            self._deferred.clear()
+        summary = self.resolve(addresses)
+        self.stats['prewarm_runs'] += 1
+        self.stats['last_prewarm_seconds'] = round(time.perf_counter() - started, 3)
+        self.stats['last_prewarm_addresses'] = summary['addresses']
+        return summary
+
+    def metrics(self):
+        return dict(self.stats, backend=self.backend.name, max_concurrency=self.max_concurrency,
+                    hit_rate=(self.stats['cache_hits'] / self.stats['lookups']) if self.stats['lookups'] else 0.0)
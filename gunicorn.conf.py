@@ -0,0 +1,12 @@
+# --------------------------------------------------------------------------------------
+# Gunicorn settings for the Procfile. APP_THREADS is the one concurrency knob: it sets
+# the request threads per worker here, and app.py sizes each worker's connection pool
+# and its live tracking stream cap from the same variable.
+# --------------------------------------------------------------------------------------
+
+import os
+
+os.environ.setdefault('APP_THREADS', '16')
+
+worker_class = 'gthread'
+threads = int(os.environ['APP_THREADS'])
@@ -0,0 +1,313 @@
+# --------------------------------------------------------------------------------------
+# Background order import jobs for the TMS application.
+# Uploads are saved to disk and handed to a per-process thread pool, so the HTTP
+# request returns immediately with a job id. Job state lives in the `import_jobs`
+# table, which lets any gunicorn worker answer /jobs/<id> for any job. A periodic
+# sweep picks up jobs orphaned by a worker that restarted or crashed: queued jobs are
+# requeued, and running jobs that stopped reporting progress are marked failed. A
+# running job touches its row every few seconds, including during the final merge,
+# so only a job whose worker is gone looks stale.
+# --------------------------------------------------------------------------------------
+
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2.extras import Json, RealDictCursor
+
+from order_import import import_orders, read_order_chunks
+
+logger = logging.getLogger(__name__)
+
+MAX_STORED_ERRORS = 200
+DEFAULT_STALE_MINUTES = 15
+DEFAULT_SWEEP_INTERVAL = 60.0
+# Upper bound on the seconds between a running job's heartbeats.
+MAX_HEARTBEAT_INTERVAL = 60.0
+
+# Marker for columns that should be set to the database server's NOW().
+NOW = object()
+
+
+def create_import_jobs_table(cur):
+    """Creates the table that tracks queued, running and finished imports."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            job_id VARCHAR(36) PRIMARY KEY,
+            filename VARCHAR(255),
+            file_path VARCHAR(500),
+            submitted_by VARCHAR(100),
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            total_bytes BIGINT DEFAULT 0,
+            bytes_processed BIGINT DEFAULT 0,
+            rows_processed INTEGER DEFAULT 0,
+            rows_rejected INTEGER DEFAULT 0,
+            rows_upserted INTEGER,
+            errors JSONB DEFAULT '[]'::jsonb,
+            report JSONB,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+    """)
+    cur.execute("ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT NOW()")
+    cur.execute("ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS report JSONB")
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_import_jobs_active ON import_jobs (updated_at)
+        WHERE status IN ('queued', 'running')
+    """)
+
+
+def _job_report(report):
+    """The parts of an import_orders report kept on the job row: timings and per-batch results."""
+    return Json({'elapsed_seconds': report.get('elapsed_seconds'),
+                 'rows_per_second': report.get('rows_per_second'),
+                 'batches': report['batches']})
+
+
+class _CountingReader:
+    """Wraps a binary file and counts the bytes handed to the CSV parser."""
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def __iter__(self):
+        return iter(self._fileobj)
+
+
+class ImportJobQueue:
+    """Runs order imports on a thread pool owned by the current process."""
+
+    def __init__(self, db_pool, upload_dir, max_workers=2, chunksize=5000, on_complete=None,
+                 stale_minutes=DEFAULT_STALE_MINUTES, sweep_interval=DEFAULT_SWEEP_INTERVAL):
+        self.db_pool = db_pool
+        self.upload_dir = upload_dir
+        self.max_workers = max_workers
+        self.chunksize = chunksize
+        self.on_complete = on_complete   # called with the import report after a successful job
+        # A queued or running job whose row has not changed for this long is orphaned.
+        self.stale_minutes = stale_minutes
+        self.sweep_interval = sweep_interval
+        self.heartbeat_interval = min(MAX_HEARTBEAT_INTERVAL, stale_minutes * 60 / 4)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._sweeper_pid = None
+        self.stats = {'sweeps': 0, 'requeued': 0, 'abandoned': 0, 'errors': 0}
+
+    def ensure_running(self):
+        """Starts the stale-job sweep once per process (and again after a fork)."""
+        if self._sweeper_pid == os.getpid():
+            return
+        with self._lock:
+            if self._sweeper_pid != os.getpid():
+                threading.Thread(target=self._sweep_loop, name='import-sweep', daemon=True).start()
+                self._sweeper_pid = os.getpid()
+
+    def _sweep_loop(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception:
+                self.stats['errors'] += 1
+                logger.exception('Error sweeping stale import jobs')
+            time.sleep(self.sweep_interval)
+
+    def _get_executor(self):
+        # Executors do not survive a fork, so each gunicorn worker builds its own.
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='order-import')
+                self._pid = os.getpid()
+            return self._executor
+
+    def submit(self, file_storage, submitted_by=None):
+        """Saves an uploaded file, records a queued job and schedules it."""
+        os.makedirs(self.upload_dir, exist_ok=True)
+        job_id = str(uuid.uuid4())
+        path = os.path.join(self.upload_dir, f'{job_id}.csv')
+        file_storage.save(path)
+
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO import_jobs (job_id, filename, file_path, submitted_by, total_bytes)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, (job_id, file_storage.filename, path, submitted_by, os.path.getsize(path)))
+            conn.commit()
+
+        self._get_executor().submit(self._run, job_id, path)
+        return job_id
+
+    def sweep(self):
+        """Requeues stale queued jobs here and fails stale running ones; returns (requeued, failed)."""
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                # The import commits once at the end, so an abandoned run left no orders behind.
+                cur.execute("""
+                    UPDATE import_jobs
+                    SET status = 'failed', finished_at = NOW(), updated_at = NOW(),
+                        errors = errors || %s::jsonb
+                    WHERE status = 'running' AND updated_at < NOW() - %s * INTERVAL '1 minute'
+                    RETURNING job_id, file_path
+                """, (Json([f'import abandoned: no progress for {self.stale_minutes:g} minutes']),
+                      self.stale_minutes))
+                abandoned = cur.fetchall()
+                # Touching the row keeps other workers' sweeps from requeueing it as well.
+                cur.execute("""
+                    UPDATE import_jobs SET updated_at = NOW()
+                    WHERE status = 'queued' AND updated_at < NOW() - %s * INTERVAL '1 minute'
+                    RETURNING job_id, file_path
+                """, (self.stale_minutes,))
+                requeued = cur.fetchall()
+            conn.commit()
+
+        for job_id, path in abandoned:
+            logger.warning('Order import job %s stopped making progress; marked failed', job_id)
+            self._remove_file(path)
+        missing = [job_id for job_id, path in requeued if not (path and os.path.exists(path))]
+        for job_id, path in requeued:
+            if job_id not in missing:
+                self._get_executor().submit(self._run, job_id, path)
+        for job_id in missing:
+            self._update(job_id, expect_status='queued', status='failed', finished_at=NOW,
+                         errors=Json(['import abandoned: the uploaded file is gone']))
+        self.stats['sweeps'] += 1
+        self.stats['requeued'] += len(requeued) - len(missing)
+        self.stats['abandoned'] += len(abandoned) + len(missing)
+        return len(requeued) - len(missing), len(abandoned) + len(missing)
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except (OSError, TypeError):
+            pass
+
+    def _claim(self, job_id):
+        """Marks a queued job running; False if another worker already started it."""
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE import_jobs SET status = 'running', started_at = NOW(), updated_at = NOW()
+                    WHERE job_id = %s AND status = 'queued'
+                """, (job_id,))
+                claimed = cur.rowcount == 1
+            conn.commit()
+        return claimed
+
+    def _update(self, job_id, expect_status=None, **fields):
+        """Sets columns on a job row; with `expect_status`, only while the job is in that status.
+
+        Returns whether the row was updated.
+        """
+        fields.setdefault('updated_at', NOW)
+        assignments = ', '.join(f'{name} = NOW()' if value is NOW else f'{name} = %s'
+                                for name, value in fields.items())
+        params = [value for value in fields.values() if value is not NOW]
+        condition = 'job_id = %s'
+        params.append(job_id)
+        if expect_status is not None:
+            condition += ' AND status = %s'
+            params.append(expect_status)
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"UPDATE import_jobs SET {assignments} WHERE {condition}", params)
+                updated = cur.rowcount == 1
+            conn.commit()
+        return updated
+
+    def _heartbeat(self, job_id, stop):
+        # Keeps a running job's row fresh while no batch reports progress, e.g. during the merge.
+        while not stop.wait(self.heartbeat_interval):
+            try:
+                if not self._update(job_id, expect_status='running'):
+                    return
+            except Exception:
+                logger.exception('Error recording heartbeat of order import job %s', job_id)
+
+    def _run(self, job_id, path):
+        if not self._claim(job_id):
+            return
+        errors = []
+        progress = None
+        last_flush = 0.0
+        stop = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job_id, stop),
+                         name=f'import-heartbeat-{job_id[:8]}', daemon=True).start()
+        try:
+            with open(path, 'rb') as raw, self.db_pool.connection() as conn:
+                reader = _CountingReader(raw)
+
+                def on_batch(report):
+                    nonlocal progress, last_flush
+                    progress = report
+                    errors.extend(report['batches'][-1]['errors'])
+                    now = time.monotonic()
+                    if now - last_flush >= 1.0:
+                        last_flush = now
+                        self._update(job_id, expect_status='running', rows_processed=report['rows_read'],
+                                     rows_rejected=report['rows_rejected'],
+                                     bytes_processed=reader.bytes_read,
+                                     errors=Json(errors[:MAX_STORED_ERRORS]), report=_job_report(report))
+
+                report = import_orders(conn, read_order_chunks(reader, self.chunksize),
+                                       batch_size=self.chunksize, on_batch=on_batch)
+
+            if not self._update(job_id, expect_status='running', status='finished', finished_at=NOW,
+                                rows_processed=report['rows_read'], rows_rejected=report['rows_rejected'],
+                                rows_upserted=report['rows_upserted'], bytes_processed=reader.bytes_read,
+                                errors=Json(errors[:MAX_STORED_ERRORS]), report=_job_report(report)):
+                logger.warning('Order import job %s finished after it was marked failed', job_id)
+            if self.on_complete is not None:
+                self.on_complete(report)
+        except Exception as e:
+            logger.exception('Order import job %s failed', job_id)
+            errors.append(f'import failed: {str(e).strip()}')
+            fields = {'report': _job_report(progress)} if progress is not None else {}
+            self._update(job_id, expect_status='running', status='failed', finished_at=NOW,
+                         errors=Json(errors[:MAX_STORED_ERRORS]), **fields)
+        finally:
+            stop.set()
+            self._remove_file(path)
+
+    def get(self, job_id):
+        """Returns the job row plus progress and ETA, or None if unknown.
+
+        `report` holds the import's elapsed_seconds and rows_per_second (once it
+        finished) and one {batch, rows, staged, rejected, errors} entry per batch.
+        """
+        with self.db_pool.connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT *, EXTRACT(EPOCH FROM (NOW() - started_at)) AS elapsed_seconds
+                    FROM import_jobs WHERE job_id = %s
+                """, (job_id,))
+                job = cur.fetchone()
+        if job is None:
+            return None
+
+        job = dict(job)
+        job.pop('file_path', None)
+        job.pop('updated_at', None)
+        total, done = job['total_bytes'] or 0, job['bytes_processed'] or 0
+        job['progress'] = round(done / total, 4) if total else None
+        job['eta_seconds'] = None
+        elapsed = float(job.pop('elapsed_seconds') or 0)
+        if job['status'] == 'running' and 0 < done < total:
+            job['eta_seconds'] = round(elapsed * (total - done) / done, 1)
+        for key in ('created_at', 'started_at', 'finished_at'):
+            if job[key] is not None:
+                job[key] = job[key].isoformat()
+        return job
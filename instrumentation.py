@@ -0,0 +1,334 @@
+# --------------------------------------------------------------------------------------
+# Request and SQL instrumentation for the TMS application.
+# Every request is timed into a per-route latency histogram, and every statement run
+# through a pooled connection is counted and timed against the request that issued it.
+# Statements slower than a threshold are logged with their literals and parameters
+# redacted. Everything is exposed in the Prometheus text format by `render()`, and an
+# opt-in sampler runs cProfile on one request in N and dumps the stats to disk.
+# Metrics are per worker process, like the other monitoring endpoints.
+# --------------------------------------------------------------------------------------
+
+import cProfile
+import itertools
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+# Seconds; roughly doubling so both cached pages and report queries land in a bucket.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+# Route label for statements issued outside a request (background jobs, streaming bodies).
+BACKGROUND_ROUTE = 'background'
+MAX_LOGGED_SQL_CHARS = 2000
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMERIC_LITERAL = re.compile(r"(?<![\w$.])-?\d+(?:\.\d+)?(?![\w.])")
+_WHITESPACE = re.compile(r'\s+')
+
+
+def redact_sql(sql):
+    """SQL text with string and numeric literals replaced by `?`, on one line."""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    elif not isinstance(sql, str):
+        sql = str(sql)
+    sql = _NUMERIC_LITERAL.sub('?', _STRING_LITERAL.sub("'?'", sql))
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    return sql if len(sql) <= MAX_LOGGED_SQL_CHARS else sql[:MAX_LOGGED_SQL_CHARS] + '...'
+
+
+def redact_params(params):
+    """Parameter shapes without their values, e.g. `[str, int]`."""
+    if params is None:
+        return 'none'
+    if isinstance(params, dict):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}' for key, value in params.items()) + '}'
+    try:
+        count = len(params)
+    except TypeError:
+        return type(params).__name__
+    if count > 20:
+        return f'[{count} values]'
+    return '[' + ', '.join(type(value).__name__ for value in params) + ']'
+
+
+class Histogram:
+    """Cumulative Prometheus histogram with one series per label tuple."""
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._series = {}          # labels -> [bucket counts..., sum, count]
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, series in sorted(self._series.items()):
+            base = _format_labels(self.label_names, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_add_label(base, "le", _format_value(bound))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_add_label(base, "le", "+Inf")} {series[-1]}')
+            lines.append(f'{self.name}_sum{base} {_format_value(series[-2])}')
+            lines.append(f'{self.name}_count{base} {series[-1]}')
+        return lines
+
+
+class Counter:
+    """Prometheus counter with one series per label tuple."""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._series = {}
+
+    def inc(self, labels, amount=1):
+        self._series[labels] = self._series.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self._series.items()):
+            lines.append(f'{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}')
+        return lines
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape_label(v)}"' for n, v in zip(names, values)) + '}'
+
+
+def _add_label(base, name, value):
+    label = f'{name}="{value}"'
+    return '{' + label + '}' if not base else base[:-1] + ',' + label + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(int(value))
+
+
+def render_gauges(prefix, stats):
+    """Numeric entries of a component's stats dict as gauges, e.g. db_pool.metrics()."""
+    lines = []
+    for key, value in sorted(stats.items()):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        name = f'{prefix}_{re.sub("[^a-zA-Z0-9_]", "_", key)}'
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name} {_format_value(float(value))}')
+    return lines
+
+
+# -------------------------- Cursor and connection wrappers --------------------------
+
+class _TimedCursorMixin:
+    """Times execute/executemany/callproc/copy_expert and reports them to the connection's instrumentation."""
+
+    def _timed(self, method, query, args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self.connection.instrumentation.record_query(query, args[1] if len(args) > 1 else None,
+                                                        time.perf_counter() - started)
+
+    def execute(self, query, vars=None):
+        return self._timed(super().execute, query, (query, vars))
+
+    def executemany(self, query, vars_list):
+        return self._timed(super().executemany, query, (query, vars_list))
+
+    def callproc(self, procname, parameters=None):
+        return self._timed(super().callproc, procname, (procname, parameters))
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            self.connection.instrumentation.record_query(sql, None, time.perf_counter() - started)
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """Connection whose cursors, whatever their `cursor_factory`, are timed."""
+
+    instrumentation = None
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = self.instrumentation.cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+
+# -------------------------- Instrumentation --------------------------
+
+class Instrumentation:
+    """Collects request latency, per-request SQL usage, slow queries and sampled profiles."""
+
+    def __init__(self, slow_query_ms=500.0, profile_sample_rate=0, profile_dir='profiles', profile_keep=200):
+        self.slow_query_seconds = slow_query_ms / 1000.0
+        self.profile_sample_rate = int(profile_sample_rate)
+        self.profile_dir = profile_dir
+        self.profile_keep = profile_keep
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._cursor_classes = {}
+        self._request_counter = itertools.count(1)
+        self._profiles = deque()
+        self.connection_class = type('InstrumentedConnection', (InstrumentedConnection,), {'instrumentation': self})
+
+        self.request_latency = Histogram(
+            'tms_http_request_duration_seconds', 'Time to produce a response, by route.',
+            ('route', 'method'), LATENCY_BUCKETS)
+        self.requests = Counter(
+            'tms_http_requests_total', 'Requests handled, by route and status.', ('route', 'method', 'status'))
+        self.request_queries = Histogram(
+            'tms_http_request_db_queries', 'SQL statements issued per request, by route.',
+            ('route',), QUERY_COUNT_BUCKETS)
+        self.request_db_time = Histogram(
+            'tms_http_request_db_seconds', 'Time spent in SQL per request, by route.',
+            ('route',), LATENCY_BUCKETS)
+        self.queries = Counter('tms_db_queries_total', 'SQL statements executed, by route.', ('route',))
+        self.query_time = Counter('tms_db_query_seconds_total', 'Time spent in SQL, by route.', ('route',))
+        self.slow_queries = Counter(
+            'tms_db_slow_queries_total', 'SQL statements slower than the slow-query threshold.', ('route',))
+        self.stats = {'profiles_written': 0, 'profiles_skipped': 0}
+
+    def cursor_class(self, base):
+        """A subclass of cursor class `base` that reports its statements; cached per base."""
+        cls = self._cursor_classes.get(base)
+        if cls is None:
+            cls = type(f'Timed{base.__name__}', (_TimedCursorMixin, base), {})
+            self._cursor_classes[base] = cls
+        return cls
+
+    # ---- Per-request state ----
+
+    def begin_request(self, route):
+        """Starts counting SQL for the request handled by this thread."""
+        local = self._local
+        local.route = route
+        local.queries = 0
+        local.db_seconds = 0.0
+        local.started = time.perf_counter()
+
+    def end_request(self, method, status):
+        """Records the request begun on this thread; returns (seconds, queries, db_seconds)."""
+        local = self._local
+        route = getattr(local, 'route', None)
+        if route is None:
+            return None
+        elapsed = time.perf_counter() - local.started
+        queries, db_seconds = local.queries, local.db_seconds
+        local.route = None
+        with self._lock:
+            self.request_latency.observe((route, method), elapsed)
+            self.requests.inc((route, method, str(status)))
+            self.request_queries.observe((route,), queries)
+            self.request_db_time.observe((route,), db_seconds)
+        return elapsed, queries, db_seconds
+
+    def record_query(self, sql, params, seconds):
+        local = self._local
+        route = getattr(local, 'route', None)
+        if route is not None:
+            local.queries += 1
+            local.db_seconds += seconds
+        else:
+            route = BACKGROUND_ROUTE
+        slow = seconds >= self.slow_query_seconds
+        with self._lock:
+            self.queries.inc((route,))
+            self.query_time.inc((route,), seconds)
+            if slow:
+                self.slow_queries.inc((route,))
+        if slow:
+            logger.warning('Slow query (%.1f ms, route %s): %s params=%s',
+                           seconds * 1000, route, redact_sql(sql), redact_params(params))
+
+    # ---- Sampling profiler ----
+
+    def start_profile(self):
+        """Returns an enabled cProfile.Profile for one request in `profile_sample_rate`, else None."""
+        if self.profile_sample_rate <= 0 or next(self._request_counter) % self.profile_sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active (Python 3.12+ allows only one at a time).
+            self.stats['profiles_skipped'] += 1
+            return None
+        return profile
+
+    def finish_profile(self, profile, route):
+        """Stops `profile` and dumps it as a pstats file, keeping the newest `profile_keep`.
+
+        The files load directly into snakeviz, flameprof or gprof2dot for flame graphs.
+        """
+        profile.disable()
+        os.makedirs(self.profile_dir, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+        path = os.path.join(self.profile_dir, f'{slug}-{time.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}-'
+                                              f'{threading.get_ident()}.prof')
+        try:
+            profile.dump_stats(path)
+        except OSError as e:
+            logger.warning('Could not write profile %s: %s', path, e)
+            return None
+        with self._lock:
+            self.stats['profiles_written'] += 1
+            self._profiles.append(path)
+            expired = [self._profiles.popleft() for _ in range(len(self._profiles) - self.profile_keep)]
+        for old in expired:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+        return path
+
+    # ---- Exposition ----
+
+    def render(self, gauges=None):
+        """Prometheus text exposition; `gauges` maps a metric prefix to a component stats dict."""
+        with self._lock:
+            lines = []
+            for metric in (self.request_latency, self.requests, self.request_queries, self.request_db_time,
+                           self.queries, self.query_time, self.slow_queries):
+                lines.extend(metric.render())
+            lines.extend(render_gauges('tms_profiler', self.stats))
+        for prefix, stats in (gauges or {}).items():
+            lines.extend(render_gauges(prefix, stats))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,234 @@
+# --------------------------------------------------------------------------------------
+# Load consolidation: packs pending orders onto active fleet vehicles by weight and
+# volume before routing (two-dimensional vector bin packing).
+# The default mode is a NumPy first-fit-decreasing heuristic that handles thousands
+# of orders and vehicles in well under a second. An exact mode solves the same
+# problem with OR-Tools CP-SAT under a time limit, warm-started from the heuristic.
+# Orders and vehicles are held as parallel NumPy arrays rather than per-row dicts.
+# --------------------------------------------------------------------------------------
+
+import time
+
+import numpy as np
+from ortools.sat.python import cp_model
+
+from route_optimizer import PRIORITY_WEIGHTS, VOLUME_SCALE
+
+DEFAULT_TIME_LIMIT_SECONDS = 5
+# CP-SAT gets one boolean per (order, vehicle) pair that fits; past this it is too slow.
+DEFAULT_EXACT_MAX_PAIRS = 200_000
+PACKING_MODES = ('ffd', 'exact')
+
+# Weights are solved in units of 0.1 kg so CP-SAT can work with integers.
+WEIGHT_SCALE = 10
+
+
+def load_packing_inputs(cur):
+    """Fetches pending orders and active vehicles as column arrays; returns (orders, vehicles)."""
+    cur.execute("""
+        SELECT order_id, COALESCE(weight_kg, 0), COALESCE(volume_cbm, 0), delivery_priority
+        FROM orders
+        WHERE status = 'Pending'
+        ORDER BY order_id
+    """)
+    rows = cur.fetchall()
+    orders = {
+        'order_id': np.array([r[0] for r in rows], dtype=object),
+        'weight_kg': np.array([r[1] for r in rows], dtype=float),
+        'volume_cbm': np.array([r[2] for r in rows], dtype=float),
+        'priority': np.array([PRIORITY_WEIGHTS.get(r[3], 1) for r in rows], dtype=np.int64),
+    }
+    cur.execute("""
+        SELECT vehicle_id, COALESCE(capacity_weight_kg, 0), COALESCE(capacity_vol_cbm, 0)
+        FROM fleet
+        WHERE status = 'Active'
+        ORDER BY vehicle_id
+    """)
+    rows = cur.fetchall()
+    vehicles = {
+        'vehicle_id': np.array([r[0] for r in rows], dtype=object),
+        'capacity_weight_kg': np.array([r[1] for r in rows], dtype=float),
+        'capacity_vol_cbm': np.array([r[2] for r in rows], dtype=float),
+    }
+    return orders, vehicles
+
+
+def _packing_order(orders, vehicles):
+    """Orders sorted by priority, then by size relative to a typical vehicle, largest first."""
+    typical_w = np.median(vehicles['capacity_weight_kg']) or 1.0
+    typical_v = np.median(vehicles['capacity_vol_cbm']) or 1.0
+    size = np.maximum(orders['weight_kg'] / typical_w, orders['volume_cbm'] / typical_v)
+    return np.lexsort((-size, -orders['priority']))
+
+
+def first_fit_decreasing(orders, vehicles):
+    """Assigns each order to the first vehicle with room for it; returns vehicle indexes (-1 if none).
+
+    Vehicles are opened largest first, so freight is consolidated onto as few
+    vehicles as possible. Each placement is one vectorized scan of the remaining
+    capacities.
+    """
+    assignment = np.full(len(orders['order_id']), -1, dtype=np.int64)
+    if not len(assignment) or not len(vehicles['vehicle_id']):
+        return assignment
+
+    cap_w, cap_v = vehicles['capacity_weight_kg'], vehicles['capacity_vol_cbm']
+    typical_w = np.median(cap_w) or 1.0
+    typical_v = np.median(cap_v) or 1.0
+    bins = np.lexsort((np.arange(len(cap_w)), -(cap_w / typical_w + cap_v / typical_v)))
+    remaining_w, remaining_v = cap_w[bins].copy(), cap_v[bins].copy()
+
+    weight, volume = orders['weight_kg'], orders['volume_cbm']
+    for i in _packing_order(orders, vehicles):
+        fits = (remaining_w >= weight[i]) & (remaining_v >= volume[i])
+        slot = fits.argmax()
+        if fits[slot]:
+            remaining_w[slot] -= weight[i]
+            remaining_v[slot] -= volume[i]
+            assignment[i] = bins[slot]
+    return assignment
+
+
+def exact_pack(orders, vehicles, time_limit=DEFAULT_TIME_LIMIT_SECONDS, max_pairs=DEFAULT_EXACT_MAX_PAIRS,
+               hint=None, workers=8):
+    """Solves the packing with CP-SAT; returns (assignment, status).
+
+    Maximizes priority-weighted orders loaded, then minimizes vehicles used.
+    Demands are rounded up and capacities down to integer units, so every
+    solution is feasible in real units. Raises ValueError when the instance has
+    more than `max_pairs` candidate (order, vehicle) pairs.
+    """
+    n, m = len(orders['order_id']), len(vehicles['vehicle_id'])
+    weight = np.ceil(orders['weight_kg'] * WEIGHT_SCALE).astype(np.int64)
+    volume = np.ceil(orders['volume_cbm'] * VOLUME_SCALE).astype(np.int64)
+    cap_w = np.floor(vehicles['capacity_weight_kg'] * WEIGHT_SCALE).astype(np.int64)
+    cap_v = np.floor(vehicles['capacity_vol_cbm'] * VOLUME_SCALE).astype(np.int64)
+
+    # Only pairs where the order fits the empty vehicle get a variable.
+    fits = (weight[:, None] <= cap_w[None, :]) & (volume[:, None] <= cap_v[None, :])
+    pairs = np.argwhere(fits)
+    if len(pairs) > max_pairs:
+        raise ValueError(f'Exact mode supports up to {max_pairs} order/vehicle pairs; '
+                         f'this load has {len(pairs)}. Use mode=ffd.')
+
+    model = cp_model.CpModel()
+    used = [model.NewBoolVar(f'used_{j}') for j in range(m)]
+    x = {(int(i), int(j)): model.NewBoolVar(f'x_{i}_{j}') for i, j in pairs}
+    by_order, by_vehicle = [[] for _ in range(n)], [[] for _ in range(m)]
+    for (i, j), var in x.items():
+        by_order[i].append(var)
+        by_vehicle[j].append((i, var))
+
+    for i in range(n):
+        if by_order[i]:
+            model.AddAtMostOne(by_order[i])
+    for j in range(m):
+        if not by_vehicle[j]:
+            model.Add(used[j] == 0)
+            continue
+        model.Add(sum(int(weight[i]) * var for i, var in by_vehicle[j]) <= int(cap_w[j]) * used[j])
+        model.Add(sum(int(volume[i]) * var for i, var in by_vehicle[j]) <= int(cap_v[j]) * used[j])
+        for i, var in by_vehicle[j]:
+            if weight[i] == 0 and volume[i] == 0:
+                model.AddImplication(var, used[j])
+    # Identical vehicles are interchangeable; use them in index order.
+    for j in range(m - 1):
+        if cap_w[j] == cap_w[j + 1] and cap_v[j] == cap_v[j + 1]:
+            model.Add(used[j] >= used[j + 1])
+
+    loaded = sum(int(orders['priority'][i]) * var for (i, _), var in x.items())
+    model.Maximize(loaded * (m + 1) - sum(used))
+
+    if hint is not None:
+        for (i, j), var in x.items():
+            model.AddHint(var, int(hint[i] == j))
+
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = float(time_limit)
+    solver.parameters.num_workers = workers
+    status = solver.Solve(model)
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return None, solver.StatusName(status).lower()
+
+    assignment = np.full(n, -1, dtype=np.int64)
+    for (i, j), var in x.items():
+        if solver.BooleanValue(var):
+            assignment[i] = j
+    return assignment, 'optimal' if status == cp_model.OPTIMAL else 'feasible'
+
+
+def _score(orders, assignment, m):
+    """The exact mode's objective: priority-weighted orders loaded, then fewest vehicles."""
+    assigned = assignment >= 0
+    return int(orders['priority'][assigned].sum()) * (m + 1) - len(np.unique(assignment[assigned]))
+
+
+def summarize_packing(orders, vehicles, assignment):
+    """Per-vehicle loads and utilization percentages for an assignment."""
+    m = len(vehicles['vehicle_id'])
+    assigned = assignment >= 0
+    target = assignment[assigned]
+    load_w = np.bincount(target, weights=orders['weight_kg'][assigned], minlength=m)
+    load_v = np.bincount(target, weights=orders['volume_cbm'][assigned], minlength=m)
+    count = np.bincount(target, minlength=m)
+    cap_w, cap_v = vehicles['capacity_weight_kg'], vehicles['capacity_vol_cbm']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct_w = np.where(cap_w > 0, load_w / cap_w * 100, 0.0)
+        pct_v = np.where(cap_v > 0, load_v / cap_v * 100, 0.0)
+
+    # Order IDs grouped by vehicle in one sort.
+    grouped = np.argsort(assignment, kind='stable')
+    grouped = grouped[assignment[grouped] >= 0]
+    bounds = np.concatenate(([0], np.cumsum(count)))
+
+    used = np.flatnonzero(count)
+    used = used[np.argsort(-np.maximum(pct_w[used], pct_v[used]), kind='stable')]
+    loads = [{
+        'vehicle_id': vehicles['vehicle_id'][j],
+        'orders': int(count[j]),
+        'order_ids': orders['order_id'][grouped[bounds[j]:bounds[j + 1]]].tolist(),
+        'weight_kg': round(float(load_w[j]), 2),
+        'volume_cbm': round(float(load_v[j]), 3),
+        'capacity_weight_kg': float(cap_w[j]),
+        'capacity_vol_cbm': float(cap_v[j]),
+        'weight_utilization_pct': round(float(pct_w[j]), 1),
+        'volume_utilization_pct': round(float(pct_v[j]), 1),
+        'utilization_pct': round(float(max(pct_w[j], pct_v[j])), 1),
+    } for j in used]
+
+    total_w, total_v = cap_w[used].sum(), cap_v[used].sum()
+    summary = {
+        'orders': int(len(assignment)),
+        'orders_loaded': int(assigned.sum()),
+        'orders_unassigned': int((~assigned).sum()),
+        'vehicles_available': int(m),
+        'vehicles_used': int(len(used)),
+        'weight_utilization_pct': round(float(load_w.sum() / total_w * 100), 1) if total_w > 0 else 0.0,
+        'volume_utilization_pct': round(float(load_v.sum() / total_v * 100), 1) if total_v > 0 else 0.0,
+    }
+    return {'summary': summary, 'vehicles': loads,
+            'unassigned_order_ids': orders['order_id'][~assigned].tolist()}
+
+
+def consolidate(orders, vehicles, mode='ffd', time_limit=DEFAULT_TIME_LIMIT_SECONDS,
+                max_pairs=DEFAULT_EXACT_MAX_PAIRS):
+    """Packs `orders` onto `vehicles` and returns the utilization summary.
+
+    `mode='exact'` refines the heuristic with CP-SAT and keeps the heuristic
+    result if the solver finds nothing better within `time_limit` (its integer
+    rounding can make the hint itself slightly infeasible).
+    """
+    if mode not in PACKING_MODES:
+        raise ValueError(f'Unknown consolidation mode: {mode}')
+    started = time.perf_counter()
+    assignment = first_fit_decreasing(orders, vehicles)
+    status = 'heuristic'
+    if mode == 'exact' and len(assignment) and len(vehicles['vehicle_id']):
+        exact, solver_status = exact_pack(orders, vehicles, time_limit=time_limit, max_pairs=max_pairs,
+                                          hint=assignment)
+        m = len(vehicles['vehicle_id'])
+        if exact is not None and _score(orders, exact, m) >= _score(orders, assignment, m):
+            assignment, status = exact, solver_status
+    result = summarize_packing(orders, vehicles, assignment)
+    result.update(mode=mode, status=status, solve_seconds=round(time.perf_counter() - started, 3))
+    return result
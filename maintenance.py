@@ -0,0 +1,241 @@
+# --------------------------------------------------------------------------------------
+# Vehicle maintenance, service history and tyre records.
+# These used to live in module-level lists, which were lost on restart and differed
+# between gunicorn workers. They are now tables, and every filter on the maintenance
+# and tyre pages runs in SQL against an index: vehicle ID and driver prefixes, status,
+# and next_service_due for the "due for service within N days" query.
+# --------------------------------------------------------------------------------------
+
+from datetime import date, timedelta
+
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+
+MAINTENANCE_STATUSES = ('Pending', 'In Progress', 'Completed')
+TYRE_STATUSES = ('Installed', 'Spare', 'Repair')
+
+MAINTENANCE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_vehicle_maintenance_vehicle_id ON vehicle_maintenance (vehicle_id)",
+    "CREATE INDEX IF NOT EXISTS idx_vehicle_maintenance_vehicle_prefix "
+    "ON vehicle_maintenance (lower(vehicle_id) text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_vehicle_maintenance_driver_prefix "
+    "ON vehicle_maintenance (lower(assigned_driver) text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_vehicle_maintenance_status_due "
+    "ON vehicle_maintenance (status, next_service_due, id)",
+    "CREATE INDEX IF NOT EXISTS idx_vehicle_maintenance_next_service_due "
+    "ON vehicle_maintenance (next_service_due, id)",
+    "CREATE INDEX IF NOT EXISTS idx_service_records_maintenance "
+    "ON service_records (maintenance_id, service_date DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_service_records_vehicle_id ON service_records (vehicle_id, service_date DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_tyres_vehicle_id ON tyres (vehicle_id, position)",
+    "CREATE INDEX IF NOT EXISTS idx_tyres_status ON tyres (status, vehicle_id)",
+]
+
+
+def create_maintenance_tables(cur):
+    """Creates the maintenance, service history and tyre tables with their indexes."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS vehicle_maintenance (
+            id SERIAL PRIMARY KEY,
+            vehicle_id VARCHAR(50) NOT NULL,
+            vehicle_type VARCHAR(50),
+            model VARCHAR(100),
+            manufacturer VARCHAR(100),
+            year INTEGER,
+            current_mileage INTEGER,
+            last_service_date DATE,
+            next_service_due DATE,
+            service_type VARCHAR(100),
+            status VARCHAR(20),
+            parts_replaced TEXT,
+            service_cost NUMERIC(12, 2) DEFAULT 0,
+            assigned_driver VARCHAR(100),
+            condition VARCHAR(50),
+            notes TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS service_records (
+            id SERIAL PRIMARY KEY,
+            maintenance_id INTEGER NOT NULL REFERENCES vehicle_maintenance(id) ON DELETE CASCADE,
+            vehicle_id VARCHAR(50) NOT NULL,
+            service_date DATE NOT NULL,
+            next_service_due DATE NOT NULL,
+            service_type VARCHAR(100),
+            status VARCHAR(20),
+            parts_replaced TEXT,
+            service_cost NUMERIC(12, 2) DEFAULT 0,
+            notes TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS tyres (
+            serial_number VARCHAR(50) PRIMARY KEY,
+            vehicle_id VARCHAR(50) NOT NULL,
+            position VARCHAR(50),
+            status VARCHAR(20),
+            installed_on DATE,
+            km_run INTEGER DEFAULT 0,
+            last_inspection DATE,
+            condition VARCHAR(50)
+        );
+    """)
+    for statement in MAINTENANCE_INDEXES:
+        cur.execute(statement)
+
+
+def _prefix_pattern(value):
+    """LIKE pattern matching values that start with `value`, case-insensitively."""
+    escaped = value.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '%'
+
+
+def _parse_date(value):
+    return date.fromisoformat(value) if value else None
+
+
+# -------------------------- Maintenance records --------------------------
+
+def parse_maintenance_args(args):
+    """Extracts the maintenance page filters; raises ValueError for a bad `due_in_days`."""
+    due_in_days = args.get('due_in_days', '').strip()
+    if due_in_days:
+        try:
+            due_in_days = int(due_in_days)
+        except ValueError:
+            raise ValueError('due_in_days must be a whole number of days')
+        if due_in_days < 0:
+            raise ValueError('due_in_days cannot be negative')
+    try:
+        limit = min(max(int(args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        limit = DEFAULT_PAGE_SIZE
+    filters = {'vehicle_id': args.get('vehicle_id', '').strip(),
+               'assigned_driver': args.get('assigned_driver', '').strip(),
+               'status': args.get('status', '').strip(),
+               'due_in_days': due_in_days}
+    return filters, limit
+
+
+def fetch_maintenance(cur, filters, limit=DEFAULT_PAGE_SIZE):
+    """Maintenance records matching `filters`, soonest service first.
+
+    Each row carries the nightly batch's predicted service and tyre replacement
+    dates from `maintenance_predictions` (see predictive_maintenance.py).
+
+    `due_in_days` keeps records whose next service falls on or before today + N
+    days (overdue ones included), which is a range scan on next_service_due.
+    """
+    clauses, params = [], []
+    if filters.get('vehicle_id'):
+        clauses.append("lower(m.vehicle_id) LIKE %s")
+        params.append(_prefix_pattern(filters['vehicle_id']))
+    if filters.get('assigned_driver'):
+        clauses.append("lower(m.assigned_driver) LIKE %s")
+        params.append(_prefix_pattern(filters['assigned_driver']))
+    if filters.get('status'):
+        clauses.append("m.status = %s")
+        params.append(filters['status'])
+    if filters.get('due_in_days') not in (None, ''):
+        clauses.append("m.next_service_due <= %s")
+        params.append(date.today() + timedelta(days=filters['due_in_days']))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    cur.execute(f"""
+        SELECT m.*, p.next_service_date AS predicted_service_date, p.km_to_service,
+               p.next_tyre_replacement, p.tyre_serial
+        FROM vehicle_maintenance AS m
+        LEFT JOIN maintenance_predictions AS p ON p.vehicle_id = m.vehicle_id
+        {where}
+        ORDER BY m.next_service_due ASC NULLS LAST, m.id ASC
+        LIMIT %s
+    """, params + [limit])
+    return cur.fetchall()
+
+
+def get_maintenance(cur, maintenance_id):
+    """The maintenance record with `maintenance_id`, or None."""
+    cur.execute("SELECT * FROM vehicle_maintenance WHERE id = %s", (maintenance_id,))
+    return cur.fetchone()
+
+
+def insert_maintenance(cur, form):
+    """Inserts a maintenance record from the add-vehicle form; returns its id."""
+    cur.execute("""
+        INSERT INTO vehicle_maintenance (
+            vehicle_id, vehicle_type, model, manufacturer, year, current_mileage,
+            last_service_date, next_service_due, service_type, status, parts_replaced,
+            service_cost, assigned_driver, condition, notes
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING id
+    """, (
+        form['vehicle_id'], form.get('vehicle_type'), form.get('model'), form.get('manufacturer'),
+        int(form['year']) if form.get('year') else None,
+        int(form['current_mileage']) if form.get('current_mileage') else None,
+        _parse_date(form.get('last_service_date')), _parse_date(form.get('next_service_due')),
+        form.get('service_type'), form.get('status'), form.get('parts_replaced'),
+        float(form.get('service_cost') or 0), form.get('assigned_driver'), form.get('condition'),
+        form.get('notes')
+    ))
+    return cur.fetchone()[0]
+
+
+def add_service_record(cur, maintenance, form):
+    """Stores a service and rolls its dates, status and cost onto the maintenance record."""
+    service = (
+        _parse_date(form['service_date']), _parse_date(form['next_service_due']), form.get('service_type'),
+        form.get('status'), form.get('parts_replaced'), float(form.get('service_cost') or 0), form.get('notes')
+    )
+    cur.execute("""
+        INSERT INTO service_records (
+            maintenance_id, vehicle_id, service_date, next_service_due, service_type, status,
+            parts_replaced, service_cost, notes
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, (maintenance['id'], maintenance['vehicle_id']) + service)
+    cur.execute("""
+        UPDATE vehicle_maintenance SET
+            last_service_date = %s, next_service_due = %s, service_type = %s, status = %s,
+            parts_replaced = %s, service_cost = %s, notes = %s
+        WHERE id = %s
+    """, service + (maintenance['id'],))
+
+
+def delete_maintenance(cur, maintenance_id):
+    """Deletes a maintenance record and its service history; returns whether it existed."""
+    cur.execute("DELETE FROM vehicle_maintenance WHERE id = %s", (maintenance_id,))
+    return cur.rowcount > 0
+
+
+# -------------------------- Tyres --------------------------
+
+def fetch_tyres(cur, filters, limit=DEFAULT_PAGE_SIZE):
+    """Tyres filtered by exact vehicle ID and status, grouped by vehicle."""
+    clauses, params = [], []
+    if filters.get('vehicle_id'):
+        clauses.append("vehicle_id = %s")
+        params.append(filters['vehicle_id'])
+    if filters.get('status'):
+        clauses.append("status = %s")
+        params.append(filters['status'])
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    cur.execute(f"""
+        SELECT * FROM tyres
+        {where}
+        ORDER BY vehicle_id, position, serial_number
+        LIMIT %s
+    """, params + [limit])
+    return cur.fetchall()
+
+
+def insert_tyre(cur, form):
+    """Inserts a tyre from the tyre management form."""
+    cur.execute("""
+        INSERT INTO tyres (serial_number, vehicle_id, position, status, installed_on, km_run,
+                           last_inspection, condition)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """, (
+        form['serial_number'], form['vehicle_id'], form.get('position'), form.get('status'),
+        _parse_date(form['installed_on']), int(form.get('km_run') or 0),
+        _parse_date(form['last_inspection']), form.get('condition')
+    ))
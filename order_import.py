@@ -0,0 +1,212 @@
+# --------------------------------------------------------------------------------------
+# Bulk order import for the TMS application.
+# Uploaded CSV rows are validated in batches with pandas, streamed into a temporary
+# staging table with COPY FROM STDIN and merged into `orders` with a single
+# set-based upsert, instead of one INSERT ... ON CONFLICT per row.
+# --------------------------------------------------------------------------------------
+
+import io
+import time
+
+import pandas as pd
+import psycopg2
+
+# CSV header -> orders column, in the order the columns are copied.
+ORDER_COLUMNS = {
+    'Order_ID': 'order_id',
+    'Customer_Name': 'customer_name',
+    'created_date': 'created_date',
+    'Order_Type': 'order_type',
+    'Pickup_Location_LatLon': 'pickup_location_latlon',
+    'Drop_Location_LatLon': 'drop_location_latlon',
+    'Volume_CBM': 'volume_cbm',
+    'Weight_KG': 'weight_kg',
+    'Delivery_Priority': 'delivery_priority',
+    'Expected_Delivery': 'expected_delivery',
+    'amount': 'amount',
+    'Status': 'status',
+}
+NUMERIC_COLUMNS = ['Volume_CBM', 'Weight_KG', 'amount']
+DATE_COLUMNS = ['created_date', 'Expected_Delivery']
+
+# Explicit dtypes skip pandas' type inference and keep memory per chunk predictable.
+# Numeric and date columns are read as text and coerced in validate_batch so a bad
+# value rejects one row instead of failing the whole chunk.
+ORDER_DTYPES = {
+    'Order_ID': str,
+    'Customer_Name': str,
+    'created_date': str,
+    'Order_Type': 'category',
+    'Pickup_Location_LatLon': str,
+    'Drop_Location_LatLon': str,
+    'Volume_CBM': str,
+    'Weight_KG': str,
+    'Delivery_Priority': 'category',
+    'Expected_Delivery': str,
+    'amount': str,
+    'Status': 'category',
+}
+
+DEFAULT_BATCH_SIZE = 5000
+MAX_ERRORS_PER_BATCH = 20
+
+
+def read_order_chunks(file, chunksize=DEFAULT_BATCH_SIZE):
+    """Streams an uploaded CSV as DataFrames of at most `chunksize` rows.
+
+    Only the order columns are parsed, so peak memory depends on the chunk size
+    and not on the size of the upload.
+    """
+    return pd.read_csv(
+        file,
+        chunksize=chunksize,
+        dtype=ORDER_DTYPES,
+        usecols=lambda col: col in ORDER_COLUMNS,
+        keep_default_na=False,
+        na_values=[''],
+    )
+
+
+def iter_batches(df, batch_size=DEFAULT_BATCH_SIZE):
+    """Splits a DataFrame into consecutive slices of at most `batch_size` rows."""
+    for start in range(0, len(df), batch_size):
+        yield df.iloc[start:start + batch_size]
+
+
+def validate_batch(df, row_offset=0):
+    """Coerces a batch to the orders column types and drops rows that cannot be loaded.
+
+    Returns the cleaned frame (with database column names) and a list of error
+    messages that reference the 1-based data row number in the uploaded file.
+    """
+    missing = [col for col in ORDER_COLUMNS if col not in df.columns]
+    if missing:
+        raise ValueError(f"Missing columns in upload: {', '.join(missing)}")
+
+    df = df[list(ORDER_COLUMNS)].copy()
+    bad = pd.Series(False, index=df.index)
+    reasons = pd.Series('', index=df.index, dtype=object)
+
+    order_ids = df['Order_ID'].astype('string').str.strip()
+    no_id = order_ids.isna() | (order_ids == '')
+    bad |= no_id
+    reasons.loc[no_id] += 'missing Order_ID; '
+    df['Order_ID'] = order_ids
+
+    for col in NUMERIC_COLUMNS:
+        converted = pd.to_numeric(df[col], errors='coerce')
+        invalid = converted.isna() & df[col].notna()
+        bad |= invalid
+        reasons.loc[invalid] += f'invalid {col}; '
+        df[col] = converted
+
+    # Dates are only checked here; the raw text goes to Postgres so the time of day and
+    # any UTC offset survive. format='mixed' parses each value on its own instead of
+    # inferring one format per chunk, and utc=True lets offsets differ between rows.
+    for col in DATE_COLUMNS:
+        raw = df[col].str.strip()
+        converted = pd.to_datetime(raw, errors='coerce', format='mixed', utc=True)
+        invalid = converted.isna() & raw.notna() & (raw != '')
+        bad |= invalid
+        reasons.loc[invalid] += f'invalid {col}; '
+        df[col] = raw.where(raw != '')
+
+    errors = [
+        f"row {row_offset + pos + 1}: {reasons.iloc[pos].rstrip('; ')}"
+        for pos in range(len(df)) if bad.iloc[pos]
+    ]
+    clean = df[~bad].rename(columns=ORDER_COLUMNS)
+    return clean, errors
+
+
+def _create_staging_table(cur):
+    cur.execute("""
+        CREATE TEMP TABLE orders_staging
+        (LIKE orders INCLUDING DEFAULTS) ON COMMIT DROP
+    """)
+    cur.execute("ALTER TABLE orders_staging ADD COLUMN staging_seq BIGSERIAL")
+
+
+def _copy_batch(cur, df):
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cur.copy_expert(
+        f"COPY orders_staging ({', '.join(ORDER_COLUMNS.values())}) FROM STDIN WITH (FORMAT csv)",
+        buffer
+    )
+
+
+def _merge_staging(cur):
+    columns = list(ORDER_COLUMNS.values())
+    updates = ',\n'.join(f'{col} = EXCLUDED.{col}' for col in columns if col != 'order_id')
+    # DISTINCT ON keeps the last occurrence of an order_id in the file, since
+    # ON CONFLICT cannot touch the same target row twice in one statement.
+    cur.execute(f"""
+        INSERT INTO orders ({', '.join(columns)})
+        SELECT DISTINCT ON (order_id) {', '.join(columns)}
+        FROM orders_staging
+        ORDER BY order_id, staging_seq DESC
+        ON CONFLICT (order_id) DO UPDATE SET
+            {updates}
+    """)
+    return cur.rowcount
+
+
+def import_orders(conn, frames, batch_size=DEFAULT_BATCH_SIZE, on_batch=None):
+    """Loads order rows from an iterable of DataFrames into `orders`.
+
+    `frames` is consumed lazily, so a `read_order_chunks` reader is never held
+    in memory as a whole. `on_batch`, if given, is called with the running
+    report after every batch so callers can publish progress.
+
+    Every batch is validated and copied into the staging table on its own
+    savepoint, so one bad batch is reported without aborting the others. The
+    merge and commit happen once, after all batches are staged.
+    """
+    started = time.perf_counter()
+    report = {'rows_read': 0, 'rows_staged': 0, 'rows_rejected': 0, 'batches': []}
+
+    cur = conn.cursor()
+    try:
+        _create_staging_table(cur)
+        batch_no = 0
+        for frame in frames:
+            for batch in iter_batches(frame, batch_size):
+                batch_no += 1
+                offset = report['rows_read']
+                report['rows_read'] += len(batch)
+                clean, errors = validate_batch(batch, row_offset=offset)
+
+                batch_report = {'batch': batch_no, 'rows': len(batch), 'staged': 0,
+                                'rejected': len(batch) - len(clean),
+                                'errors': errors[:MAX_ERRORS_PER_BATCH]}
+                cur.execute("SAVEPOINT order_batch")
+                try:
+                    if len(clean):
+                        _copy_batch(cur, clean)
+                    cur.execute("RELEASE SAVEPOINT order_batch")
+                    batch_report['staged'] = len(clean)
+                except psycopg2.Error as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT order_batch")
+                    batch_report['rejected'] = len(batch)
+                    batch_report['errors'].append(f"batch failed to load: {str(e).strip()}")
+
+                report['rows_staged'] += batch_report['staged']
+                report['rows_rejected'] += batch_report['rejected']
+                report['batches'].append(batch_report)
+                if on_batch is not None:
+                    on_batch(report)
+
+        report['rows_upserted'] = _merge_staging(cur)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    elapsed = time.perf_counter() - started
+    report['elapsed_seconds'] = round(elapsed, 3)
+    report['rows_per_second'] = round(report['rows_read'] / elapsed, 1) if elapsed > 0 else None
+    return report
@@ -0,0 +1,170 @@
+# --------------------------------------------------------------------------------------
+# Server-side listing for the orders table.
+# Builds keyset (cursor) paginated queries with filters on status, customer,
+# priority and expected delivery date, and defines the indexes that back each
+# sortable column so a page costs the same no matter how deep the user scrolls.
+# --------------------------------------------------------------------------------------
+
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Sortable columns; every one is paired with order_id as a unique tie-breaker.
+SORT_COLUMNS = ('expected_delivery', 'created_date', 'amount', 'customer_name', 'order_id')
+
+ORDER_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_orders_expected_delivery ON orders (expected_delivery, order_id)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_created_date ON orders (created_date, order_id)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_amount ON orders (amount, order_id)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_customer_name ON orders (customer_name, order_id)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_status_delivery ON orders (status, expected_delivery, order_id)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_priority_delivery ON orders (delivery_priority, expected_delivery, order_id)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_customer_prefix ON orders (lower(customer_name) text_pattern_ops)",
+]
+
+
+def create_order_indexes(cur):
+    """Creates the listing indexes when the orders table exists."""
+    cur.execute("SELECT to_regclass('orders')")
+    if cur.fetchone()[0] is None:
+        return
+    for statement in ORDER_INDEXES:
+        cur.execute(statement)
+
+
+def encode_cursor(row, sort):
+    """Encodes the sort key of the last row on a page as an opaque token."""
+    value = row[sort]
+    payload = [None if value is None else str(value), row['order_id']]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(token):
+    """Decodes a token from `encode_cursor`; raises ValueError when malformed."""
+    try:
+        value, order_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid page cursor') from e
+    return value, order_id
+
+
+def parse_listing_args(args):
+    """Extracts filters, sort and page options from request query arguments."""
+    sort = args.get('sort', 'expected_delivery')
+    if sort not in SORT_COLUMNS:
+        sort = 'expected_delivery'
+    direction = 'desc' if args.get('direction', 'asc').lower() == 'desc' else 'asc'
+    try:
+        limit = min(max(int(args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        limit = DEFAULT_PAGE_SIZE
+
+    filters = {
+        'status': args.get('status', '').strip(),
+        'customer_name': args.get('customer_name', '').strip(),
+        'delivery_priority': args.get('delivery_priority', '').strip(),
+        'date_from': args.get('date_from', '').strip(),
+        'date_to': args.get('date_to', '').strip(),
+    }
+    return {'filters': filters, 'sort': sort, 'direction': direction,
+            'limit': limit, 'cursor': args.get('cursor') or None}
+
+
+def build_filter_clause(filters):
+    """Returns (where_sql_fragments, params) for the listing filters."""
+    clauses, params = [], []
+    if filters.get('status'):
+        clauses.append("status = %s")
+        params.append(filters['status'])
+    if filters.get('delivery_priority'):
+        clauses.append("delivery_priority = %s")
+        params.append(filters['delivery_priority'])
+    if filters.get('customer_name'):
+        # Prefix match on lower(customer_name) can use the text_pattern_ops index.
+        escaped = filters['customer_name'].lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        clauses.append("lower(customer_name) LIKE %s")
+        params.append(escaped + '%')
+    if filters.get('date_from'):
+        clauses.append("expected_delivery >= %s")
+        params.append(filters['date_from'])
+    if filters.get('date_to'):
+        clauses.append("expected_delivery <= %s")
+        params.append(filters['date_to'])
+    return clauses, params
+
+
+def build_orders_query(filters, sort='expected_delivery', direction='asc', after=None,
+                       limit=DEFAULT_PAGE_SIZE, null_segment=False):
+    """Builds one keyset query over either the non-NULL or the NULL sort values.
+
+    Rows with a NULL sort value cannot take part in a (column, order_id) row
+    comparison, so they are paged as a separate segment ordered by order_id.
+    Keeping the two apart lets the non-NULL segment start its index scan right
+    at the cursor instead of filtering its way there. `after` is the decoded
+    (value, order_id) of the last row already shown within the same segment.
+    """
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f'Unsupported sort column: {sort}')
+
+    clauses, params = build_filter_clause(filters)
+    op = '>' if direction == 'asc' else '<'
+
+    if sort == 'order_id':
+        if after:
+            clauses.append(f"order_id {op} %s")
+            params.append(after[1])
+        order_by = f"order_id {direction.upper()}"
+    elif null_segment:
+        clauses.append(f"{sort} IS NULL")
+        if after:
+            clauses.append(f"order_id {op} %s")
+            params.append(after[1])
+        order_by = f"order_id {direction.upper()}"
+    else:
+        if after:
+            clauses.append(f"({sort}, order_id) {op} (%s, %s)")
+            params.extend(after)
+        else:
+            clauses.append(f"{sort} IS NOT NULL")
+        order_by = f"{sort} {direction.upper()}, order_id {direction.upper()}"
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    sql = f"SELECT * FROM orders {where} ORDER BY {order_by} LIMIT %s"
+    params.append(limit)
+    return sql, params
+
+
+def fetch_orders_page(cur, listing):
+    """Runs a listing query on a RealDictCursor; returns (rows, next_cursor).
+
+    NULL sort values come last when ascending and first when descending. One
+    extra row is fetched so the caller can tell whether a next page exists.
+    """
+    sort, direction, limit = listing['sort'], listing['direction'], listing['limit']
+    after = decode_cursor(listing['cursor']) if listing['cursor'] else None
+
+    if sort == 'order_id':
+        segments = [False]
+    else:
+        segments = [False, True] if direction == 'asc' else [True, False]
+    if after and sort != 'order_id':
+        # Resume in the segment the last row belonged to.
+        segments = segments[segments.index(after[0] is None):]
+
+    rows = []
+    for null_segment in segments:
+        sql, params = build_orders_query(listing['filters'], sort, direction, after,
+                                         limit + 1 - len(rows), null_segment)
+        cur.execute(sql, params)
+        rows.extend(cur.fetchall())
+        if len(rows) > limit:
+            break
+        after = None
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1], sort)
+    return rows, next_cursor
@@ -0,0 +1,160 @@
+# --------------------------------------------------------------------------------------
+# Response caching for read-heavy master-data pages.
+# Query results and rendered template fragments are kept in a per-process TTL + LRU
+# cache. Every entry belongs to a namespace ("fleet", "drivers", "orders") whose
+# version is part of the cache key; a write bumps the version, which makes the old
+# entries unreachable at once. Versions live in the `cache_versions` table so that a
+# write handled by one gunicorn worker reaches the others within
+# `version_check_interval` seconds. The same versions back the ETag and
+# Last-Modified headers, so browsers can revalidate with a 304.
+# --------------------------------------------------------------------------------------
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from markupsafe import Markup
+
+logger = logging.getLogger(__name__)
+
+
+def create_cache_versions_table(cur):
+    """Creates the table holding the current version of every cache namespace."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            namespace VARCHAR(50) PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+    """)
+
+
+class PageCache:
+    """A thread-safe TTL + LRU cache whose entries are invalidated by namespace."""
+
+    def __init__(self, db_pool, maxsize=256, ttl=300.0, version_check_interval=1.0):
+        self.db_pool = db_pool
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()    # (namespace, version, key) -> (expires_at, value)
+        self._versions = {}              # namespace -> (version, updated_at epoch)
+        self._checked_at = 0.0
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'invalidations': 0,
+                      'not_modified': 0}
+
+    # -------------------------- Versions --------------------------
+
+    def _sync_versions(self):
+        """Picks up invalidations made by other workers, at most once per check interval."""
+        if time.monotonic() - self._checked_at < self.version_check_interval:
+            return
+        self._checked_at = time.monotonic()
+        try:
+            with self.db_pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT namespace, version, EXTRACT(EPOCH FROM updated_at) FROM cache_versions")
+                    rows = cur.fetchall()
+        except Exception:
+            logger.exception('Error reading cache versions')
+            return
+        with self._lock:
+            for namespace, version, updated_at in rows:
+                if version > self._versions.get(namespace, (-1, 0.0))[0]:
+                    self._versions[namespace] = (version, float(updated_at))
+
+    def _version(self, namespace):
+        return self._versions.get(namespace, (0, 0.0))
+
+    def current_versions(self, namespaces):
+        """{namespace: version}, including invalidations made by other workers."""
+        self._sync_versions()
+        with self._lock:
+            return {n: self._version(n)[0] for n in namespaces}
+
+    def invalidate(self, *namespaces):
+        """Drops every entry of `namespaces` here and bumps their versions for other workers."""
+        with self._lock:
+            for namespace in namespaces:
+                version, _ = self._version(namespace)
+                self._versions[namespace] = (version + 1, time.time())
+            for key in [k for k in self._entries if k[0] in namespaces]:
+                del self._entries[key]
+            self.stats['invalidations'] += len(namespaces)
+        try:
+            with self.db_pool.connection() as conn:
+                with conn.cursor() as cur:
+                    for namespace in namespaces:
+                        cur.execute("""
+                            INSERT INTO cache_versions (namespace, version) VALUES (%s, 1)
+                            ON CONFLICT (namespace) DO UPDATE SET
+                                version = cache_versions.version + 1, updated_at = NOW()
+                            RETURNING version, EXTRACT(EPOCH FROM updated_at)
+                        """, (namespace,))
+                        version, updated_at = cur.fetchone()
+                        with self._lock:
+                            if version > self._version(namespace)[0]:
+                                self._versions[namespace] = (version, float(updated_at))
+                conn.commit()
+        except Exception:
+            # This worker is already invalidated; others catch up when their TTL runs out.
+            logger.exception('Error publishing cache invalidation')
+
+    # -------------------------- Entries --------------------------
+
+    def get_or_set(self, namespace, key, loader):
+        """Returns the cached value for `key`, calling `loader()` to fill a miss."""
+        self._sync_versions()
+        now = time.monotonic()
+        with self._lock:
+            full_key = (namespace, self._version(namespace)[0], key)
+            entry = self._entries.get(full_key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(full_key)
+                    self.stats['hits'] += 1
+                    return entry[1]
+                del self._entries[full_key]
+                self.stats['expired'] += 1
+            self.stats['misses'] += 1
+
+        value = loader()
+        with self._lock:
+            self._entries[full_key] = (now + self.ttl, value)
+            self._entries.move_to_end(full_key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.stats['evicted'] += 1
+        return value
+
+    def fragment(self, namespace, key, caller=None):
+        """Jinja call-block helper caching the rendered body of the block.
+
+        Usage: {% call cached_fragment('fleet', 'fleet_rows') %}...{% endcall %}
+        """
+        return self.get_or_set(namespace, ('fragment', key), lambda: Markup(caller()))
+
+    # -------------------------- HTTP validators --------------------------
+
+    def validators(self, namespaces, *parts):
+        """ETag and Last-Modified for a page built from `namespaces` and varying on `parts`."""
+        self._sync_versions()
+        with self._lock:
+            versions = [self._version(n) for n in namespaces]
+        # Validators also roll over once per TTL window, so a change made outside the
+        # app (and so never invalidated) is not revalidated as current forever.
+        window = int(time.time() // self.ttl * self.ttl)
+        token = repr(([v for v, _ in versions], window, parts)).encode()
+        etag = hashlib.sha1(token).hexdigest()
+        # HTTP dates have one-second resolution.
+        updated = int(max([u for _, u in versions] + [window]))
+        return etag, datetime.fromtimestamp(updated, tz=timezone.utc)
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), maxsize=self.maxsize, ttl=self.ttl,
+                        versions={n: v for n, (v, _) in self._versions.items()})
@@ -0,0 +1,373 @@
+# --------------------------------------------------------------------------------------
+# Nightly predictive-maintenance batch.
+# For every vehicle in `fleet` it predicts the next service date from the odometer
+# (`current_meter`), the usage rate observed between runs and the service history
+# recorded through /add_service, and the next tyre replacement from each installed
+# tyre's `km_run`. The whole fleet is computed in one vectorized NumPy pass and the
+# results are written to `maintenance_predictions`, which the maintenance pages read
+# instead of computing anything per request.
+#
+# Runs are incremental: an md5 of each vehicle's inputs is stored with its
+# prediction, and only vehicles whose meter, service history or tyres changed since
+# the last run are recomputed.
+# --------------------------------------------------------------------------------------
+
+import io
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# pg_try_advisory_xact_lock key; keeps two gunicorn workers from running the batch together.
+RUN_LOCK_KEY = 7310414
+
+INPUT_COLUMNS = ('vehicle_id', 'current_meter', 'avg', 'last_service', 'median_gap', 'input_hash',
+                 'meter_reading', 'meter_read_at', 'daily_km')
+
+# Columns copied into the staging table. Timestamps travel as epoch seconds and dates as
+# days since the epoch, which keeps the CSV plain numbers.
+PREDICTION_COLUMNS = (
+    'vehicle_id', 'current_meter', 'meter_reading', 'meter_read_at', 'daily_km', 'rate_source',
+    'last_service_date', 'service_interval_days', 'next_service_date', 'km_to_service',
+    'fuel_to_service_liters', 'tyres_installed', 'next_tyre_replacement', 'tyre_serial', 'input_hash'
+)
+
+
+def create_prediction_tables(cur):
+    """Creates the prediction lookup table and the batch run log."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS maintenance_predictions (
+            vehicle_id VARCHAR(50) PRIMARY KEY,
+            current_meter DOUBLE PRECISION,
+            meter_reading DOUBLE PRECISION,
+            meter_read_at TIMESTAMPTZ,
+            daily_km DOUBLE PRECISION,
+            rate_source VARCHAR(10),
+            last_service_date DATE,
+            service_interval_days INTEGER,
+            next_service_date DATE,
+            km_to_service DOUBLE PRECISION,
+            fuel_to_service_liters DOUBLE PRECISION,
+            tyres_installed INTEGER NOT NULL DEFAULT 0,
+            next_tyre_replacement DATE,
+            tyre_serial VARCHAR(50),
+            input_hash CHAR(32) NOT NULL,
+            computed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_maintenance_predictions_service "
+                "ON maintenance_predictions (next_service_date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_maintenance_predictions_tyre "
+                "ON maintenance_predictions (next_tyre_replacement)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS maintenance_prediction_runs (
+            run_id SERIAL PRIMARY KEY,
+            started_at TIMESTAMPTZ NOT NULL,
+            finished_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            full_run BOOLEAN NOT NULL,
+            vehicles_checked INTEGER NOT NULL,
+            vehicles_updated INTEGER NOT NULL,
+            seconds DOUBLE PRECISION NOT NULL
+        );
+    """)
+
+
+# Vehicles whose inputs differ from the hash stored with their prediction, together
+# with the meter anchor and usage rate carried over from the previous run.
+CHANGED_INPUTS_SQL = """
+    WITH service_gaps AS (
+        SELECT vehicle_id, service_date,
+               service_date - LAG(service_date) OVER (PARTITION BY vehicle_id ORDER BY service_date) AS gap
+        FROM service_records
+    ),
+    services AS (
+        SELECT vehicle_id, MAX(service_date) AS last_service, COUNT(*) AS services,
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY gap) AS median_gap
+        FROM service_gaps
+        GROUP BY vehicle_id
+    ),
+    manual AS (
+        SELECT vehicle_id, MAX(last_service_date) AS last_service
+        FROM vehicle_maintenance
+        GROUP BY vehicle_id
+    ),
+    installed AS (
+        SELECT vehicle_id,
+               md5(string_agg(concat_ws(',', serial_number, km_run, last_inspection), ';'
+                              ORDER BY serial_number)) AS tyres_hash
+        FROM tyres
+        WHERE status = 'Installed'
+        GROUP BY vehicle_id
+    ),
+    inputs AS (
+        SELECT f.vehicle_id, f.current_meter, f.avg,
+               GREATEST(s.last_service, m.last_service) AS last_service, s.median_gap,
+               md5(concat_ws('|', f.current_meter, f.avg, s.last_service, s.services, s.median_gap,
+                             m.last_service, t.tyres_hash)) AS input_hash
+        FROM fleet AS f
+        LEFT JOIN services AS s ON s.vehicle_id = f.vehicle_id
+        LEFT JOIN manual AS m ON m.vehicle_id = f.vehicle_id
+        LEFT JOIN installed AS t ON t.vehicle_id = f.vehicle_id
+    )
+    SELECT i.vehicle_id, i.current_meter, i.avg, i.last_service - DATE '1970-01-01', i.median_gap,
+           i.input_hash, p.meter_reading, EXTRACT(EPOCH FROM p.meter_read_at), p.daily_km
+    FROM inputs AS i
+    LEFT JOIN maintenance_predictions AS p ON p.vehicle_id = i.vehicle_id
+    {where}
+"""
+
+
+# -------------------------- Vectorized model --------------------------
+
+def predict(inputs, tyres, now, fleet_rate, service_interval_km=10000.0, service_interval_days=180.0,
+            tyre_life_km=60000.0, smoothing=0.3, min_rate_days=0.5):
+    """Computes predictions for a batch of vehicles; returns a dict of column arrays.
+
+    `inputs` holds one array per column of CHANGED_INPUTS_SQL and `tyres` the
+    installed tyres of those vehicles (vehicle index, serial, km_run, last
+    inspection day). Usage (km/day) is an exponentially smoothed rate of meter
+    growth between runs; vehicles without one yet use `fleet_rate`.
+    """
+    today = now // 86400
+    meter = inputs['current_meter']
+    prev_meter, prev_read_at, prev_rate = inputs['meter_reading'], inputs['meter_read_at'], inputs['daily_km']
+
+    # Usage rate from the meter growth since the anchored reading.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        elapsed = (now - prev_read_at) / 86400.0
+        observed = (meter - prev_meter) / elapsed
+    moved = ~np.isnan(prev_meter) & (meter > prev_meter) & (elapsed >= min_rate_days)
+    smoothed = np.where(np.isnan(prev_rate), observed, smoothing * observed + (1 - smoothing) * prev_rate)
+    daily_km = np.where(moved, smoothed, prev_rate)
+    # Re-anchor on a new reading, a first reading or a meter reset; otherwise keep the old
+    # anchor so a short or flat interval is folded into the next measurement.
+    reanchor = moved | np.isnan(prev_meter) | (meter < prev_meter)
+    meter_reading = np.where(reanchor, meter, prev_meter)
+    meter_read_at = np.where(reanchor, float(now), prev_read_at)
+
+    observed_rate = ~np.isnan(daily_km) & (daily_km > 0)
+    rate = np.where(observed_rate, daily_km, fleet_rate)
+
+    # Next service: whichever of the history's service interval and the km interval
+    # comes first, counted from the last service; from the odometer when there is none.
+    interval_days = np.where(np.isnan(inputs['median_gap']), service_interval_days, inputs['median_gap'])
+    last_service = inputs['last_service']
+    has_service = ~np.isnan(last_service)
+    km_days = service_interval_km / rate
+    anchor_day = np.floor(meter_read_at / 86400.0)
+    remaining_km = service_interval_km - np.mod(meter_reading, service_interval_km)
+    next_service = np.where(has_service, last_service + np.minimum(interval_days, km_days),
+                            anchor_day + remaining_km / rate)
+    km_to_service = np.where(has_service, service_interval_km - rate * (today - last_service),
+                             remaining_km - rate * (today - anchor_day))
+    avg = inputs['avg']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fuel = np.where((avg > 0) & (km_to_service > 0), km_to_service / avg, np.nan)
+
+    # Tyres: wear grows from `km_run` at the last inspection at the vehicle's rate; the
+    # vehicle's next replacement is its most worn tyre's.
+    n = len(meter)
+    tyre_vehicle, tyre_km, tyre_inspected = tyres['vehicle'], tyres['km_run'], tyres['last_inspection']
+    tyre_due = tyre_inspected + np.maximum(tyre_life_km - tyre_km, 0) / rate[tyre_vehicle]
+    next_tyre = np.full(n, np.nan)
+    tyre_serial = np.full(n, None, dtype=object)
+    valid = ~np.isnan(tyre_due)
+    if valid.any():
+        order = np.lexsort((tyre_due[valid], tyre_vehicle[valid]))
+        vehicles_sorted = tyre_vehicle[valid][order]
+        _, first = np.unique(vehicles_sorted, return_index=True)
+        worst = order[first]
+        next_tyre[vehicles_sorted[first]] = tyre_due[valid][worst]
+        tyre_serial[vehicles_sorted[first]] = tyres['serial'][valid][worst]
+    tyres_installed = np.bincount(tyre_vehicle, minlength=n)
+
+    return {
+        'meter_reading': meter_reading, 'meter_read_at': meter_read_at, 'daily_km': daily_km,
+        'rate_source': np.where(observed_rate, 'observed', 'fleet'),
+        'service_interval_days': np.round(interval_days), 'next_service_date': np.floor(next_service),
+        'km_to_service': np.round(km_to_service, 1), 'fuel_to_service_liters': np.round(fuel, 1),
+        'tyres_installed': tyres_installed, 'next_tyre_replacement': np.floor(next_tyre),
+        'tyre_serial': tyre_serial,
+    }
+
+
+# -------------------------- Batch job --------------------------
+
+class PredictiveMaintenance:
+    """Runs the prediction batch once a night in a background thread."""
+
+    def __init__(self, db_pool, run_hour=2, service_interval_km=10000.0, service_interval_days=180.0,
+                 tyre_life_km=60000.0, default_daily_km=150.0):
+        self.db_pool = db_pool
+        self.run_hour = run_hour
+        self.service_interval_km = service_interval_km
+        self.service_interval_days = service_interval_days
+        self.tyre_life_km = tyre_life_km
+        self.default_daily_km = default_daily_km
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self.stats = {'runs': 0, 'skipped_runs': 0, 'vehicles_checked': 0, 'vehicles_updated': 0,
+                      'errors': 0, 'last_run_seconds': None, 'last_run_at': None}
+
+    def ensure_running(self):
+        """Starts the nightly scheduler once per process (and again after a fork)."""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._run, name='predictive-maintenance', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _seconds_until_next_run(self):
+        now = datetime.now()
+        next_run = now.replace(hour=self.run_hour, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        return (next_run - now).total_seconds()
+
+    def _run(self):
+        # A worker started after tonight's slot still runs once if no run happened today.
+        first = True
+        while True:
+            if not first:
+                time.sleep(self._seconds_until_next_run())
+            try:
+                self.run(only_if_stale=first)
+            except Exception:
+                self.stats['errors'] += 1
+                logger.exception('Error running predictive maintenance batch')
+            first = False
+
+    def run(self, full=False, only_if_stale=False):
+        """Recomputes predictions for changed vehicles (all of them when `full`).
+
+        Returns the number of vehicles updated, or None when another worker holds
+        the batch lock or, with `only_if_stale`, a run already finished today.
+        """
+        started = time.perf_counter()
+        started_at = datetime.now().astimezone()
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (RUN_LOCK_KEY,))
+                if not cur.fetchone()[0]:
+                    conn.rollback()
+                    self.stats['skipped_runs'] += 1
+                    return None
+                if only_if_stale:
+                    cur.execute("SELECT EXISTS (SELECT 1 FROM maintenance_prediction_runs "
+                                "WHERE finished_at >= date_trunc('day', NOW()))")
+                    if cur.fetchone()[0]:
+                        conn.rollback()
+                        self.stats['skipped_runs'] += 1
+                        return None
+
+                cur.execute("SELECT COUNT(*) FROM fleet")
+                checked = cur.fetchone()[0]
+                cur.execute(CHANGED_INPUTS_SQL.format(
+                    where='' if full else 'WHERE p.input_hash IS DISTINCT FROM i.input_hash'))
+                rows = cur.fetchall()
+                if rows:
+                    self._update(cur, rows)
+                cur.execute("DELETE FROM maintenance_predictions AS p "
+                            "WHERE NOT EXISTS (SELECT 1 FROM fleet AS f WHERE f.vehicle_id = p.vehicle_id)")
+                seconds = time.perf_counter() - started
+                cur.execute("""
+                    INSERT INTO maintenance_prediction_runs
+                        (started_at, full_run, vehicles_checked, vehicles_updated, seconds)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, (started_at, full, checked, len(rows), seconds))
+            conn.commit()
+
+        self.stats['runs'] += 1
+        self.stats['vehicles_checked'] += checked
+        self.stats['vehicles_updated'] += len(rows)
+        self.stats['last_run_seconds'] = round(seconds, 3)
+        self.stats['last_run_at'] = time.time()
+        return len(rows)
+
+    def _update(self, cur, rows):
+        frame = pd.DataFrame.from_records(rows, columns=INPUT_COLUMNS)
+        vehicle_ids = frame['vehicle_id']
+        inputs = {name: frame[name].to_numpy(dtype=float, na_value=np.nan)
+                  for name in INPUT_COLUMNS if name not in ('vehicle_id', 'input_hash')}
+
+        cur.execute("""
+            SELECT vehicle_id, serial_number, km_run, last_inspection - DATE '1970-01-01'
+            FROM tyres
+            WHERE status = 'Installed' AND vehicle_id = ANY(%s)
+        """, (vehicle_ids.tolist(),))
+        installed = pd.DataFrame.from_records(cur.fetchall(),
+                                              columns=('vehicle_id', 'serial', 'km_run', 'last_inspection'))
+        position = pd.Series(np.arange(len(frame)), index=vehicle_ids)
+        tyres = {
+            'vehicle': position.reindex(installed['vehicle_id']).to_numpy(dtype=int),
+            'serial': installed['serial'].to_numpy(dtype=object),
+            'km_run': installed['km_run'].to_numpy(dtype=float, na_value=np.nan),
+            'last_inspection': installed['last_inspection'].to_numpy(dtype=float, na_value=np.nan),
+        }
+
+        # Vehicles without an observed rate yet use the fleet's median usage.
+        cur.execute("SELECT percentile_cont(0.5) WITHIN GROUP (ORDER BY daily_km) FROM maintenance_predictions "
+                    "WHERE rate_source = 'observed'")
+        fleet_rate = cur.fetchone()[0] or self.default_daily_km
+
+        now = time.time()
+        result = predict(inputs, tyres, now, float(fleet_rate),
+                         service_interval_km=self.service_interval_km,
+                         service_interval_days=self.service_interval_days,
+                         tyre_life_km=self.tyre_life_km)
+
+        output = pd.DataFrame({
+            'vehicle_id': vehicle_ids,
+            'current_meter': inputs['current_meter'],
+            'meter_reading': result['meter_reading'],
+            'meter_read_at': result['meter_read_at'],
+            'daily_km': result['daily_km'],
+            'rate_source': result['rate_source'],
+            'last_service_date': inputs['last_service'],
+            'service_interval_days': result['service_interval_days'],
+            'next_service_date': result['next_service_date'],
+            'km_to_service': result['km_to_service'],
+            'fuel_to_service_liters': result['fuel_to_service_liters'],
+            'tyres_installed': result['tyres_installed'],
+            'next_tyre_replacement': result['next_tyre_replacement'],
+            'tyre_serial': result['tyre_serial'],
+            'input_hash': frame['input_hash'],
+        }, columns=PREDICTION_COLUMNS)
+
+        buffer = io.StringIO()
+        output.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cur.execute("""
+            CREATE TEMP TABLE predictions_staging (
+                vehicle_id VARCHAR(50), current_meter DOUBLE PRECISION, meter_reading DOUBLE PRECISION,
+                meter_read_at DOUBLE PRECISION, daily_km DOUBLE PRECISION, rate_source VARCHAR(10),
+                last_service_date DOUBLE PRECISION, service_interval_days DOUBLE PRECISION,
+                next_service_date DOUBLE PRECISION, km_to_service DOUBLE PRECISION,
+                fuel_to_service_liters DOUBLE PRECISION, tyres_installed INTEGER,
+                next_tyre_replacement DOUBLE PRECISION, tyre_serial VARCHAR(50), input_hash CHAR(32)
+            ) ON COMMIT DROP
+        """)
+        cur.copy_expert(f"COPY predictions_staging ({', '.join(PREDICTION_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                        buffer)
+        updates = ', '.join(f'{col} = EXCLUDED.{col}' for col in PREDICTION_COLUMNS + ('computed_at',)
+                            if col != 'vehicle_id')
+        cur.execute(f"""
+            INSERT INTO maintenance_predictions ({', '.join(PREDICTION_COLUMNS)}, computed_at)
+            SELECT vehicle_id, current_meter, meter_reading, to_timestamp(meter_read_at), daily_km, rate_source,
+                   DATE '1970-01-01' + last_service_date::int, service_interval_days::int,
+                   DATE '1970-01-01' + next_service_date::int, km_to_service, fuel_to_service_liters,
+                   tyres_installed, DATE '1970-01-01' + next_tyre_replacement::int, tyre_serial, input_hash,
+                   NOW()
+            FROM predictions_staging
+            ON CONFLICT (vehicle_id) DO UPDATE SET {updates}
+        """)
+
+    def metrics(self):
+        return dict(self.stats, run_hour=self.run_hour)
@@ -0,0 +1,225 @@
+# --------------------------------------------------------------------------------------
+# Per-route Folium maps for optimized plans.
+# Each route's map is named by a hash of what it draws (vehicle and stop sequence), so a
+# map is rendered once and reused by every later plan in which that route is unchanged;
+# after an incremental re-optimization only the touched vehicles get new maps. Maps are
+# rendered on a process pool owned by the current process, stored gzip-compressed under
+# static/route_maps and served with Content-Encoding: gzip.
+# --------------------------------------------------------------------------------------
+
+import gzip
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Bump when render_route_map's output changes so old maps stop matching.
+MAP_FORMAT_VERSION = 1
+MAP_HASH_PATTERN = re.compile(r'^[0-9a-f]{40}$')
+DEFAULT_RETENTION_DAYS = 30
+STOP_COLORS = {'pickup': '#198754', 'drop': '#dc3545'}
+
+
+def route_map_hash(route):
+    """Content hash of everything a route's map draws."""
+    payload = {
+        'version': MAP_FORMAT_VERSION,
+        'vehicle': route['vehicle'],
+        'stops': [(s['order_id'], s['type'], [float(c) for c in s['latlon']]) for s in route['stops']],
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def render_route_map(route):
+    """Folium HTML for one route: the stop sequence as a polyline with numbered stop markers."""
+    import folium
+
+    points = [[float(c) for c in s['latlon']] for s in route['stops']]
+    fmap = folium.Map(tiles='OpenStreetMap', prefer_canvas=True, control_scale=True)
+    folium.PolyLine(points, color='#0d6efd', weight=4, opacity=0.8, tooltip=f"Vehicle {route['vehicle']}").add_to(fmap)
+    for seq, (stop, point) in enumerate(zip(route['stops'], points), start=1):
+        folium.CircleMarker(
+            point, radius=6, color=STOP_COLORS.get(stop['type'], '#6c757d'), fill=True, fill_opacity=0.9,
+            tooltip=f"{seq}. {stop['type'].title()} {stop['order_id']}",
+        ).add_to(fmap)
+    fmap.fit_bounds([[min(p[0] for p in points), min(p[1] for p in points)],
+                     [max(p[0] for p in points), max(p[1] for p in points)]])
+    return fmap.get_root().render()
+
+
+def find_plan_route(cur, route_hash, recent_plans=20):
+    """The route with `route_hash` from one of the most recent stored plans, or None."""
+    cur.execute("""
+        SELECT route
+        FROM (SELECT plan FROM route_plans ORDER BY plan_id DESC LIMIT %s) AS p,
+             jsonb_array_elements(p.plan->'routes') AS route
+        WHERE route->>'map_hash' = %s
+        LIMIT 1
+    """, (recent_plans, route_hash))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def write_route_map(map_dir, route_hash, route):
+    """Renders `route` to <map_dir>/<hash>.html.gz atomically; returns seconds spent."""
+    started = time.perf_counter()
+    html = render_route_map(route)
+    # mtime=0 keeps the bytes, and so the ETag, identical across re-renders.
+    data = gzip.compress(html.encode('utf-8'), compresslevel=9, mtime=0)
+    os.makedirs(map_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=map_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, os.path.join(map_dir, f'{route_hash}.html.gz'))
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return time.perf_counter() - started
+
+
+class RouteMapRenderer:
+    """Keeps a content-addressed directory of route maps in step with the stored plans."""
+
+    def __init__(self, map_dir, url_prefix='static/route_maps', max_workers=2,
+                 retention_days=DEFAULT_RETENTION_DAYS):
+        self.map_dir = map_dir
+        self.url_prefix = url_prefix.rstrip('/')
+        self.max_workers = max_workers
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._pending = {}         # hash -> Future
+        self.stats = {'rendered': 0, 'reused': 0, 'render_errors': 0, 'render_seconds': 0.0,
+                      'inline_renders': 0, 'pruned': 0}
+
+    def _get_executor(self):
+        # Spawned children, like the route partition pool: no inherited threads or sockets.
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                self._pid = os.getpid()
+                self._pending = {}
+            return self._executor
+
+    def path(self, route_hash):
+        return os.path.join(self.map_dir, f'{route_hash}.html.gz')
+
+    def attach_map_urls(self, plan):
+        """Sets each route's `map_hash` and `map_url`; call before the plan is saved."""
+        for route in plan.get('routes', []):
+            if not route.get('stops'):
+                continue
+            route['map_hash'] = route_map_hash(route)
+            route['map_url'] = f"{self.url_prefix}/{route['map_hash']}.html"
+        return plan
+
+    def render_plan(self, plan):
+        """Queues maps for routes whose hash has no file yet; returns the number queued.
+
+        Maps that already exist are touched so retention pruning keeps them.
+        """
+        executor = None
+        queued = 0
+        now = time.time()
+        for route in plan.get('routes', []):
+            route_hash = route.get('map_hash')
+            if not route_hash:
+                continue
+            path = self.path(route_hash)
+            if os.path.exists(path):
+                try:
+                    os.utime(path, (now, now))
+                except OSError:
+                    pass
+                self.stats['reused'] += 1
+                continue
+            with self._lock:
+                if route_hash in self._pending and self._pid == os.getpid():
+                    continue
+            executor = executor or self._get_executor()
+            future = executor.submit(write_route_map, self.map_dir, route_hash, route)
+            with self._lock:
+                self._pending[route_hash] = future
+            future.add_done_callback(lambda f, h=route_hash: self._finished(h, f))
+            queued += 1
+        if queued:
+            self.prune({r['map_hash'] for r in plan.get('routes', []) if r.get('map_hash')})
+        return queued
+
+    def _finished(self, route_hash, future):
+        with self._lock:
+            if self._pending.get(route_hash) is future:
+                del self._pending[route_hash]
+        try:
+            self.stats['render_seconds'] += future.result()
+            self.stats['rendered'] += 1
+        except Exception:
+            self.stats['render_errors'] += 1
+            logger.exception('Error rendering route map %s', route_hash)
+
+    def get(self, route_hash, find_route=None, timeout=30):
+        """Path of the map for `route_hash`, rendering it if needed; None if unknown.
+
+        Waits for a render already queued in this process. Otherwise asks
+        `find_route(hash)` for the route (e.g. from the stored plan, when another
+        worker computed it) and renders it inline.
+        """
+        if not MAP_HASH_PATTERN.match(route_hash):
+            return None
+        path = self.path(route_hash)
+        if os.path.exists(path):
+            return path
+        with self._lock:
+            future = self._pending.get(route_hash) if self._pid == os.getpid() else None
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except FutureTimeoutError:
+                return None
+            except Exception:
+                pass
+            if os.path.exists(path):
+                return path
+        route = find_route(route_hash) if find_route is not None else None
+        if route is None or route_map_hash(route) != route_hash:
+            return None
+        self.stats['render_seconds'] += write_route_map(self.map_dir, route_hash, route)
+        self.stats['inline_renders'] += 1
+        return path
+
+    def prune(self, keep=()):
+        """Deletes maps untouched for `retention_days`, except the hashes in `keep`."""
+        cutoff = time.time() - self.retention_days * 86400
+        try:
+            names = os.listdir(self.map_dir)
+        except FileNotFoundError:
+            return 0
+        removed = 0
+        for name in names:
+            if not name.endswith('.html.gz') or name[:-len('.html.gz')] in keep:
+                continue
+            path = os.path.join(self.map_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+        self.stats['pruned'] += removed
+        return removed
+
+    def metrics(self):
+        with self._lock:
+            pending = len(self._pending) if self._pid == os.getpid() else 0
+        return dict(self.stats, pending=pending, workers=self.max_workers)
@@ -0,0 +1,575 @@
+# --------------------------------------------------------------------------------------
+# Route optimization for the TMS application.
+# Pending orders are modelled as pickup-and-delivery pairs and assigned to active
+# fleet vehicles with OR-Tools' routing solver, subject to weight and volume
+# capacity and soft time windows derived from each order's expected delivery date.
+# --------------------------------------------------------------------------------------
+
+import math
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+from psycopg2.extras import Json, execute_values
+
+from distance_matrix import distance_matrix
+
+DEFAULT_TIME_LIMIT_SECONDS = 10
+DEFAULT_INCREMENTAL_TIME_LIMIT_SECONDS = 0.5
+DEFAULT_FIRST_SOLUTION_STRATEGY = 'PARALLEL_CHEAPEST_INSERTION'
+FIRST_SOLUTION_STRATEGIES = (
+    'AUTOMATIC', 'PATH_CHEAPEST_ARC', 'PARALLEL_CHEAPEST_INSERTION',
+    'LOCAL_CHEAPEST_INSERTION', 'SAVINGS', 'CHRISTOFIDES',
+)
+DEFAULT_SPEED_KMPH = 40.0
+DEFAULT_SERVICE_MINUTES = 15
+MAX_HORIZON_DAYS = 14
+
+# Solver costs are in metres. Dropping an order must always cost more than
+# serving it, and lateness is traded off against distance per minute late.
+DROP_PENALTY_METRES = 10_000_000
+LATE_PENALTY_PER_MINUTE = 50
+PRIORITY_WEIGHTS = {'Urgent': 4, 'High': 2, 'Medium': 1, 'Low': 1}
+
+# Volumes are solved in litres so the solver can work with integers.
+VOLUME_SCALE = 1000
+
+
+def parse_latlon(value):
+    """Parses a "lat,lon" string into a (lat, lon) tuple, or None if invalid."""
+    if not value:
+        return None
+    parts = str(value).replace(';', ',').split(',')
+    if len(parts) != 2:
+        return None
+    try:
+        lat, lon = float(parts[0]), float(parts[1])
+    except ValueError:
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def load_pending_orders(cur, geocoded=None):
+    """Fetches pending orders with parseable coordinates; returns (orders, skipped_ids).
+
+    Locations that are not "lat,lon" are looked up with `geocoded(values)`, which
+    returns {value: (lat, lon)} for the ones it knows (e.g. the geocoding cache).
+    """
+    cur.execute("""
+        SELECT order_id, pickup_location_latlon, drop_location_latlon, weight_kg,
+               volume_cbm, delivery_priority, expected_delivery
+        FROM orders
+        WHERE status = 'Pending'
+        ORDER BY expected_delivery NULLS LAST, order_id
+    """)
+    rows = cur.fetchall()
+    known = {}
+    if geocoded is not None:
+        addresses = {v for row in rows for v in (row[1], row[2]) if v and parse_latlon(v) is None}
+        known = geocoded(list(addresses)) if addresses else {}
+    orders, skipped = [], []
+    for row in rows:
+        pickup = parse_latlon(row[1]) or known.get(row[1])
+        drop = parse_latlon(row[2]) or known.get(row[2])
+        if pickup is None or drop is None:
+            skipped.append(row[0])
+            continue
+        orders.append({
+            'order_id': row[0],
+            'pickup': pickup,
+            'drop': drop,
+            'weight_kg': float(row[3] or 0),
+            'volume_cbm': float(row[4] or 0),
+            'delivery_priority': row[5],
+            'expected_delivery': row[6],
+        })
+    return orders, skipped
+
+
+def load_active_vehicles(cur):
+    """Fetches active fleet vehicles with their capacities and assigned driver."""
+    cur.execute("""
+        SELECT vehicle_id, driver_id, capacity_weight_kg, capacity_vol_cbm, avg
+        FROM fleet
+        WHERE status = 'Active'
+        ORDER BY vehicle_id
+    """)
+    return [{
+        'vehicle_id': row[0],
+        'driver_id': row[1],
+        'capacity_weight_kg': float(row[2] or 0),
+        'capacity_vol_cbm': float(row[3] or 0),
+        'avg': float(row[4] or 0),
+    } for row in cur.fetchall()]
+
+
+def _deadline_minutes(expected_delivery, start_time):
+    """Minutes from the planning start to the end of the expected delivery day."""
+    if expected_delivery is None:
+        return None
+    if isinstance(expected_delivery, datetime):
+        deadline = expected_delivery
+    else:
+        deadline = datetime.combine(expected_delivery, datetime.max.time())
+    return int((deadline - start_time).total_seconds() // 60)
+
+
+def _search_parameters(time_limit, first_solution_strategy):
+    if first_solution_strategy not in FIRST_SOLUTION_STRATEGIES:
+        raise ValueError(f'Unknown first solution strategy: {first_solution_strategy}')
+    params = pywrapcp.DefaultRoutingSearchParameters()
+    params.first_solution_strategy = getattr(routing_enums_pb2.FirstSolutionStrategy, first_solution_strategy)
+    params.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+    params.time_limit.FromMilliseconds(int(time_limit * 1000))
+    return params
+
+
+def order_fingerprints(orders):
+    """{order_id: the attributes its routing depends on}, stored with a plan to spot edited orders."""
+    return {o['order_id']: [*o['pickup'], *o['drop'], o['weight_kg'], o['volume_cbm'], o['delivery_priority'],
+                            None if o['expected_delivery'] is None else o['expected_delivery'].isoformat()]
+            for o in orders}
+
+
+def _order_points(orders):
+    """Stacks pickup/drop coordinates so order i owns points 2i (pickup) and 2i + 1 (drop)."""
+    points = np.empty((2 * len(orders), 2), dtype=np.float64)
+    points[0::2] = [order['pickup'] for order in orders]
+    points[1::2] = [order['drop'] for order in orders]
+    return points
+
+
+def _build_model(orders, vehicles, km, speed_kmph, service_minutes, start_time):
+    """Builds the routing model; node 0 is the depot and node k >= 1 is point k - 1 of `km`."""
+    n_nodes = len(km) + 1
+    distance = np.zeros((n_nodes, n_nodes), dtype=np.int64)
+    distance[1:, 1:] = np.rint(km * 1000)
+    travel = np.zeros((n_nodes, n_nodes), dtype=np.int64)
+    travel[1:, 1:] = np.ceil(km / speed_kmph * 60) + service_minutes
+    travel[1:, 0] = service_minutes
+    np.fill_diagonal(travel, 0)
+    distance, travel = distance.tolist(), travel.tolist()
+
+    manager = pywrapcp.RoutingIndexManager(n_nodes, len(vehicles), 0)
+    routing = pywrapcp.RoutingModel(manager)
+    solver = routing.solver()
+
+    distance_cb = routing.RegisterTransitMatrix(distance)
+    routing.SetArcCostEvaluatorOfAllVehicles(distance_cb)
+    routing.AddDimension(distance_cb, 0, sum(map(max, distance)) + 1, True, 'Distance')
+    distance_dim = routing.GetDimensionOrDie('Distance')
+
+    weight_demand = [0]
+    volume_demand = [0]
+    for order in orders:
+        weight = int(math.ceil(order['weight_kg']))
+        volume = int(math.ceil(order['volume_cbm'] * VOLUME_SCALE))
+        weight_demand += [weight, -weight]
+        volume_demand += [volume, -volume]
+    routing.AddDimensionWithVehicleCapacity(
+        routing.RegisterUnaryTransitVector(weight_demand), 0,
+        [int(v['capacity_weight_kg']) for v in vehicles], True, 'Weight')
+    routing.AddDimensionWithVehicleCapacity(
+        routing.RegisterUnaryTransitVector(volume_demand), 0,
+        [int(v['capacity_vol_cbm'] * VOLUME_SCALE) for v in vehicles], True, 'Volume')
+
+    horizon = MAX_HORIZON_DAYS * 24 * 60
+    time_cb = routing.RegisterTransitMatrix(travel)
+    routing.AddDimension(time_cb, horizon, horizon, True, 'Time')
+    time_dim = routing.GetDimensionOrDie('Time')
+
+    for i, order in enumerate(orders):
+        pickup_index = manager.NodeToIndex(2 * i + 1)
+        drop_index = manager.NodeToIndex(2 * i + 2)
+        routing.AddPickupAndDelivery(pickup_index, drop_index)
+        solver.Add(routing.VehicleVar(pickup_index) == routing.VehicleVar(drop_index))
+        solver.Add(distance_dim.CumulVar(pickup_index) <= distance_dim.CumulVar(drop_index))
+
+        penalty = DROP_PENALTY_METRES * PRIORITY_WEIGHTS.get(order['delivery_priority'], 1)
+        routing.AddDisjunction([pickup_index], penalty)
+        routing.AddDisjunction([drop_index], penalty)
+
+        deadline = _deadline_minutes(order['expected_delivery'], start_time)
+        if deadline is not None:
+            time_dim.SetCumulVarSoftUpperBound(drop_index, max(deadline, 0), LATE_PENALTY_PER_MINUTE)
+
+    for v in range(len(vehicles)):
+        routing.AddVariableMinimizedByFinalizer(time_dim.CumulVar(routing.End(v)))
+
+    return manager, routing, time_dim
+
+
+def _extract_routes(solution, manager, routing, time_dim, orders, vehicles, km, speed_kmph, start_time):
+    """Reads each vehicle's stop sequence out of a solution; returns (routes, assigned_ids)."""
+    routes, assigned = [], set()
+    for v, vehicle in enumerate(vehicles):
+        stops = []
+        index = solution.Value(routing.NextVar(routing.Start(v)))
+        while not routing.IsEnd(index):
+            node = manager.IndexToNode(index)
+            order = orders[(node - 1) // 2]
+            is_pickup = node % 2 == 1
+            stops.append({
+                'order_id': order['order_id'],
+                'type': 'pickup' if is_pickup else 'drop',
+                'node': node,
+                'latlon': order['pickup'] if is_pickup else order['drop'],
+                'eta': start_time + timedelta(minutes=solution.Value(time_dim.CumulVar(index))),
+            })
+            index = solution.Value(routing.NextVar(index))
+        if stops:
+            routes.append(_summarize_route(vehicle, stops, km, speed_kmph))
+            assigned.update(stop['order_id'] for stop in stops)
+    return routes, assigned
+
+
+def _empty_result(start_time, mode):
+    return {'routes': [], 'unassigned': [], 'status': 'no_solution', 'mode': mode,
+            'solve_seconds': 0.0, 'objective': None, 'planned_at': start_time.isoformat()}
+
+
+def solve_routes(orders, vehicles, time_limit=DEFAULT_TIME_LIMIT_SECONDS,
+                 first_solution_strategy=DEFAULT_FIRST_SOLUTION_STRATEGY,
+                 speed_kmph=DEFAULT_SPEED_KMPH, service_minutes=DEFAULT_SERVICE_MINUTES,
+                 start_time=None, matrix_cache=None):
+    """Solves a capacitated pickup-and-delivery VRP for the given orders and vehicles.
+
+    Node 0 is a virtual depot at zero distance from every stop, so each vehicle
+    starts at its first pickup and ends at its last drop. Orders that cannot be
+    served (over capacity, too few vehicles) are dropped with a penalty and
+    returned under `unassigned`. Distances come from `distance_matrix`, reusing
+    `matrix_cache` when one is given.
+    """
+    start_time = start_time or datetime.now().replace(second=0, microsecond=0)
+    result = _empty_result(start_time, 'full')
+    if not orders or not vehicles:
+        result['unassigned'] = [o['order_id'] for o in orders]
+        result['status'] = 'empty'
+        return result
+
+    km = distance_matrix(_order_points(orders), cache=matrix_cache)
+    manager, routing, time_dim = _build_model(orders, vehicles, km, speed_kmph, service_minutes, start_time)
+
+    started = time.perf_counter()
+    solution = routing.SolveWithParameters(_search_parameters(time_limit, first_solution_strategy))
+    result['solve_seconds'] = round(time.perf_counter() - started, 3)
+    if solution is None:
+        result['unassigned'] = [o['order_id'] for o in orders]
+        return result
+
+    result['status'] = 'solved'
+    result['objective'] = solution.ObjectiveValue()
+    result['order_fingerprints'] = order_fingerprints(orders)
+    result['routes'], assigned = _extract_routes(solution, manager, routing, time_dim, orders,
+                                                 vehicles, km, speed_kmph, start_time)
+    result['unassigned'] = [o['order_id'] for o in orders if o['order_id'] not in assigned]
+    return result
+
+
+# -------------------------- Incremental re-optimization --------------------------
+
+def _cheapest_insertion(route, pickup, drop, demand, loads, capacity, km):
+    """Finds the cheapest feasible (pickup_pos, drop_pos, cost) for one order in `route`.
+
+    `route` holds point indices, `loads` the (weight, volume) on board after each
+    stop. The order rides between the two insertion points, so every load in that
+    stretch plus its demand must fit the vehicle capacity.
+    """
+    def arc(a, b):
+        return 0.0 if a is None or b is None else float(km[a, b])
+
+    n = len(route)
+    best = None
+    for i in range(n + 1):
+        before = route[i - 1] if i > 0 else None
+        after = route[i] if i < n else None
+        load_before = loads[i - 1] if i > 0 else (0, 0)
+        if any(load_before[k] + demand[k] > capacity[k] for k in (0, 1)):
+            continue
+        pickup_cost = arc(before, pickup) + arc(pickup, after) - arc(before, after)
+        # Back-to-back pickup and drop between the same two stops.
+        cost = arc(before, pickup) + arc(pickup, drop) + arc(drop, after) - arc(before, after)
+        if best is None or cost < best[2]:
+            best = (i, i, cost)
+        for j in range(i + 1, n + 1):
+            if any(loads[j - 1][k] + demand[k] > capacity[k] for k in (0, 1)):
+                break
+            prev_stop = route[j - 1]
+            next_stop = route[j] if j < n else None
+            cost = pickup_cost + arc(prev_stop, drop) + arc(drop, next_stop) - arc(prev_stop, next_stop)
+            if cost < best[2]:
+                best = (i, j, cost)
+    return best
+
+
+def _route_loads(route, demands):
+    """Cumulative (weight, volume) on board after each stop of a route of point indices."""
+    loads, weight, volume = [], 0, 0
+    for point in route:
+        sign = 1 if point % 2 == 0 else -1
+        weight += sign * demands[point // 2][0]
+        volume += sign * demands[point // 2][1]
+        loads.append((weight, volume))
+    return loads
+
+
+def _route_from_points(vehicle, points, orders, km, speed_kmph, service_minutes, start_time):
+    """Shapes a route of point indices like a solved one, timed as the model times it."""
+    if not points:
+        return None
+    stops, minutes = [], 0
+    for k, point in enumerate(points):
+        if k:
+            minutes += math.ceil(km[points[k - 1], point] / speed_kmph * 60) + service_minutes
+        order = orders[point // 2]
+        is_pickup = point % 2 == 0
+        stops.append({
+            'order_id': order['order_id'],
+            'type': 'pickup' if is_pickup else 'drop',
+            'node': point + 1,
+            'latlon': order['pickup'] if is_pickup else order['drop'],
+            'eta': start_time + timedelta(minutes=minutes),
+        })
+    return _summarize_route(vehicle, stops, km, speed_kmph)
+
+
+def reoptimize_routes(previous_plan, orders, vehicles, time_limit=DEFAULT_INCREMENTAL_TIME_LIMIT_SECONDS,
+                      speed_kmph=DEFAULT_SPEED_KMPH, service_minutes=DEFAULT_SERVICE_MINUTES,
+                      start_time=None, matrix_cache=None):
+    """Updates a persisted plan for added, cancelled and edited orders without a full re-solve.
+
+    Orders that are no longer pending are removed from their routes, and new
+    pending orders are placed by cheapest insertion under the capacity limits.
+    An order whose location, weight, volume, priority or expected delivery
+    changed since the plan was made (per its `order_fingerprints`) is removed
+    and inserted again. Only the vehicles touched by those edits, or whose
+    capacity no longer fits their route, are re-solved, warm-started from the
+    edited routes. All other routes keep their stop sequence and are re-timed
+    from `start_time`. If the re-solve finds no solution in time, the edited
+    routes are kept as they are.
+    """
+    started = time.perf_counter()
+    start_time = start_time or datetime.now().replace(second=0, microsecond=0)
+    result = _empty_result(start_time, 'incremental')
+
+    position = {order['order_id']: i for i, order in enumerate(orders)}
+    vehicle_ids = [v['vehicle_id'] for v in vehicles]
+    previous_routes = {r['vehicle']: r for r in previous_plan.get('routes', []) if r['vehicle'] in vehicle_ids}
+    fingerprints = order_fingerprints(orders)
+    previous_fingerprints = previous_plan.get('order_fingerprints', {})
+
+    # Routes as point indices (2i pickup, 2i + 1 drop) with stale and edited orders removed.
+    routes, affected, removed, changed, planned = {}, set(), set(), set(), set()
+    for vehicle_id, route in previous_routes.items():
+        points = []
+        for stop in route['stops']:
+            i = position.get(stop['order_id'])
+            if i is None:
+                removed.add(stop['order_id'])
+                affected.add(vehicle_id)
+            elif previous_fingerprints.get(stop['order_id']) != fingerprints[stop['order_id']]:
+                changed.add(stop['order_id'])
+                affected.add(vehicle_id)
+            else:
+                points.append(2 * i if stop['type'] == 'pickup' else 2 * i + 1)
+                planned.add(stop['order_id'])
+        routes[vehicle_id] = points
+    for plan_route in previous_plan.get('routes', []):
+        if plan_route['vehicle'] not in previous_routes:
+            # The vehicle left the active fleet; its orders are re-inserted below.
+            removed.update(o for o in plan_route['orders'] if o not in position)
+
+    km = distance_matrix(_order_points(orders), cache=matrix_cache) if orders else np.zeros((0, 0))
+    demands = [(int(math.ceil(o['weight_kg'])), int(math.ceil(o['volume_cbm'] * VOLUME_SCALE))) for o in orders]
+    capacities = {v['vehicle_id']: (int(v['capacity_weight_kg']), int(v['capacity_vol_cbm'] * VOLUME_SCALE))
+                  for v in vehicles}
+    for vehicle_id, route in routes.items():
+        if any(load[k] > capacities[vehicle_id][k] for load in _route_loads(route, demands) for k in (0, 1)):
+            affected.add(vehicle_id)
+
+    new_orders = sorted((i for i, o in enumerate(orders) if o['order_id'] not in planned),
+                        key=lambda i: -PRIORITY_WEIGHTS.get(orders[i]['delivery_priority'], 1))
+    inserted, leftover = [], []
+    for i in new_orders:
+        best = None
+        for vehicle_id in vehicle_ids:
+            route = routes.setdefault(vehicle_id, [])
+            option = _cheapest_insertion(route, 2 * i, 2 * i + 1, demands[i],
+                                         _route_loads(route, demands), capacities[vehicle_id], km)
+            if option is not None and (best is None or option[2] < best[1][2]):
+                best = (vehicle_id, option)
+        if best is None:
+            leftover.append(i)
+            continue
+        vehicle_id, (p, d, _) = best
+        routes[vehicle_id][d:d] = [2 * i + 1]
+        routes[vehicle_id][p:p] = [2 * i]
+        affected.add(vehicle_id)
+        inserted.append(orders[i]['order_id'])
+
+    # Re-solve only the affected vehicles, warm-started from the edited routes.
+    sub_vehicles = [v for v in vehicles if v['vehicle_id'] in affected]
+    sub_index = sorted({p // 2 for vid in affected for p in routes[vid]} | set(leftover))
+    sub_orders = [orders[i] for i in sub_index]
+    local = {i: k for k, i in enumerate(sub_index)}
+    for vehicle in vehicles:
+        if vehicle['vehicle_id'] in previous_routes and vehicle['vehicle_id'] not in affected:
+            route = _route_from_points(vehicle, routes[vehicle['vehicle_id']], orders, km,
+                                       speed_kmph, service_minutes, start_time)
+            if route is not None:
+                result['routes'].append(route)
+    assigned = {o for r in result['routes'] for o in r['orders']}
+
+    if sub_vehicles and sub_orders:
+        point_index = np.array([2 * i + side for i in sub_index for side in (0, 1)])
+        sub_km = km[np.ix_(point_index, point_index)]
+        manager, routing, time_dim = _build_model(sub_orders, sub_vehicles, sub_km, speed_kmph,
+                                                  service_minutes, start_time)
+        initial_routes = [[manager.NodeToIndex(2 * local[p // 2] + p % 2 + 1) for p in routes[v['vehicle_id']]]
+                          for v in sub_vehicles]
+        params = _search_parameters(time_limit, 'PARALLEL_CHEAPEST_INSERTION')
+        routing.CloseModelWithParameters(params)
+        initial = routing.ReadAssignmentFromRoutes(initial_routes, True)
+        if initial is not None:
+            solution = routing.SolveFromAssignmentWithParameters(initial, params)
+        else:
+            solution = routing.SolveWithParameters(params)
+        if solution is not None:
+            sub_routes, sub_assigned = _extract_routes(solution, manager, routing, time_dim, sub_orders,
+                                                       sub_vehicles, sub_km, speed_kmph, start_time)
+            result['routes'].extend(sub_routes)
+            assigned |= sub_assigned
+            result['objective'] = solution.ObjectiveValue()
+        else:
+            # No solution within the time limit: keep the cheapest-insertion edits.
+            for vehicle in sub_vehicles:
+                route = _route_from_points(vehicle, routes[vehicle['vehicle_id']], orders, km,
+                                           speed_kmph, service_minutes, start_time)
+                if route is not None:
+                    result['routes'].append(route)
+                    assigned.update(route['orders'])
+
+    result['routes'].sort(key=lambda r: r['vehicle'])
+    result['unassigned'] = [o['order_id'] for o in orders if o['order_id'] not in assigned]
+    result.update({
+        'status': 'solved',
+        'affected_vehicles': sorted(affected),
+        'inserted': inserted,
+        'removed': sorted(removed),
+        'changed': sorted(changed),
+        'order_fingerprints': fingerprints,
+        'solve_seconds': round(time.perf_counter() - started, 3),
+    })
+    return result
+
+
+# -------------------------- Plan persistence --------------------------
+
+def create_route_plans_table(cur):
+    """Creates the table of computed plans; the newest one is current, older ones are pruned."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS route_plans (
+            plan_id SERIAL PRIMARY KEY,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            mode VARCHAR(20) NOT NULL,
+            plan JSONB NOT NULL
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS order_dispatch (
+            order_id VARCHAR(50) PRIMARY KEY,
+            vehicle_id VARCHAR(50) NOT NULL,
+            driver_id VARCHAR(50),
+            plan_id INTEGER NOT NULL,
+            distance_km DOUBLE PRECISION,
+            fuel_liters DOUBLE PRECISION,
+            dispatched_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+    """)
+
+
+def save_plan(cur, plan):
+    """Stores a plan, records which vehicle carries each routed order, and returns the plan id.
+
+    A route's distance and fuel are split evenly across the orders it carries.
+    Orders the plan could not place lose their previous assignment.
+    """
+    cur.execute("INSERT INTO route_plans (mode, plan) VALUES (%s, %s) RETURNING plan_id",
+                (plan.get('mode', 'full'), Json(plan)))
+    plan_id = cur.fetchone()[0]
+
+    dispatch = []
+    for route in plan['routes']:
+        share = 1 / max(len(route['orders']), 1)
+        fuel = route.get('estimated_fuel_liters')
+        driver = None if route['driver'] == 'Unassigned' else route['driver']
+        dispatch.extend((order_id, route['vehicle'], driver, plan_id, route['distance_km'] * share,
+                         None if fuel is None else fuel * share) for order_id in route['orders'])
+    if dispatch:
+        execute_values(cur, """
+            INSERT INTO order_dispatch (order_id, vehicle_id, driver_id, plan_id, distance_km, fuel_liters)
+            VALUES %s
+            ON CONFLICT (order_id) DO UPDATE SET
+                vehicle_id = EXCLUDED.vehicle_id, driver_id = EXCLUDED.driver_id,
+                plan_id = EXCLUDED.plan_id, distance_km = EXCLUDED.distance_km,
+                fuel_liters = EXCLUDED.fuel_liters, dispatched_at = NOW()
+            WHERE (order_dispatch.vehicle_id, order_dispatch.distance_km, order_dispatch.fuel_liters)
+                IS DISTINCT FROM (EXCLUDED.vehicle_id, EXCLUDED.distance_km, EXCLUDED.fuel_liters)
+        """, dispatch)
+    if plan.get('unassigned'):
+        cur.execute("DELETE FROM order_dispatch WHERE order_id = ANY(%s)", (list(plan['unassigned']),))
+    return plan_id
+
+
+def _route_signature(plan):
+    return (sorted((r['vehicle'], r['driver'], [(s['order_id'], s['type']) for s in r['stops']])
+                   for r in plan['routes']),
+            sorted(plan['unassigned']))
+
+
+def same_routes(stored, plan):
+    """Whether `plan` sends every vehicle and driver through the same stops as `stored`, ignoring ETAs."""
+    return _route_signature(stored) == _route_signature(plan)
+
+
+def prune_plans(cur, retention_days):
+    """Deletes plans older than `retention_days`; the current plan is always kept."""
+    cur.execute("""
+        DELETE FROM route_plans
+        WHERE created_at < NOW() - %s * INTERVAL '1 day'
+          AND plan_id < (SELECT MAX(plan_id) FROM route_plans)
+    """, (retention_days,))
+    return cur.rowcount
+
+
+def load_latest_plan(cur):
+    """Returns the most recently stored plan, or None."""
+    cur.execute("SELECT plan_id, plan FROM route_plans ORDER BY plan_id DESC LIMIT 1")
+    row = cur.fetchone()
+    if row is None:
+        return None
+    plan = row[1]
+    plan['plan_id'] = row[0]
+    return plan
+
+
+def _summarize_route(vehicle, stops, km, speed_kmph):
+    """Shapes one vehicle's stop sequence into the fields route_optimize.html renders."""
+    nodes = [s.pop('node') - 1 for s in stops]
+    distance_km = float(sum(km[a, b] for a, b in zip(nodes, nodes[1:])))
+    drops = [s['eta'] for s in stops if s['type'] == 'drop']
+    order_ids = list(dict.fromkeys(s['order_id'] for s in stops))
+    return {
+        'vehicle': vehicle['vehicle_id'],
+        'driver': vehicle['driver_id'] or 'Unassigned',
+        'orders': order_ids,
+        'stops': [dict(s, eta=s['eta'].isoformat()) for s in stops],
+        'distance_km': round(distance_km, 1),
+        'estimated_travel_time_hrs': round(distance_km / speed_kmph, 1),
+        'estimated_fuel_liters': round(distance_km / vehicle['avg'], 1) if vehicle['avg'] > 0 else None,
+        'suggested_delivery_window': f"{min(drops):%Y-%m-%d %H:%M} - {max(drops):%Y-%m-%d %H:%M}",
+        'map_url': '',
+    }
@@ -0,0 +1,157 @@
+# --------------------------------------------------------------------------------------
+# Regional partitioning for large route optimizations.
+# Pending orders are clustered by pickup location with k-means, fleet vehicles are
+# shared out between clusters in proportion to the load each cluster has to move, and
+# every cluster is solved as its own VRP in a separate process. The per-cluster plans
+# are then merged into one plan for route_optimize.html.
+# --------------------------------------------------------------------------------------
+
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from distance_matrix import DistanceMatrixCache
+from route_optimizer import order_fingerprints, solve_routes
+
+KMEANS_ITERATIONS = 50
+KMEANS_SEED = 42
+
+
+def kmeans_partition(coords, k, iterations=KMEANS_ITERATIONS, seed=KMEANS_SEED):
+    """Clusters (lat, lon) rows into `k` groups; returns a label per row.
+
+    Points are projected with an equirectangular approximation, which is close
+    enough for grouping stops within a country.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    n = len(coords)
+    k = max(1, min(k, n))
+    xy = np.column_stack([coords[:, 1] * np.cos(np.radians(coords[:, 0].mean())), coords[:, 0]])
+
+    # k-means++ seeding
+    rng = np.random.default_rng(seed)
+    centers = np.empty((k, 2))
+    centers[0] = xy[rng.integers(n)]
+    closest = ((xy - centers[0]) ** 2).sum(axis=1)
+    for c in range(1, k):
+        total = closest.sum()
+        pick = rng.choice(n, p=closest / total) if total > 0 else rng.integers(n)
+        centers[c] = xy[pick]
+        closest = np.minimum(closest, ((xy - centers[c]) ** 2).sum(axis=1))
+
+    labels = np.zeros(n, dtype=np.int64)
+    for iteration in range(iterations):
+        dist = ((xy[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        new_labels = dist.argmin(axis=1)
+        if iteration > 0 and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for c in range(k):
+            members = xy[labels == c]
+            if len(members):
+                centers[c] = members.mean(axis=0)
+    return labels
+
+
+def allocate_vehicles(cluster_demand, vehicles):
+    """Shares vehicles between clusters; returns a list of vehicle lists, one per cluster.
+
+    Every cluster first gets one vehicle, then the remaining vehicles, largest
+    first, go to whichever cluster has the most weight left uncovered.
+    """
+    k = len(cluster_demand)
+    ordered = sorted(vehicles, key=lambda v: v['capacity_weight_kg'], reverse=True)
+    allocation = [[] for _ in range(k)]
+    remaining = np.asarray(cluster_demand, dtype=np.float64).copy()
+    for c in np.argsort(-remaining)[:len(ordered)]:
+        vehicle = ordered.pop(0)
+        allocation[c].append(vehicle)
+        remaining[c] -= vehicle['capacity_weight_kg']
+    for vehicle in ordered:
+        c = int(remaining.argmax())
+        allocation[c].append(vehicle)
+        remaining[c] -= vehicle['capacity_weight_kg']
+    return allocation
+
+
+def _solve_partition(index, orders, vehicles, cache_dir, kwargs):
+    """Process-pool entry point: solves one cluster and times it."""
+    started = time.perf_counter()
+    cache = DistanceMatrixCache(cache_dir) if cache_dir else None
+    plan = solve_routes(orders, vehicles, matrix_cache=cache, **kwargs)
+    plan['partition'] = index
+    plan['wall_seconds'] = round(time.perf_counter() - started, 3)
+    return plan
+
+
+class PartitionedRouteSolver:
+    """Solves regional sub-problems on a process pool owned by the current process."""
+
+    def __init__(self, max_workers=None, cache_dir=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self):
+        # Spawned (not forked) children, so they never inherit the web worker's
+        # threads or database sockets; each gunicorn worker keeps its own pool.
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                self._pid = os.getpid()
+            return self._executor
+
+    def solve(self, orders, vehicles, partitions, **kwargs):
+        """Clusters orders into `partitions` regions, solves them in parallel and merges the plans."""
+        started = time.perf_counter()
+        kwargs.setdefault('start_time', datetime.now().replace(second=0, microsecond=0))
+        partitions = max(1, min(partitions, len(orders), len(vehicles)))
+        pickups = np.array([o['pickup'] for o in orders], dtype=np.float64).reshape(-1, 2)
+        labels = kmeans_partition(pickups, partitions) if len(orders) else np.zeros(0, dtype=np.int64)
+
+        clusters = [[o for o, label in zip(orders, labels) if label == c] for c in range(partitions)]
+        clusters = [c for c in clusters if c]
+        demand = [sum(o['weight_kg'] for o in c) for c in clusters]
+        fleets = allocate_vehicles(demand, vehicles) if clusters else []
+
+        executor = self._get_executor()
+        futures = [executor.submit(_solve_partition, i, cluster, fleet, self.cache_dir, kwargs)
+                   for i, (cluster, fleet) in enumerate(zip(clusters, fleets))]
+        plans = [f.result() for f in futures]
+
+        merged = {
+            'routes': sorted((r for p in plans for r in p['routes']), key=lambda r: r['vehicle']),
+            'unassigned': [o for p in plans for o in p['unassigned']],
+            'status': 'empty' if not plans else (
+                'solved' if all(p['status'] in ('solved', 'empty') for p in plans) else 'no_solution'),
+            'mode': 'partitioned',
+            'objective': sum(p['objective'] or 0 for p in plans),
+            'planned_at': plans[0]['planned_at'] if plans else None,
+            'order_fingerprints': order_fingerprints(orders),
+            'partitions': [{
+                'partition': p['partition'],
+                'orders': len(clusters[p['partition']]),
+                'vehicles': len(fleets[p['partition']]),
+                'status': p['status'],
+                'solve_seconds': p['solve_seconds'],
+                'wall_seconds': p['wall_seconds'],
+            } for p in plans],
+            'workers': self.max_workers,
+        }
+        merged['solve_seconds'] = round(time.perf_counter() - started, 3)
+        merged['serial_seconds'] = round(sum(p['wall_seconds'] for p in plans), 3)
+        return merged
+
+
+def suggested_partitions(n_orders, orders_per_partition):
+    """Number of regions needed to keep each sub-problem near `orders_per_partition` orders."""
+    return max(1, math.ceil(n_orders / max(orders_per_partition, 1)))
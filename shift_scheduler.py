@@ -0,0 +1,495 @@
+# --------------------------------------------------------------------------------------
+# Driver shift scheduling: assigns available drivers to vehicles and shifts across a
+# planning horizon with OR-Tools CP-SAT.
+# The solver decides who works which (day, shift) slot, one boolean per driver and
+# slot, under hours-of-service rules: at most one shift a day, a minimum rest between
+# shifts, a cap on hours in any rolling 7 days and on consecutive working days, with
+# the previous roster carried into the horizon. Vehicles are interchangeable within a
+# slot, so the model only caps each slot at the number of roadworthy vehicles and the
+# vehicles are handed out after the solve, home vehicles first. That keeps the model
+# linear in drivers. A greedy roster, warm-started from the stored roster or the
+# drivers' current vehicle and shift, seeds CP-SAT, so thousands of drivers get a
+# roster within the time budget even when the solver cannot improve on it.
+# --------------------------------------------------------------------------------------
+
+import csv
+import io
+import re
+import time
+from datetime import datetime, timedelta
+
+from ortools.sat.python import cp_model
+from psycopg2.extras import Json
+
+DEFAULT_SHIFTS = 'Morning=06:00-14:00,Evening=14:00-22:00,Night=22:00-06:00'
+DEFAULT_HORIZON_DAYS = 7
+DEFAULT_TIME_LIMIT_SECONDS = 30
+DEFAULT_RULES = {'min_rest_hours': 11, 'max_weekly_hours': 48, 'max_consecutive_days': 6}
+
+# Objective weights: staffing a vehicle shift dominates; among equally staffed
+# rosters, prefer drivers' stated shifts and spread shifts evenly.
+COVERAGE_WEIGHT = 100
+PREFERENCE_WEIGHT = 10
+FAIRNESS_WEIGHT = 20
+
+SCHEDULE_LOCK_KEY = 7310415
+TIME_RANGE = re.compile(r'(\d{1,2}):?(\d{2})\s*(?:-|to)\s*(\d{1,2}):?(\d{2})')
+
+
+def parse_shift_definitions(text):
+    """'Name=HH:MM-HH:MM,...' as [{'name', 'start', 'minutes'}]; start is minutes after midnight.
+
+    A shift whose end is not after its start runs past midnight.
+    """
+    shifts = []
+    for part in filter(None, (p.strip() for p in text.split(','))):
+        name, _, window = part.partition('=')
+        match = TIME_RANGE.fullmatch(window.strip())
+        if not name.strip() or not match:
+            raise ValueError(f'Invalid shift definition: {part!r} (expected Name=HH:MM-HH:MM)')
+        h1, m1, h2, m2 = map(int, match.groups())
+        start, end = h1 * 60 + m1, h2 * 60 + m2
+        shifts.append({'name': name.strip(), 'start': start, 'minutes': (end - start) % 1440 or 1440})
+    if not shifts:
+        raise ValueError('At least one shift must be defined')
+    return shifts
+
+
+def preferred_shifts(shift_info, shifts):
+    """Indexes of the shifts a driver's free-text shift_info asks for: by name, or by time range."""
+    text = (shift_info or '').casefold()
+    named = {k for k, s in enumerate(shifts) if s['name'].casefold() in text}
+    if named:
+        return named
+    match = TIME_RANGE.search(text)
+    if not match:
+        return set()
+    h1, m1, h2, m2 = map(int, match.groups())
+    start = h1 * 60 + m1
+    minutes = (h2 * 60 + m2 - start) % 1440 or 1440
+
+    def overlap(s):
+        return sum(max(0, min(start + minutes, s['start'] + shift + s['minutes']) - max(start, s['start'] + shift))
+                   for shift in (-1440, 0, 1440))
+    best = max(range(len(shifts)), key=lambda k: overlap(shifts[k]))
+    return {best} if overlap(shifts[best]) else set()
+
+
+def create_shift_tables(cur):
+    """Creates the schedule run log and the per-shift driver/vehicle roster."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS shift_schedule_runs (
+            run_id SERIAL PRIMARY KEY,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            horizon_start DATE NOT NULL,
+            horizon_days INTEGER NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            summary JSONB NOT NULL
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS driver_shift_assignments (
+            shift_date DATE NOT NULL,
+            shift_name VARCHAR(20) NOT NULL,
+            driver_id VARCHAR(50) NOT NULL,
+            vehicle_id VARCHAR(50) NOT NULL,
+            starts_at TIMESTAMP NOT NULL,
+            ends_at TIMESTAMP NOT NULL,
+            run_id INTEGER NOT NULL,
+            PRIMARY KEY (shift_date, shift_name, driver_id),
+            UNIQUE (shift_date, shift_name, vehicle_id)
+        );
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_driver_shift_assignments_driver
+        ON driver_shift_assignments (driver_id, starts_at);
+    """)
+
+
+def load_scheduling_inputs(cur, start, days):
+    """Available drivers, active vehicles and the roster around the horizon starting at `start`."""
+    cur.execute("""
+        SELECT dm.driver_id, dm.shift_info, COALESCE(dm.vehicle_id, f.vehicle_id)
+        FROM driver_master AS dm
+        LEFT JOIN LATERAL (
+            SELECT vehicle_id FROM fleet WHERE fleet.driver_id = dm.driver_id ORDER BY vehicle_id LIMIT 1
+        ) AS f ON TRUE
+        WHERE lower(dm.availability) = 'available'
+        ORDER BY dm.driver_id
+    """)
+    drivers = [{'driver_id': r[0], 'shift_info': r[1], 'home_vehicle': r[2]} for r in cur.fetchall()]
+    cur.execute("""
+        SELECT vehicle_id, documents_expiry
+        FROM fleet
+        WHERE status = 'Active'
+        ORDER BY vehicle_id
+    """)
+    vehicles = [{'vehicle_id': r[0], 'documents_expiry': r[1]} for r in cur.fetchall()]
+    # The week before the horizon, for rest, weekly-hours and consecutive-day limits,
+    # and the horizon itself as the warm start.
+    cur.execute("""
+        SELECT driver_id, shift_date, shift_name, starts_at, ends_at
+        FROM driver_shift_assignments
+        WHERE shift_date >= %s::date - 7 AND shift_date < %s::date + %s
+    """, (start, start, days))
+    history, previous = [], []
+    for driver_id, shift_date, shift_name, starts_at, ends_at in cur.fetchall():
+        (history if shift_date < start else previous).append(
+            {'driver_id': driver_id, 'shift_date': shift_date, 'shift_name': shift_name,
+             'starts_at': starts_at, 'ends_at': ends_at})
+    return {'start': start, 'days': days, 'drivers': drivers, 'vehicles': vehicles,
+            'history': history, 'previous': previous}
+
+
+# -------------------------- Model --------------------------
+
+def _build_slots(start, days, shifts, vehicles):
+    """One slot per (day, shift), in start order, with the vehicles roadworthy that day."""
+    slots = []
+    for day in range(days):
+        shift_date = start + timedelta(days=day)
+        available = [v['vehicle_id'] for v in vehicles
+                     if v['documents_expiry'] is None or v['documents_expiry'] >= shift_date]
+        for k, shift in enumerate(shifts):
+            begin = day * 1440 + shift['start']
+            slots.append({'day': day, 'shift': k, 'date': shift_date, 'start': begin,
+                          'end': begin + shift['minutes'], 'vehicles': available})
+    slots.sort(key=lambda s: s['start'])
+    return slots
+
+
+def _rest_conflicts(slots, rest_minutes):
+    """Pairs of slots on different days that overlap or leave less than the minimum rest between them."""
+    pairs = []
+    for a in range(len(slots)):
+        for b in range(a + 1, len(slots)):
+            if slots[b]['start'] >= slots[a]['end'] + rest_minutes:
+                break
+            if slots[a]['day'] != slots[b]['day']:
+                pairs.append((a, b))
+    return pairs
+
+
+def prepare_problem(inputs, shifts, rules=None):
+    """Slots, per-driver preferences and the hours-of-service limits carried in from history."""
+    rules = dict(DEFAULT_RULES, **(rules or {}))
+    start, days, drivers = inputs['start'], inputs['days'], inputs['drivers']
+    slots = _build_slots(start, days, shifts, inputs['vehicles'])
+    rest = int(rules['min_rest_hours'] * 60)
+    horizon_start = datetime.combine(start, datetime.min.time())
+
+    # Per driver: slots too close to a shift worked before the horizon, and the
+    # minutes / working days already spent in the days leading up to it.
+    carried = {}
+    for h in inputs['history']:
+        day = (h['shift_date'] - start).days
+        h_start = (h['starts_at'] - horizon_start).total_seconds() / 60
+        h_end = (h['ends_at'] - horizon_start).total_seconds() / 60
+        blocked, minutes, worked_days = carried.setdefault(h['driver_id'], (set(), {}, set()))
+        blocked.update(j for j, s in enumerate(slots) if s['start'] < h_end + rest and h_start < s['end'] + rest)
+        minutes[day] = minutes.get(day, 0) + int(h_end - h_start)
+        worked_days.add(day)
+
+    capacity = sum(len(s['vehicles']) for s in slots)
+    index = {(s['date'], shifts[s['shift']]['name']): j for j, s in enumerate(slots)}
+    previous = {}
+    for p in inputs['previous']:
+        if (p['shift_date'], p['shift_name']) in index:
+            previous.setdefault(p['driver_id'], set()).add(index[(p['shift_date'], p['shift_name'])])
+    return {
+        'slots': slots, 'days': days, 'drivers': drivers,
+        'by_day': [[j for j, s in enumerate(slots) if s['day'] == day] for day in range(days)],
+        'conflicts': _rest_conflicts(slots, rest),
+        'preferences': [preferred_shifts(d['shift_info'], shifts) for d in drivers],
+        'carried': carried, 'previous': previous, 'capacity': capacity,
+        'target': capacity // len(drivers) if drivers else 0,
+        'max_week': int(rules['max_weekly_hours'] * 60), 'max_run': int(rules['max_consecutive_days']),
+    }
+
+
+def score(problem, worked):
+    """The CP-SAT objective for a roster given as {driver index: [slot indexes]}."""
+    slots, preferences, target = problem['slots'], problem['preferences'], problem['target']
+    total = 0
+    for d, js in worked.items():
+        total += COVERAGE_WEIGHT * len(js) - FAIRNESS_WEIGHT * max(len(js) - target, 0)
+        total += PREFERENCE_WEIGHT * sum(1 for j in js if slots[j]['shift'] in preferences[d])
+    return total
+
+
+def greedy_roster(problem):
+    """A feasible roster built driver by driver; the warm start for CP-SAT.
+
+    Each driver keeps their stored shifts for the horizon where the limits still
+    allow, otherwise works their preferred shift (or, failing that, any shift
+    with a free vehicle) on as many days as the limits allow. A first pass stops
+    every driver at the fair share of vehicle shifts, a second hands out the rest.
+    """
+    slots, by_day, drivers = problem['slots'], problem['by_day'], problem['drivers']
+    max_week, max_run = problem['max_week'], problem['max_run']
+    conflicts = set(problem['conflicts'])
+    used = [0] * len(slots)
+    worked = {d: [] for d in range(len(drivers))}
+
+    def fits(d, j):
+        slot = slots[j]
+        if used[j] >= len(slot['vehicles']):
+            return False
+        blocked, past_minutes, past_days = problem['carried'].get(drivers[d]['driver_id'], ((), {}, ()))
+        if j in blocked:
+            return False
+        mine = worked[d]
+        day = slot['day']
+        if any(slots[c]['day'] == day or (min(c, j), max(c, j)) in conflicts for c in mine):
+            return False
+        minutes = {slots[c]['day']: slots[c]['end'] - slots[c]['start'] for c in mine}
+        minutes[day] = slot['end'] - slot['start']
+        for first in range(day - 6, day + 1):
+            window = range(first, first + 7)
+            if (sum(m for k, m in past_minutes.items() if k in window)
+                    + sum(m for k, m in minutes.items() if k in window)) > max_week:
+                return False
+        days_on = set(past_days) | set(minutes)
+        for first in range(day - max_run, day + 1):
+            if sum(1 for k in range(first, first + max_run + 1) if k in days_on) > max_run:
+                return False
+        return True
+
+    for quota in (problem['target'], len(slots)):
+        for d, driver in enumerate(drivers):
+            stored = problem['previous'].get(driver['driver_id'], set())
+            preferred = problem['preferences'][d]
+            for day_slots in by_day:
+                if len(worked[d]) >= quota:
+                    break
+                if any(j in day_slots for j in worked[d]):
+                    continue
+                for j in sorted(day_slots, key=lambda j: (j not in stored, slots[j]['shift'] not in preferred,
+                                                          used[j] / max(len(slots[j]['vehicles']), 1))):
+                    if fits(d, j):
+                        worked[d].append(j)
+                        used[j] += 1
+                        break
+    return worked
+
+
+def solve_shift_schedule(inputs, shifts, rules=None, time_limit=DEFAULT_TIME_LIMIT_SECONDS, workers=8):
+    """Builds the greedy roster and refines it with CP-SAT; returns (problem, worked, status, summary).
+
+    `worked` maps driver index -> list of slot indexes. `time_limit` covers the
+    whole run: CP-SAT gets whatever the greedy pass and model build leave of it,
+    and its result is kept only when it scores at least as well as the greedy
+    roster, so a tight budget never costs a worse answer.
+    """
+    started = time.perf_counter()
+    problem = prepare_problem(inputs, shifts, rules)
+    slots, by_day, drivers = problem['slots'], problem['by_day'], problem['drivers']
+    max_week, max_run = problem['max_week'], problem['max_run']
+    greedy = greedy_roster(problem)
+    greedy_seconds = time.perf_counter() - started
+
+    model = cp_model.CpModel()
+    y = [[model.NewBoolVar(f'y_{d}_{j}') for j in range(len(slots))] for d in range(len(drivers))]
+    for d, driver in enumerate(drivers):
+        row = y[d]
+        for day_slots in by_day:
+            model.AddAtMostOne([row[j] for j in day_slots])
+        for a, b in problem['conflicts']:
+            model.AddBoolOr([row[a].Not(), row[b].Not()])
+
+        blocked, past_minutes, past_days = problem['carried'].get(driver['driver_id'], ((), {}, ()))
+        for j in blocked:
+            model.Add(row[j] == 0)
+        # Any 7 consecutive days: at most max_weekly_hours, counted by shift start date.
+        for first in range(-6, len(by_day)):
+            window = [j for day in range(max(first, 0), min(first + 7, len(by_day))) for j in by_day[day]]
+            carried = sum(m for day, m in past_minutes.items() if first <= day < first + 7)
+            lengths = [slots[j]['end'] - slots[j]['start'] for j in window]
+            # At most one shift a day, so only windows whose longest shifts could exceed the cap need a row.
+            if carried + sum(sorted(lengths)[-7:]) > max_week:
+                model.Add(sum(m * row[j] for m, j in zip(lengths, window)) <= max(max_week - carried, 0))
+        # Any max_consecutive_days + 1 consecutive days include a day off.
+        for first in range(-max_run, max(len(by_day) - max_run, 1)):
+            window = range(max(first, 0), min(first + max_run + 1, len(by_day)))
+            carried = sum(1 for day in past_days if first <= day < first + max_run + 1)
+            if carried + len(window) > max_run:
+                model.Add(sum(row[j] for day in window for j in by_day[day]) <= max(max_run - carried, 0))
+
+    # Staff each slot with no more drivers than roadworthy vehicles.
+    for j, slot in enumerate(slots):
+        model.Add(sum(y[d][j] for d in range(len(drivers))) <= len(slot['vehicles']))
+
+    coverage, preferred, excess = [], [], []
+    for d in range(len(drivers)):
+        coverage.extend(y[d])
+        preferred.extend(y[d][j] for j, s in enumerate(slots) if s['shift'] in problem['preferences'][d])
+        over = model.NewIntVar(0, len(slots), f'over_{d}')
+        model.Add(over >= sum(y[d]) - problem['target'])
+        excess.append(over)
+    model.Maximize(COVERAGE_WEIGHT * sum(coverage) + PREFERENCE_WEIGHT * sum(preferred)
+                   - FAIRNESS_WEIGHT * sum(excess))
+    for d in range(len(drivers)):
+        chosen = set(greedy[d])
+        for j in range(len(slots)):
+            model.AddHint(y[d][j], j in chosen)
+    build_seconds = time.perf_counter() - started - greedy_seconds
+
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = float(time_limit) - (time.perf_counter() - started)
+    solver.parameters.num_workers = workers
+    solver_status = solver.Solve(model) if solver.parameters.max_time_in_seconds > 0 else cp_model.UNKNOWN
+    worked, status = greedy, 'heuristic'
+    if solver_status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        exact = {d: [j for j in range(len(slots)) if solver.BooleanValue(y[d][j])] for d in range(len(drivers))}
+        if score(problem, exact) >= score(problem, greedy):
+            worked, status = exact, 'optimal' if solver_status == cp_model.OPTIMAL else 'feasible'
+
+    assigned = sum(len(v) for v in worked.values())
+    hits = sum(1 for d, js in worked.items() for j in js if slots[j]['shift'] in problem['preferences'][d])
+    summary = {
+        'drivers': len(drivers), 'vehicles': len(inputs['vehicles']), 'slots': len(slots),
+        'vehicle_shifts_available': problem['capacity'], 'shifts_assigned': assigned,
+        'coverage_pct': round(assigned / problem['capacity'] * 100, 1) if problem['capacity'] else 0.0,
+        'preferred_shift_pct': round(hits / assigned * 100, 1) if assigned else 0.0,
+        'max_shifts_per_driver': max((len(v) for v in worked.values()), default=0),
+        'warm_start': 'previous_schedule' if problem['previous'] else 'current_assignment',
+        'greedy_score': score(problem, greedy), 'score': score(problem, worked),
+        'best_bound': int(solver.BestObjectiveBound()) if solver_status in (cp_model.OPTIMAL, cp_model.FEASIBLE)
+        else None,
+        'greedy_seconds': round(greedy_seconds, 3), 'build_seconds': round(build_seconds, 3),
+        'solve_seconds': round(solver.WallTime(), 3),
+    }
+    return problem, worked, status, summary
+
+
+def assign_vehicles(problem, start, shifts, worked):
+    """Hands out vehicles slot by slot; returns roster rows.
+
+    Drivers take their home vehicle when it is roadworthy and no one else on
+    the shift has claimed it; everyone else keeps the vehicle they drove last
+    if it is free, or takes the first free one.
+    """
+    slots, drivers = problem['slots'], problem['drivers']
+    horizon_start = datetime.combine(start, datetime.min.time())
+    by_slot = {}
+    for d, js in worked.items():
+        for j in js:
+            by_slot.setdefault(j, []).append(d)
+    homed = {d['home_vehicle'] for d in drivers if d['home_vehicle'] is not None}
+    last_vehicle, rows = {}, []
+    for j, slot in enumerate(slots):
+        working = by_slot.get(j, [])
+        roadworthy = set(slot['vehicles'])
+        taken, vehicle_of = set(), {}
+        for d in working:
+            home = drivers[d]['home_vehicle']
+            if home in roadworthy and home not in taken:
+                vehicle_of[d] = home
+                taken.add(home)
+        # Vehicles nobody calls home go first, so home vehicles stay free for their drivers later.
+        free = sorted((v for v in slot['vehicles'] if v not in taken), key=lambda v: (v in homed, v))
+        for d in working:
+            if d in vehicle_of:
+                continue
+            vehicle_id = last_vehicle.get(d)
+            if vehicle_id not in roadworthy or vehicle_id in taken:
+                vehicle_id = next(v for v in free if v not in taken)
+            vehicle_of[d] = vehicle_id
+            taken.add(vehicle_id)
+        for d, vehicle_id in vehicle_of.items():
+            last_vehicle[d] = vehicle_id
+            begin = horizon_start + timedelta(minutes=slot['start'])
+            rows.append((slot['date'], shifts[slot['shift']]['name'], drivers[d]['driver_id'], vehicle_id,
+                         begin, begin + timedelta(minutes=slot['end'] - slot['start'])))
+    return rows
+
+
+def save_schedule(cur, inputs, status, summary, rows, update_master=True):
+    """Replaces the horizon's roster with `rows` in bulk; returns the run id.
+
+    With `update_master`, each rostered driver's driver_master.vehicle_id and
+    each rostered vehicle's fleet.driver_id become the one they share most shifts with.
+    """
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEDULE_LOCK_KEY,))
+    cur.execute("""
+        INSERT INTO shift_schedule_runs (horizon_start, horizon_days, status, summary)
+        VALUES (%s, %s, %s, %s) RETURNING run_id
+    """, (inputs['start'], inputs['days'], status, Json(summary)))
+    run_id = cur.fetchone()[0]
+    cur.execute("DELETE FROM driver_shift_assignments WHERE shift_date >= %s AND shift_date < %s::date + %s",
+                (inputs['start'], inputs['start'], inputs['days']))
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(row + (run_id,))
+    buffer.seek(0)
+    cur.copy_expert("""COPY driver_shift_assignments
+                       (shift_date, shift_name, driver_id, vehicle_id, starts_at, ends_at, run_id)
+                       FROM STDIN WITH (FORMAT csv)""", buffer)
+
+    summary['drivers_updated'] = summary['vehicles_updated'] = 0
+    if update_master and rows:
+        cur.execute("""
+            UPDATE driver_master AS dm SET vehicle_id = p.vehicle_id
+            FROM (SELECT DISTINCT ON (driver_id) driver_id, vehicle_id
+                  FROM driver_shift_assignments WHERE run_id = %s
+                  GROUP BY driver_id, vehicle_id
+                  ORDER BY driver_id, COUNT(*) DESC, vehicle_id) AS p
+            WHERE dm.driver_id = p.driver_id AND dm.vehicle_id IS DISTINCT FROM p.vehicle_id
+        """, (run_id,))
+        summary['drivers_updated'] = cur.rowcount
+        cur.execute("""
+            UPDATE fleet AS f SET driver_id = p.driver_id
+            FROM (SELECT DISTINCT ON (vehicle_id) vehicle_id, driver_id
+                  FROM driver_shift_assignments WHERE run_id = %s
+                  GROUP BY vehicle_id, driver_id
+                  ORDER BY vehicle_id, COUNT(*) DESC, driver_id) AS p
+            WHERE f.vehicle_id = p.vehicle_id AND f.driver_id IS DISTINCT FROM p.driver_id
+        """, (run_id,))
+        summary['vehicles_updated'] = cur.rowcount
+    cur.execute("UPDATE shift_schedule_runs SET summary = %s WHERE run_id = %s", (Json(summary), run_id))
+    return run_id
+
+
+def plan_shifts(inputs, shifts=None, rules=None, time_limit=DEFAULT_TIME_LIMIT_SECONDS):
+    """Solves the roster for loaded inputs without touching the database; returns (status, summary, rows).
+
+    `rows` is what save_schedule writes back.
+    """
+    shifts = shifts or parse_shift_definitions(DEFAULT_SHIFTS)
+    problem, worked, status, summary = solve_shift_schedule(inputs, shifts, rules=rules, time_limit=time_limit)
+    summary.update(status=status, horizon_start=inputs['start'].isoformat(), horizon_days=inputs['days'])
+    return status, summary, assign_vehicles(problem, inputs['start'], shifts, worked)
+
+
+def schedule_shifts(cur, start, days=DEFAULT_HORIZON_DAYS, shifts=None, rules=None,
+                    time_limit=DEFAULT_TIME_LIMIT_SECONDS, update_master=True):
+    """Loads inputs, solves and writes the roster back; returns the run summary.
+
+    The caller commits. Callers that should not hold a connection through the
+    solve use load_scheduling_inputs, plan_shifts and save_schedule instead.
+    """
+    inputs = load_scheduling_inputs(cur, start, days)
+    status, summary, rows = plan_shifts(inputs, shifts, rules=rules, time_limit=time_limit)
+    summary['run_id'] = save_schedule(cur, inputs, status, summary, rows, update_master=update_master)
+    return summary
+
+
+def fetch_schedule(cur, start, days, driver_id=None, vehicle_id=None):
+    """Stored roster rows for the horizon, optionally for one driver or vehicle."""
+    conditions, params = ['shift_date >= %s', 'shift_date < %s::date + %s'], [start, start, days]
+    if driver_id:
+        conditions.append('driver_id = %s')
+        params.append(driver_id)
+    if vehicle_id:
+        conditions.append('vehicle_id = %s')
+        params.append(vehicle_id)
+    cur.execute(f"""
+        SELECT shift_date, shift_name, driver_id, vehicle_id, starts_at, ends_at, run_id
+        FROM driver_shift_assignments
+        WHERE {' AND '.join(conditions)}
+        ORDER BY starts_at, vehicle_id
+    """, params)
+    return [{'shift_date': r[0].isoformat(), 'shift_name': r[1], 'driver_id': r[2], 'vehicle_id': r[3],
+             'starts_at': r[4].isoformat(), 'ends_at': r[5].isoformat(), 'run_id': r[6]} for r in cur.fetchall()]
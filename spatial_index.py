@@ -0,0 +1,229 @@
+# --------------------------------------------------------------------------------------
+# Spatial lookups for dispatch.
+# Points are bucketed into a uniform lat/lon grid and stored sorted by cell key, so a
+# radius query only touches the few contiguous runs of cells that overlap its bounding
+# box before computing exact haversine distances. Nearest-k searches widen the radius
+# until k points are found. Indexes are kept for the latest vehicle positions and for
+# the pickup and drop points of open orders; order addresses resolve through the
+# geocode cache, as they do for route planning.
+# --------------------------------------------------------------------------------------
+
+import math
+import threading
+import time
+
+import numpy as np
+
+from distance_matrix import haversine_matrix, parse_latlon_array
+
+KM_PER_DEGREE = 111.32
+DEFAULT_CELL_KM = 2.0
+CLOSED_ORDER_STATUSES = ('Delivered', 'Cancelled')
+
+
+class GridIndex:
+    """Immutable grid index over (lat, lon) points with nearest-k and radius queries.
+
+    Longitudes do not wrap at the antimeridian, which is fine for a single-country fleet.
+    """
+
+    def __init__(self, ids, coords, cell_km=DEFAULT_CELL_KM):
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        valid = ~np.isnan(coords).any(axis=1)
+        ids = np.asarray(ids, dtype=object)[valid]
+        coords = coords[valid]
+
+        self.cell_km = cell_km
+        self.cell_deg = cell_km / KM_PER_DEGREE
+        self._row_width = int(math.ceil(360 / self.cell_deg)) + 1
+        keys = self._cell_row(coords[:, 0]) * self._row_width + self._cell_col(coords[:, 1])
+        order = np.argsort(keys, kind='stable')
+        self._keys = keys[order]
+        self.ids = ids[order]
+        self.coords = coords[order]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _cell_row(self, lat):
+        return np.floor((np.asarray(lat) + 90) / self.cell_deg).astype(np.int64)
+
+    def _cell_col(self, lon):
+        return np.floor((np.asarray(lon) + 180) / self.cell_deg).astype(np.int64)
+
+    def _candidates(self, lat, lon, radius_km):
+        """Indexes of the points in every cell overlapping the query's bounding box."""
+        dlat = radius_km / KM_PER_DEGREE
+        # Degrees of longitude shrink towards the poles, so size the box at its poleward edge.
+        dlon = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(min(abs(lat) + dlat, 90))), 1e-6))
+        rows = np.arange(self._cell_row(lat - dlat), self._cell_row(lat + dlat) + 1)
+        if len(rows) > len(self._keys):
+            return np.arange(len(self._keys))
+        col_lo, col_hi = self._cell_col(max(lon - dlon, -180)), self._cell_col(min(lon + dlon, 180))
+        # Cells of one grid row are contiguous in key order, so each row is one slice.
+        starts = np.searchsorted(self._keys, rows * self._row_width + col_lo, side='left')
+        ends = np.searchsorted(self._keys, rows * self._row_width + col_hi, side='right')
+        keep = ends > starts
+        if not keep.any():
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([np.arange(s, e) for s, e in zip(starts[keep], ends[keep])])
+
+    def within(self, lat, lon, radius_km):
+        """Points within `radius_km` of (lat, lon); returns (indexes, distances) sorted by distance."""
+        candidates = self._candidates(lat, lon, radius_km)
+        if not len(candidates):
+            return candidates, np.zeros(0, dtype=np.float32)
+        dist = haversine_matrix(np.array([[lat, lon]]), self.coords[candidates])[0]
+        inside = dist <= radius_km
+        candidates, dist = candidates[inside], dist[inside]
+        order = np.argsort(dist, kind='stable')
+        return candidates[order], dist[order]
+
+    def nearest(self, lat, lon, k, max_radius_km=None):
+        """The `k` points closest to (lat, lon), optionally no further than `max_radius_km`."""
+        radius = self.cell_km
+        while True:
+            if max_radius_km is not None:
+                radius = min(radius, max_radius_km)
+            idx, dist = self.within(lat, lon, radius)
+            # Everything within `radius` has been seen, so once k points are inside
+            # it the k nearest are among them.
+            if (len(idx) >= k or len(idx) == len(self)
+                    or (max_radius_km is not None and radius >= max_radius_km)
+                    or radius > math.pi * 6371.0088):
+                return idx[:k], dist[:k]
+            radius *= 2
+
+
+def _resolve_points(values, known):
+    """(n, 2) coordinates of "lat,lon" strings, falling back to `known` {address: (lat, lon)}; NaN if neither."""
+    if not values:
+        return np.zeros((0, 2))
+    coords = parse_latlon_array(values)
+    for i, value in enumerate(values):
+        if value in known:
+            coords[i] = known[value]
+    return coords
+
+
+class SpatialIndex:
+    """Keeps grid indexes over live vehicle positions and open order pickup/drop points."""
+
+    def __init__(self, db_pool, tracking_store, cell_km=DEFAULT_CELL_KM, orders_ttl=60.0,
+                 vehicles_min_age=0.5, geocoder=None):
+        self.db_pool = db_pool
+        self.tracking_store = tracking_store
+        self.geocoder = geocoder         # GeocodingCache for order locations that are addresses
+        self.cell_km = cell_km
+        self.orders_ttl = orders_ttl
+        self.vehicles_min_age = vehicles_min_age
+        self._lock = threading.Lock()
+        self._vehicles = None            # (GridIndex, {vehicle_id: row}, version, built_at)
+        self._orders = None              # ({'pickup': GridIndex, 'drop': GridIndex}, {order_id: row}, built_at)
+        self.stats = {'vehicle_rebuilds': 0, 'order_rebuilds': 0, 'queries': 0}
+
+    # -------------------------- Index maintenance --------------------------
+
+    def _vehicle_index(self):
+        with self._lock:
+            cached = self._vehicles
+            if cached is not None and time.monotonic() - cached[3] < self.vehicles_min_age:
+                return cached
+        vehicle_ids, drivers, coords, version = self.tracking_store.coordinates()
+        with self._lock:
+            if self._vehicles is None or self._vehicles[2] != version:
+                details = {v: {'driver': d, 'location': tuple(c)}
+                           for v, d, c in zip(vehicle_ids, drivers, coords.tolist())}
+                self._vehicles = (GridIndex(vehicle_ids, coords, self.cell_km), details, version,
+                                  time.monotonic())
+                self.stats['vehicle_rebuilds'] += 1
+            else:
+                self._vehicles = self._vehicles[:3] + (time.monotonic(),)
+            return self._vehicles
+
+    def _order_index(self):
+        with self._lock:
+            cached = self._orders
+            if cached is not None and time.monotonic() - cached[2] < self.orders_ttl:
+                return cached
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT order_id, customer_name, status, pickup_location_latlon, drop_location_latlon
+                    FROM orders
+                    WHERE COALESCE(status, '') NOT IN %s
+                """, (CLOSED_ORDER_STATUSES,))
+                rows = cur.fetchall()
+                known = {}
+                if self.geocoder is not None:
+                    known = self.geocoder.lookup(cur, {v for r in rows for v in (r[3], r[4])})
+        order_ids = [r[0] for r in rows]
+        pickups = _resolve_points([r[3] for r in rows], known)
+        drops = _resolve_points([r[4] for r in rows], known)
+        details = {r[0]: {'customer_name': r[1], 'status': r[2], 'pickup': tuple(p), 'drop': tuple(d)}
+                   for r, p, d in zip(rows, pickups.tolist(), drops.tolist())}
+        grids = {'pickup': GridIndex(order_ids, pickups, self.cell_km),
+                 'drop': GridIndex(order_ids, drops, self.cell_km)}
+        with self._lock:
+            self._orders = (grids, details, time.monotonic())
+            self.stats['order_rebuilds'] += 1
+            return self._orders
+
+    def invalidate_orders(self):
+        """Forces the order index to reload on its next query."""
+        with self._lock:
+            self._orders = None
+
+    # -------------------------- Queries --------------------------
+
+    @staticmethod
+    def _search(grid, lat, lon, k, radius_km):
+        if k is None:
+            return grid.within(lat, lon, radius_km)
+        return grid.nearest(lat, lon, k, max_radius_km=radius_km)
+
+    def vehicle_location(self, vehicle_id):
+        """Latest (lat, lon) of a vehicle, or None."""
+        vehicle = self._vehicle_index()[1].get(vehicle_id)
+        return vehicle['location'] if vehicle else None
+
+    def order_location(self, order_id, point='pickup'):
+        """Pickup or drop (lat, lon) of an open order, or None."""
+        order = self._order_index()[1].get(order_id)
+        if order is None or any(math.isnan(v) for v in order[point]):
+            return None
+        return order[point]
+
+    def nearby_vehicles(self, lat, lon, k=None, radius_km=None):
+        """Vehicles nearest to a point (`k`), within `radius_km`, or both; closest first."""
+        grid, details, _, _ = self._vehicle_index()
+        self.stats['queries'] += 1
+        idx, dist = self._search(grid, lat, lon, k, radius_km)
+        return [{
+            'vehicle_id': grid.ids[i],
+            'driver': details[grid.ids[i]]['driver'] or 'Unassigned',
+            'lat': round(float(grid.coords[i, 0]), 6),
+            'lon': round(float(grid.coords[i, 1]), 6),
+            'distance_km': round(float(d), 3),
+        } for i, d in zip(idx, dist)]
+
+    def nearby_orders(self, lat, lon, k=None, radius_km=None, point='pickup'):
+        """Open orders whose pickup (or drop) point is nearest to / within range of a point."""
+        grids, details, _ = self._order_index()
+        self.stats['queries'] += 1
+        grid = grids[point]
+        idx, dist = self._search(grid, lat, lon, k, radius_km)
+        return [{
+            'order_id': grid.ids[i],
+            'customer_name': details[grid.ids[i]]['customer_name'],
+            'status': details[grid.ids[i]]['status'],
+            'lat': round(float(grid.coords[i, 0]), 6),
+            'lon': round(float(grid.coords[i, 1]), 6),
+            'distance_km': round(float(d), 3),
+        } for i, d in zip(idx, dist)]
+
+    def metrics(self):
+        vehicles, orders = self._vehicles, self._orders
+        return dict(self.stats,
+                    vehicles_indexed=len(vehicles[0]) if vehicles else 0,
+                    orders_indexed=len(orders[0]['pickup']) if orders else 0)
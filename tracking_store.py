@@ -0,0 +1,359 @@
+# --------------------------------------------------------------------------------------
+# Live vehicle tracking for the TMS application.
+# GPS pings are validated in bulk, folded into a compact in-memory index holding the
+# latest position of every fleet vehicle, and queued for the database. A background
+# thread writes queued pings to `vehicle_positions` with COPY and upserts
+# `vehicle_latest_positions`, which lets every gunicorn worker catch up on pings
+# that another worker received.
+# --------------------------------------------------------------------------------------
+
+import csv
+import io
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+MOVING_SPEED_KMPH = 2.0
+# Width of the vehicle_id columns below.
+MAX_VEHICLE_ID_LENGTH = 50
+
+
+def create_tracking_tables(cur):
+    """Creates the ping history and latest-position tables."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS vehicle_positions (
+            vehicle_id VARCHAR(50) NOT NULL,
+            recorded_at TIMESTAMPTZ NOT NULL,
+            lat DOUBLE PRECISION NOT NULL,
+            lon DOUBLE PRECISION NOT NULL,
+            speed REAL
+        );
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_vehicle_positions_vehicle_time
+        ON vehicle_positions (vehicle_id, recorded_at)
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS vehicle_latest_positions (
+            vehicle_id VARCHAR(50) PRIMARY KEY,
+            recorded_at TIMESTAMPTZ NOT NULL,
+            lat DOUBLE PRECISION NOT NULL,
+            lon DOUBLE PRECISION NOT NULL,
+            speed REAL
+        );
+    """)
+
+
+def _to_epoch(value):
+    """Accepts epoch seconds or an ISO-8601 string; returns epoch seconds or NaN."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return float('nan')
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    return float('nan')
+
+
+def _valid_vehicle_id(value):
+    # Anything the vehicle_id columns reject would fail the whole COPY batch on every retry.
+    text = '' if value is None else str(value)
+    return 0 < len(text) <= MAX_VEHICLE_ID_LENGTH and '\x00' not in text
+
+
+def parse_pings(pings):
+    """Converts a list of ping dicts into column arrays; returns (columns, errors).
+
+    Rows with a missing or over-long vehicle_id, out-of-range coordinates or an
+    unreadable timestamp are dropped and reported by their position in the batch.
+    """
+    n = len(pings)
+    vehicle_ids = np.empty(n, dtype=object)
+    values = np.full((n, 4), np.nan)
+    for i, ping in enumerate(pings):
+        if not isinstance(ping, dict):
+            continue
+        vehicle_ids[i] = ping.get('vehicle_id')
+        try:
+            values[i, 0] = float(ping.get('lat'))
+            values[i, 1] = float(ping.get('lon'))
+            values[i, 2] = float(ping.get('speed') or 0)
+        except (TypeError, ValueError):
+            continue
+        values[i, 3] = _to_epoch(ping.get('timestamp', time.time()))
+
+    lat, lon, speed, ts = values.T
+    valid = (~np.isnan(values).any(axis=1) & (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+             & np.array([_valid_vehicle_id(v) for v in vehicle_ids], dtype=bool))
+    errors = [f'ping {i}: invalid vehicle_id, coordinates or timestamp' for i in np.flatnonzero(~valid)]
+    columns = {
+        'vehicle_id': vehicle_ids[valid].astype(str),
+        'lat': lat[valid],
+        'lon': lon[valid],
+        'speed': speed[valid].astype(np.float32),
+        'ts': ts[valid],
+    }
+    return columns, errors
+
+
+class TrackingStore:
+    """Latest-position index for fleet vehicles plus a batched history writer."""
+
+    def __init__(self, db_pool, flush_interval=1.0, flush_batch_size=5000, fleet_refresh_interval=60.0,
+                 sync_interval=2.0):
+        self.db_pool = db_pool
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+        self.fleet_refresh_interval = fleet_refresh_interval
+        self.sync_interval = sync_interval
+
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._slots = {}                 # vehicle_id -> row in the arrays below
+        self._vehicle_ids = []
+        self._drivers = []
+        self._lat = np.zeros(0)
+        self._lon = np.zeros(0)
+        self._speed = np.zeros(0, dtype=np.float32)
+        self._ts = np.zeros(0)           # epoch seconds; 0 means no fix yet
+        self._changed = np.zeros(0, dtype=np.int64)  # version at which each slot last moved
+        self._version = 0
+        self._fleet_loaded_at = 0.0
+        self._synced_at = 0.0
+        self._pending = []               # column dicts waiting to be written
+        self._pending_rows = 0
+        self._flush_event = threading.Event()
+        self._flusher = None
+        self.stats = {'pings_accepted': 0, 'pings_rejected': 0,
+                      'rows_written': 0, 'flushes': 0, 'flush_errors': 0}
+
+    # -------------------------- Fleet index --------------------------
+
+    def _load_fleet(self):
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT f.vehicle_id, COALESCE(dm.driver_name, f.driver_id)
+                    FROM fleet AS f
+                    LEFT JOIN driver_master AS dm ON dm.driver_id = f.driver_id
+                    ORDER BY f.vehicle_id
+                """)
+                rows = cur.fetchall()
+
+        with self._lock:
+            for vehicle_id, driver in rows:
+                slot = self._slots.get(vehicle_id)
+                if slot is None:
+                    self._slots[vehicle_id] = len(self._vehicle_ids)
+                    self._vehicle_ids.append(vehicle_id)
+                    self._drivers.append(driver)
+                else:
+                    self._drivers[slot] = driver
+            grow = len(self._vehicle_ids) - len(self._ts)
+            if grow > 0:
+                self._lat = np.concatenate([self._lat, np.zeros(grow)])
+                self._lon = np.concatenate([self._lon, np.zeros(grow)])
+                self._speed = np.concatenate([self._speed, np.zeros(grow, dtype=np.float32)])
+                self._ts = np.concatenate([self._ts, np.zeros(grow)])
+                self._changed = np.concatenate([self._changed, np.zeros(grow, dtype=np.int64)])
+            self._fleet_loaded_at = time.monotonic()
+
+    def _ensure_started(self):
+        """Loads the fleet and starts the flusher once per process (and again after a fork)."""
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._pending, self._pending_rows = [], 0
+                    self._load_fleet()
+                    self._sync_from_db(force=True)
+                    self._flusher = threading.Thread(target=self._flush_loop, name='tracking-flush',
+                                                     daemon=True)
+                    self._flusher.start()
+                    self._pid = os.getpid()
+        elif time.monotonic() - self._fleet_loaded_at > self.fleet_refresh_interval:
+            self._load_fleet()
+
+    # -------------------------- Ingestion --------------------------
+
+    def _apply(self, vehicle_ids, lat, lon, speed, ts):
+        """Folds positions into the index, keeping only the newest fix per vehicle.
+
+        Returns a boolean mask of rows that belonged to a known vehicle.
+        """
+        slots = np.array([self._slots.get(v, -1) for v in vehicle_ids], dtype=np.int64)
+        known = slots >= 0
+        if not known.any():
+            return known
+        slots_k, ts_k = slots[known], ts[known]
+        # Sort by timestamp so the last write per slot is that vehicle's newest ping.
+        order = np.argsort(ts_k, kind='stable')
+        slots_k, ts_k = slots_k[order], ts_k[order]
+        newer = ts_k > self._ts[slots_k]
+        idx = np.flatnonzero(known)[order][newer]
+        self._lat[slots_k[newer]] = lat[idx]
+        self._lon[slots_k[newer]] = lon[idx]
+        self._speed[slots_k[newer]] = speed[idx]
+        self._ts[slots_k[newer]] = ts_k[newer]
+        if newer.any():
+            self._version += 1
+            self._changed[slots_k[newer]] = self._version
+        return known
+
+    def ingest(self, pings):
+        """Validates a batch of pings, updates the index and queues them for storage."""
+        self._ensure_started()
+        columns, errors = parse_pings(pings)
+        with self._lock:
+            known = self._apply(columns['vehicle_id'], columns['lat'], columns['lon'],
+                                columns['speed'], columns['ts'])
+            unknown = int((~known).sum())
+            if known.any():
+                batch = {k: v[known] for k, v in columns.items()}
+                self._pending.append(batch)
+                self._pending_rows += int(known.sum())
+            self.stats['pings_accepted'] += int(known.sum())
+            self.stats['pings_rejected'] += len(errors) + unknown
+        if self._pending_rows >= self.flush_batch_size:
+            self._flush_event.set()
+        if unknown:
+            errors.append(f'{unknown} pings for vehicles not in the fleet')
+        return {'accepted': int(known.sum()), 'rejected': len(pings) - int(known.sum()), 'errors': errors[:50]}
+
+    # -------------------------- Persistence --------------------------
+
+    def _flush_loop(self):
+        while True:
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.stats['flush_errors'] += 1
+                logger.exception('Error writing vehicle positions')
+
+    def flush(self):
+        """Writes queued pings to the history table and refreshes latest positions."""
+        with self._lock:
+            batches, self._pending, self._pending_rows = self._pending, [], 0
+        if not batches:
+            return 0
+        columns = {k: np.concatenate([b[k] for b in batches]) for k in batches[0]}
+        n = len(columns['ts'])
+
+        buffer = io.StringIO()
+        recorded_at = [datetime.fromtimestamp(t, tz=timezone.utc).isoformat() for t in columns['ts']]
+        # CSV quoting keeps a vehicle ID with a delimiter, quote or newline in one field.
+        writer = csv.writer(buffer)
+        for i in range(n):
+            writer.writerow((columns['vehicle_id'][i], recorded_at[i], float(columns['lat'][i]),
+                             float(columns['lon'][i]), float(columns['speed'][i])))
+        buffer.seek(0)
+
+        # Newest ping per vehicle in this batch: sort by time, keep each vehicle's last row.
+        order = np.argsort(columns['ts'], kind='stable')[::-1]
+        _, first = np.unique(columns['vehicle_id'][order], return_index=True)
+        latest = [(columns['vehicle_id'][i], recorded_at[i], float(columns['lat'][i]),
+                   float(columns['lon'][i]), float(columns['speed'][i])) for i in order[first]]
+
+        try:
+            with self.db_pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.copy_expert("""COPY vehicle_positions (vehicle_id, recorded_at, lat, lon, speed)
+                                       FROM STDIN WITH (FORMAT csv)""", buffer)
+                    execute_values(cur, """
+                        INSERT INTO vehicle_latest_positions (vehicle_id, recorded_at, lat, lon, speed)
+                        VALUES %s
+                        ON CONFLICT (vehicle_id) DO UPDATE SET
+                            recorded_at = EXCLUDED.recorded_at, lat = EXCLUDED.lat,
+                            lon = EXCLUDED.lon, speed = EXCLUDED.speed
+                        WHERE EXCLUDED.recorded_at > vehicle_latest_positions.recorded_at
+                    """, latest)
+                conn.commit()
+        except Exception:
+            # Keep the pings for the next attempt unless the backlog has grown too large.
+            with self._lock:
+                if self._pending_rows + n <= self.flush_batch_size * 20:
+                    self._pending[:0] = batches
+                    self._pending_rows += n
+            raise
+        self.stats['rows_written'] += n
+        self.stats['flushes'] += 1
+        return n
+
+    def _sync_from_db(self, force=False):
+        """Pulls fixes that other workers stored, at most once per `sync_interval`."""
+        if not force and time.monotonic() - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = time.monotonic()
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT vehicle_id, lat, lon, speed, EXTRACT(EPOCH FROM recorded_at)
+                    FROM vehicle_latest_positions
+                """)
+                rows = cur.fetchall()
+        if not rows:
+            return
+        with self._lock:
+            self._apply(np.array([r[0] for r in rows], dtype=object),
+                        np.array([r[1] for r in rows], dtype=np.float64),
+                        np.array([r[2] for r in rows], dtype=np.float64),
+                        np.array([r[3] or 0 for r in rows], dtype=np.float32),
+                        np.array([float(r[4]) for r in rows], dtype=np.float64))
+
+    # -------------------------- Queries --------------------------
+
+    def _rows(self, slots):
+        return [{
+            'vehicle_id': self._vehicle_ids[s],
+            'driver': self._drivers[s] or 'Unassigned',
+            'lat': round(float(self._lat[s]), 6),
+            'lon': round(float(self._lon[s]), 6),
+            'speed': round(float(self._speed[s]), 1),
+            'status': 'Moving' if self._speed[s] > MOVING_SPEED_KMPH else 'Idle',
+            'timestamp': float(self._ts[s]),
+            'last_updated': datetime.fromtimestamp(self._ts[s], tz=timezone.utc).isoformat(),
+        } for s in slots]
+
+    def positions(self, since=None):
+        """Latest fix of every vehicle (or only those updated after `since`, epoch seconds)."""
+        self._ensure_started()
+        self._sync_from_db()
+        with self._lock:
+            return self._rows(np.flatnonzero(self._ts > (since or 0)))
+
+    def changes(self, after_version=0):
+        """Vehicles whose fix changed after `after_version`; returns (rows, current_version).
+
+        Versions count index updates rather than ping timestamps, so a late ping
+        that is still the newest for its vehicle is never missed.
+        """
+        self._ensure_started()
+        self._sync_from_db()
+        with self._lock:
+            return self._rows(np.flatnonzero(self._changed > after_version)), self._version
+
+    def coordinates(self):
+        """Arrays of every vehicle with a fix; returns (vehicle_ids, drivers, latlon, version)."""
+        self._ensure_started()
+        self._sync_from_db()
+        with self._lock:
+            slots = np.flatnonzero(self._ts > 0)
+            return ([self._vehicle_ids[s] for s in slots], [self._drivers[s] for s in slots],
+                    np.column_stack([self._lat[slots], self._lon[slots]]), self._version)
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats, vehicles=len(self._vehicle_ids), pending_rows=self._pending_rows)
@@ -0,0 +1,148 @@
+# --------------------------------------------------------------------------------------
+# Server-Sent Events fan-out for the live tracking dashboard.
+# One broadcaster thread per worker process polls the in-memory tracking index at a
+# fixed rate and publishes the vehicles that moved since its last tick as one
+# coalesced frame. Every connected dashboard reads frames from a shared ring buffer,
+# so the cost of a tick does not grow with the number of clients; a client that
+# falls behind the ring is sent a fresh snapshot instead.
+# --------------------------------------------------------------------------------------
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# How long browsers wait before reconnecting a dropped stream.
+RECONNECT_MS = 3000
+
+
+class TooManyClientsError(Exception):
+    """Raised when a worker already serves its maximum number of streams."""
+
+
+def format_event(event, data):
+    """Encodes one SSE message."""
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+class PositionBroadcaster:
+    """Publishes coalesced position deltas from a TrackingStore to SSE subscribers."""
+
+    def __init__(self, store, interval=1.0, keepalive=15.0, max_clients=80, ring_size=120):
+        self.store = store
+        self.interval = interval
+        self.keepalive = keepalive
+        self.max_clients = max_clients
+        self._frames = deque(maxlen=ring_size)   # (frame_no, {vehicle_id: row})
+        self._frame_no = 0
+        self._store_version = 0
+        self._clients = 0
+        self._cond = threading.Condition()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.stats = {'ticks': 0, 'frames': 0, 'vehicles_sent': 0, 'snapshots': 0, 'connections': 0}
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                # Threads do not survive a fork, so each gunicorn worker starts its own.
+                self._frames.clear()
+                self._clients = 0
+                _, self._store_version = self.store.changes(after_version=2 ** 62)
+                self._thread = threading.Thread(target=self._run, name='tracking-stream', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self._tick()
+            except Exception:
+                logger.exception('Tracking stream tick failed')
+
+    def _tick(self):
+        """Publishes every vehicle that moved since the previous tick as one frame."""
+        self.stats['ticks'] += 1
+        if not self._clients:
+            # Nobody is listening; just move the cursor forward.
+            _, self._store_version = self.store.changes(after_version=2 ** 62)
+            return
+        rows, self._store_version = self.store.changes(after_version=self._store_version)
+        if not rows:
+            return
+        with self._cond:
+            self._frame_no += 1
+            self._frames.append((self._frame_no, {row['vehicle_id']: row for row in rows}))
+            self.stats['frames'] += 1
+            self.stats['vehicles_sent'] += len(rows)
+            self._cond.notify_all()
+
+    def _pending(self, after):
+        """Merges frames newer than `after`; returns (rows, last_frame_no) or None if `after` fell off the ring."""
+        if not self._frames or self._frame_no <= after:
+            return [], after
+        if self._frames[0][0] > after + 1:
+            return None
+        merged = {}
+        for frame_no, frame in self._frames:
+            if frame_no > after:
+                merged.update(frame)
+        return list(merged.values()), self._frame_no
+
+    def subscribe(self):
+        """Returns a generator of SSE messages for one client.
+
+        Raises TooManyClientsError when the worker is at `max_clients`. The client
+        takes a slot only once the generator runs, so a response body that is never
+        iterated (a HEAD request, a client gone before the first chunk) holds none.
+        """
+        self._ensure_started()
+        with self._cond:
+            if self._clients >= self.max_clients:
+                raise TooManyClientsError(f'At most {self.max_clients} live streams per worker')
+        return self._stream()
+
+    def _stream(self):
+        with self._cond:
+            full = self._clients >= self.max_clients
+            if not full:
+                self._clients += 1
+                self.stats['connections'] += 1
+                cursor = self._frame_no
+        if full:
+            # Another stream took the last slot since subscribe() checked; the browser retries later.
+            yield f'retry: {RECONNECT_MS}\n\n'
+            return
+        try:
+            yield f'retry: {RECONNECT_MS}\n\n'
+            yield format_event('snapshot', {'positions': self.store.positions()})
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._frame_no > cursor, timeout=self.keepalive)
+                    pending = self._pending(cursor)
+                    latest = self._frame_no
+                if pending is None:
+                    self.stats['snapshots'] += 1
+                    cursor = latest
+                    yield format_event('snapshot', {'positions': self.store.positions()})
+                elif pending[0]:
+                    rows, cursor = pending
+                    yield format_event('positions', {'positions': rows})
+                else:
+                    # Comment line: keeps proxies from closing an idle connection.
+                    yield ': keepalive\n\n'
+        finally:
+            with self._cond:
+                self._clients -= 1
+
+    def metrics(self):
+        return {**self.stats, 'clients': self._clients, 'interval': self.interval,
+                'frames_buffered': len(self._frames)}
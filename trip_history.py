@@ -0,0 +1,349 @@
+# --------------------------------------------------------------------------------------
+# Trip history for the TMS application.
+# A background segmenter reads new GPS pings from `vehicle_positions`, splits each
+# vehicle's track into trips wherever it stood still (or went silent) for longer than
+# a stop threshold, and stores one row per trip in `vehicle_trips`. That table is range
+# partitioned by day on the trip start time and carries a Douglas-Peucker simplified
+# path, so a month of trips for one vehicle is an index range scan over ~30 small
+# partitions that returns a few hundred points per trip instead of every ping.
+# --------------------------------------------------------------------------------------
+
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from psycopg2.extras import Json, execute_values
+
+from distance_matrix import EARTH_RADIUS_KM
+from tracking_store import MOVING_SPEED_KMPH
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary key for pg_try_advisory_lock so only one worker segments at a time.
+SEGMENTER_LOCK_KEY = 7310412
+# Pings read per fetch from the server-side cursor; whole vehicles are committed per batch.
+DEFAULT_BATCH_PINGS = 50_000
+METERS_PER_DEGREE = 111320.0
+
+
+def create_trip_tables(cur):
+    """Creates the day-partitioned trip table and the segmenter's per-vehicle watermark."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS vehicle_trips (
+            vehicle_id VARCHAR(50) NOT NULL,
+            driver_id VARCHAR(50),
+            started_at TIMESTAMPTZ NOT NULL,
+            ended_at TIMESTAMPTZ NOT NULL,
+            distance_km DOUBLE PRECISION NOT NULL,
+            max_speed REAL,
+            start_lat DOUBLE PRECISION NOT NULL,
+            start_lon DOUBLE PRECISION NOT NULL,
+            end_lat DOUBLE PRECISION NOT NULL,
+            end_lon DOUBLE PRECISION NOT NULL,
+            raw_points INTEGER NOT NULL,
+            path JSONB NOT NULL,
+            PRIMARY KEY (vehicle_id, started_at)
+        ) PARTITION BY RANGE (started_at);
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_vehicle_trips_driver_time
+        ON vehicle_trips (driver_id, started_at)
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS trip_segmentation_state (
+            vehicle_id VARCHAR(50) PRIMARY KEY,
+            next_from TIMESTAMPTZ NOT NULL
+        );
+    """)
+
+
+def ensure_day_partitions(cur, days):
+    """Creates the daily `vehicle_trips` partitions (UTC days) that do not exist yet."""
+    for day in sorted(set(days)):
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS vehicle_trips_{day:%Y%m%d}
+            PARTITION OF vehicle_trips
+            FOR VALUES FROM ('{day:%Y-%m-%d} 00:00+00') TO ('{day + timedelta(days=1):%Y-%m-%d} 00:00+00')
+        """)
+
+
+# -------------------------- Geometry --------------------------
+
+def step_distances_km(lat, lon):
+    """Haversine distance between consecutive points; returns len(lat) - 1 values."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    h = (np.sin(np.diff(lat) / 2) ** 2
+         + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def douglas_peucker(lat, lon, tolerance_m):
+    """Boolean mask of the points Douglas-Peucker keeps at `tolerance_m` metres.
+
+    Points are projected onto a local equirectangular plane; the recursion is
+    run with an explicit stack so long tracks cannot hit the recursion limit.
+    """
+    n = len(lat)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    xy = np.column_stack([np.asarray(lon) * math.cos(math.radians(float(np.mean(lat)))),
+                          np.asarray(lat)]) * METERS_PER_DEGREE
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        seg = xy[end] - xy[start]
+        pts = xy[start + 1:end] - xy[start]
+        seg_len2 = float(seg @ seg)
+        t = np.clip(pts @ seg / seg_len2, 0.0, 1.0) if seg_len2 > 0 else np.zeros(len(pts))
+        dist = np.hypot(pts[:, 0] - t * seg[0], pts[:, 1] - t * seg[1])
+        i = int(dist.argmax())
+        if dist[i] > tolerance_m:
+            split = start + 1 + i
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
+
+def segment_trips(ts, lat, lon, speed, min_stop_seconds):
+    """Splits one vehicle's time-ordered pings into trips; returns a list of (start, end) slices.
+
+    A ping counts as moving when its reported speed (or, without one, the speed
+    implied by the previous ping) is above MOVING_SPEED_KMPH. Consecutive moving
+    pings more than `min_stop_seconds` apart belong to different trips, which
+    covers both a parked vehicle and a gap in the feed.
+    """
+    if len(ts) < 2:
+        return []
+    implied = np.zeros(len(ts))
+    elapsed = np.diff(ts)
+    implied[1:] = np.where(elapsed > 0, step_distances_km(lat, lon) / np.maximum(elapsed, 1e-9) * 3600, 0)
+    moving = np.where(np.isnan(speed), implied, speed) > MOVING_SPEED_KMPH
+    idx = np.flatnonzero(moving)
+    if len(idx) < 2:
+        return []
+    breaks = np.flatnonzero(np.diff(ts[idx]) > min_stop_seconds)
+    trips = []
+    for first, last in zip(np.r_[0, breaks + 1], np.r_[breaks, len(idx) - 1]):
+        # Start from the last stationary fix before the trip, so its start point is
+        # where the vehicle was parked rather than its first position on the move.
+        start = idx[first] - 1 if idx[first] > 0 and ts[idx[first]] - ts[idx[first] - 1] <= min_stop_seconds \
+            else idx[first]
+        end = idx[last] + 1
+        if end - start >= 2:
+            trips.append((start, end))
+    return trips
+
+
+# -------------------------- Segmenter --------------------------
+
+class TripSegmenter:
+    """Turns stored GPS pings into `vehicle_trips` rows on a background schedule."""
+
+    def __init__(self, db_pool, interval=300.0, min_stop_seconds=300.0, min_distance_km=0.2,
+                 tolerance_m=15.0, batch_size=DEFAULT_BATCH_PINGS):
+        self.db_pool = db_pool
+        self.interval = interval
+        self.min_stop_seconds = min_stop_seconds
+        self.min_distance_km = min_distance_km
+        self.tolerance_m = tolerance_m
+        self.batch_size = batch_size
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self.stats = {'runs': 0, 'skipped_runs': 0, 'batches': 0, 'pings_read': 0, 'trips_written': 0,
+                      'points_kept': 0, 'errors': 0, 'last_run_seconds': None}
+
+    def ensure_running(self):
+        """Starts the background segmenter once per process (and again after a fork)."""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._run, name='trip-segmenter', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.segment()
+            except Exception:
+                self.stats['errors'] += 1
+                logger.exception('Error segmenting trips')
+
+    def segment(self, cutoff=None):
+        """Segments pings recorded before `cutoff` (default now); returns trips written.
+
+        Trips still in progress at the cutoff are left for the next run, which
+        re-reads the vehicle's pings from that trip's first fix. Pings are streamed
+        through a server-side cursor on a second connection and processed a batch
+        of whole vehicles at a time; each batch's trips and watermarks are committed
+        before the next is read, so a backlog never has to fit in memory at once.
+        """
+        started = time.perf_counter()
+        cutoff = cutoff or datetime.now(timezone.utc)
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (SEGMENTER_LOCK_KEY,))
+                if not cur.fetchone()[0]:
+                    # Another worker is already segmenting.
+                    conn.rollback()
+                    self.stats['skipped_runs'] += 1
+                    return 0
+            try:
+                written = self._segment_locked(conn, cutoff)
+            finally:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (SEGMENTER_LOCK_KEY,))
+                conn.commit()
+
+        self.stats['runs'] += 1
+        self.stats['last_run_seconds'] = round(time.perf_counter() - started, 3)
+        return written
+
+    def _segment_locked(self, conn, cutoff):
+        with conn.cursor() as cur:
+            cur.execute("SELECT vehicle_id, driver_id FROM fleet")
+            drivers = dict(cur.fetchall())
+        conn.commit()
+
+        written, buffered, threshold = 0, [], self.batch_size
+        with self.db_pool.connection() as read_conn:
+            with read_conn.cursor(name='trip_segmenter_pings') as pings:
+                pings.itersize = self.batch_size
+                pings.execute("""
+                    SELECT p.vehicle_id, EXTRACT(EPOCH FROM p.recorded_at), p.lat, p.lon, p.speed
+                    FROM vehicle_positions AS p
+                    LEFT JOIN trip_segmentation_state AS s ON s.vehicle_id = p.vehicle_id
+                    WHERE p.recorded_at >= COALESCE(s.next_from, '-infinity')
+                      AND p.recorded_at < %s
+                    ORDER BY p.vehicle_id, p.recorded_at
+                """, (cutoff,))
+                while True:
+                    rows = pings.fetchmany(self.batch_size)
+                    self.stats['pings_read'] += len(rows)
+                    buffered.extend(rows)
+                    if not rows:
+                        break
+                    if len(buffered) < threshold:
+                        continue
+                    # The last vehicle may have more pings in the next fetch.
+                    split = len(buffered) - 1
+                    while split > 0 and buffered[split - 1][0] == buffered[-1][0]:
+                        split -= 1
+                    if split > 0:
+                        written += self._write_batch(conn, buffered[:split], drivers, cutoff.timestamp())[0]
+                        buffered = buffered[split:]
+                        threshold = self.batch_size
+                    else:
+                        # One vehicle fills the batch: settle its finished trips and keep
+                        # only the pings of the trip still open at its latest fix.
+                        count, watermarks = self._write_batch(conn, buffered, drivers, float(buffered[-1][1]))
+                        written += count
+                        buffered = [r for r in buffered if float(r[1]) >= watermarks[0][1]]
+                        threshold = max(self.batch_size, 2 * len(buffered))
+            read_conn.commit()
+        if buffered:
+            written += self._write_batch(conn, buffered, drivers, cutoff.timestamp())[0]
+        return written
+
+    def _write_batch(self, conn, rows, drivers, cutoff_ts):
+        """Segments and stores one batch of pings and commits; returns (trips written, watermark rows)."""
+        trips, watermarks = self._build_trips(rows, drivers, cutoff_ts)
+        with conn.cursor() as cur:
+            if trips:
+                ensure_day_partitions(cur, [datetime.fromtimestamp(t[2], tz=timezone.utc).date()
+                                            for t in trips])
+                execute_values(cur, """
+                    INSERT INTO vehicle_trips (
+                        vehicle_id, driver_id, started_at, ended_at, distance_km, max_speed,
+                        start_lat, start_lon, end_lat, end_lon, raw_points, path
+                    ) VALUES %s
+                    ON CONFLICT (vehicle_id, started_at) DO NOTHING
+                """, trips, template="(%s, %s, to_timestamp(%s), to_timestamp(%s), %s, %s, %s, %s, %s, %s, %s, %s)")
+            if watermarks:
+                execute_values(cur, """
+                    INSERT INTO trip_segmentation_state (vehicle_id, next_from) VALUES %s
+                    ON CONFLICT (vehicle_id) DO UPDATE SET next_from = EXCLUDED.next_from
+                """, watermarks, template="(%s, to_timestamp(%s))")
+        conn.commit()
+        self.stats['trips_written'] += len(trips)
+        self.stats['batches'] += 1
+        return len(trips), watermarks
+
+    def _build_trips(self, rows, drivers, cutoff_ts):
+        """Segments fetched rows vehicle by vehicle; returns (trip rows, watermark rows)."""
+        if not rows:
+            return [], []
+        vehicle_ids = np.array([r[0] for r in rows], dtype=object)
+        ts = np.array([float(r[1]) for r in rows])
+        lat = np.array([r[2] for r in rows], dtype=np.float64)
+        lon = np.array([r[3] for r in rows], dtype=np.float64)
+        speed = np.array([np.nan if r[4] is None else r[4] for r in rows], dtype=np.float64)
+        bounds = np.flatnonzero(vehicle_ids[1:] != vehicle_ids[:-1]) + 1
+
+        trips, watermarks = [], []
+        for s, e in zip(np.r_[0, bounds], np.r_[bounds, len(rows)]):
+            vehicle_id = vehicle_ids[s]
+            next_from = cutoff_ts
+            for start, end in segment_trips(ts[s:e], lat[s:e], lon[s:e], speed[s:e], self.min_stop_seconds):
+                t_lat, t_lon = lat[s + start:s + end], lon[s + start:s + end]
+                t_ts = ts[s + start:s + end]
+                if cutoff_ts - t_ts[-1] <= self.min_stop_seconds:
+                    # The vehicle may still be moving; revisit this trip next run.
+                    next_from = t_ts[0]
+                    break
+                distance_km = float(step_distances_km(t_lat, t_lon).sum())
+                if distance_km < self.min_distance_km:
+                    # GPS drift while parked, not a trip.
+                    continue
+                keep = douglas_peucker(t_lat, t_lon, self.tolerance_m)
+                path = np.round(np.column_stack([t_lat[keep], t_lon[keep]]), 6).tolist()
+                t_speed = speed[s + start:s + end]
+                self.stats['points_kept'] += len(path)
+                trips.append((
+                    vehicle_id, drivers.get(vehicle_id), float(t_ts[0]), float(t_ts[-1]),
+                    round(distance_km, 3),
+                    None if np.isnan(t_speed).all() else float(np.nanmax(t_speed)),
+                    float(t_lat[0]), float(t_lon[0]), float(t_lat[-1]), float(t_lon[-1]),
+                    int(end - start), Json(path),
+                ))
+            watermarks.append((vehicle_id, float(next_from)))
+        return trips, watermarks
+
+
+# -------------------------- Queries --------------------------
+
+def fetch_trips(cur, start, end, vehicle_id=None, driver_id=None, limit=1000):
+    """Trips that started in [start, end), newest first, with their simplified paths."""
+    clauses, params = ['started_at >= %s', 'started_at < %s'], [start, end]
+    if vehicle_id:
+        clauses.append('vehicle_id = %s')
+        params.append(vehicle_id)
+    if driver_id:
+        clauses.append('driver_id = %s')
+        params.append(driver_id)
+    cur.execute(f"""
+        SELECT vehicle_id, driver_id, started_at, ended_at, distance_km, max_speed,
+               start_lat, start_lon, end_lat, end_lon, raw_points, path
+        FROM vehicle_trips
+        WHERE {' AND '.join(clauses)}
+        ORDER BY started_at DESC
+        LIMIT %s
+    """, params + [limit])
+    trips = []
+    for row in cur.fetchall():
+        trip = dict(row)
+        hours = (trip['ended_at'] - trip['started_at']).total_seconds() / 3600
+        trip['duration_hrs'] = round(hours, 2)
+        trip['avg_speed'] = round(trip['distance_km'] / hours, 1) if hours > 0 else 0.0
+        trips.append(trip)
+    return trips